@@ -0,0 +1,77 @@
+"""
+Offline analytics over one client's dive log: pretty-printed JSON array (the old dive_log_<uuid>.json), JSON
+Lines (log_store) and the memory-mapped columnar format (columnar_log).
+
+Each format answers the same query, the mean depth and the maximum ppO₂ of the entries deeper than 30 m, from
+a cold open of the file.
+
+    python benchmarks/bench_columnar_log.py [entries...]    (default: 10000 100000 1000000)
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import columnar_log  # noqa: E402
+import log_store  # noqa: E402
+from bench_log_storage import make_entries  # noqa: E402
+
+
+def query_json(path):
+    with open(path, "r", encoding="utf-8") as file:
+        entries = json.load(file)
+    deep = [entry for entry in entries if entry["depth"] > 30]
+    return sum(entry["depth"] for entry in deep) / len(deep), max(entry["oxygen_toxicity"] for entry in deep)
+
+
+def query_ndjson(path):
+    count, depth_sum, ppo2 = 0, 0.0, 0.0
+    for entry in log_store.iter_entries(path):
+        if entry["depth"] > 30:
+            count += 1
+            depth_sum += entry["depth"]
+            ppo2 = max(ppo2, entry["oxygen_toxicity"])
+    return depth_sum / count, ppo2
+
+
+def query_columnar(path):
+    log = columnar_log.ColumnarLog(path)
+    depth = log.column("depth")
+    deep = depth > 30
+    return float(depth[deep].mean()), float(log.column("oxygen_toxicity")[deep].max())
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000]
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="divalgo-bench-")
+        try:
+            entries = make_entries(size)
+            json_path = os.path.join(directory, "dive_log_bench.json")
+            with open(json_path, "w", encoding="utf-8") as file:
+                json.dump(entries, file, indent=4)
+            ndjson_path = os.path.join(directory, "bench.ndjson")
+            log_store.append_entries(ndjson_path, entries)
+            columnar_path, _ = columnar_log.convert(json_path)
+
+            print(f"\n{size} entries")
+            print(f"{'format':<10} {'file size':>12} {'query':>12}")
+            for name, path, query in (("json", json_path, query_json), ("ndjson", ndjson_path, query_ndjson),
+                                      ("columnar", columnar_path, query_columnar)):
+                started = time.perf_counter()
+                result = query(path)
+                elapsed = (time.perf_counter() - started) * 1e3
+                print(f"{name:<10} {os.path.getsize(path) / 1e6:>9.1f} MB {elapsed:>9.1f} ms"
+                      f"  (mean depth {result[0]:.2f} m, max ppO₂ {np.float32(result[1]):.2f})")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Latency of a full ZH-L16C decompression schedule (decompression.ZHL16C.schedule).
+
+/api/v1/calculate_ndl_stops and /api/v1/decompression_stops build one schedule
+per call, so this is the per-request cost of the deco engine. Each profile is
+a descent at 18 m/min, a bottom phase on one gas and an ascent with GF 30/85.
+
+    python benchmarks/bench_decompression.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from decompression import ZHL16C  # noqa: E402
+
+PROFILES = [
+    # name, depth (m), bottom time (min), N₂ fraction, He fraction
+    ("air 18 m / 40 min", 18, 40, 0.79, 0.0),
+    ("air 30 m / 25 min", 30, 25, 0.79, 0.0),
+    ("air 40 m / 30 min", 40, 30, 0.79, 0.0),
+    ("trimix 18/45 60 m / 20 min", 60, 20, 0.45, 0.37),
+    ("trimix 15/50 100 m / 25 min", 100, 25, 0.35, 0.50),
+]
+
+
+def main():
+    model = ZHL16C()
+    print(f"{'profile':<30} {'stops':>6} {'TTS min':>9} {'per call':>12}")
+    for name, depth, bottom_time, nitrogen_fraction, helium_fraction in PROFILES:
+        nitrogen, helium = model.surface_tensions()
+        nitrogen, helium = model.travel(nitrogen, helium, 0, depth, nitrogen_fraction, helium_fraction, 18.0)
+        nitrogen, helium = model.load(nitrogen, helium, depth, nitrogen_fraction, helium_fraction, bottom_time)
+
+        def build():
+            return model.schedule(nitrogen, helium, depth, nitrogen_fraction, helium_fraction, 0.30, 0.85)
+
+        schedule = build()
+        per_call_ms = min(timeit.repeat(build, number=50, repeat=5)) / 50 * 1e3
+        print(f"{name:<30} {len(schedule['stops']):>6} {schedule['time_to_surface']:>9.1f} {per_call_ms:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
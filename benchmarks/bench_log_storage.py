@@ -0,0 +1,94 @@
+"""
+Dive log storage backends: NDJSON files (log_store.NDJSONLogStore) against SQLite (sqlite_log_store.SQLiteLogStore).
+
+For each size the log is spread over CLIENTS clients and written twice, once
+one entry per call (what save_dive_log does per dive step) on a sample of the
+entries, and once in batches of BATCH entries. Reads load one client's log
+and, the query that motivates SQLite, every entry deeper than 30 m across all
+clients.
+
+    python benchmarks/bench_log_storage.py [sizes...]    (default: 10000 100000 1000000)
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from log_store import NDJSONLogStore  # noqa: E402
+from sqlite_log_store import SQLiteLogStore  # noqa: E402
+
+CLIENTS = 100
+BATCH = 1000
+SINGLE_APPENDS = 2000  # Entries timed one call at a time per size
+
+
+def make_entries(count, seed=0):
+    rng = random.Random(seed)
+    entries = []
+    for i in range(count):
+        depth = rng.choice((0, 10, 20, 30, 40, 50))
+        entries.append({
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1700000000 + i)),
+            "depth": depth, "pressure": 1 + depth / 10, "oxygen_toxicity": round(0.21 * (1 + depth / 10), 2),
+            "ndl": rng.uniform(5, 200), "rgbm_factor": rng.uniform(0.8, 1.2), "total_time": i,
+            "time_at_depth": rng.uniform(0, 600)
+        })
+    return entries
+
+
+def deep_entries(store, clients):
+    return sum(1 for client in clients for entry in store.iter_entries(client) if entry["depth"] > 30)
+
+
+def deep_entries_sqlite(store):
+    return store._connection().execute("SELECT COUNT(*) FROM dive_log WHERE depth > 30").fetchone()[0]
+
+
+def run(name, store, entries, clients):
+    per_client = {client: entries[i::len(clients)] for i, client in enumerate(clients)}
+
+    started = time.perf_counter()
+    for entry in entries[:SINGLE_APPENDS]:
+        store.append(clients[0], entry)
+    single = (time.perf_counter() - started) / SINGLE_APPENDS * 1e6
+
+    started = time.perf_counter()
+    for client, client_entries in per_client.items():
+        for start in range(0, len(client_entries), BATCH):
+            store.append_many(client, client_entries[start:start + BATCH])
+    batched = (time.perf_counter() - started) / len(entries) * 1e6
+
+    started = time.perf_counter()
+    count = sum(1 for _ in store.iter_entries(clients[1]))
+    read_one = (time.perf_counter() - started) * 1e3
+
+    started = time.perf_counter()
+    deep = deep_entries_sqlite(store) if isinstance(store, SQLiteLogStore) else deep_entries(store, clients)
+    query = (time.perf_counter() - started) * 1e3
+    print(f"{name:<8} {single:>10.1f} µs {batched:>10.2f} µs {read_one:>9.1f} ms ({count} entries)"
+          f" {query:>10.1f} ms ({deep} deep)")
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000]
+    clients = [f"client-{i:03d}" for i in range(CLIENTS)]
+    for size in sizes:
+        entries = make_entries(size)
+        print(f"\n{size} entries over {CLIENTS} clients")
+        print(f"{'backend':<8} {'append/call':>13} {'append/batch':>13} {'read one client':>26} {'depth > 30 m, all':>24}")
+        directory = tempfile.mkdtemp(prefix="divalgo-bench-")
+        try:
+            run("ndjson", NDJSONLogStore(os.path.join(directory, "logs")), entries, clients)
+            sqlite_store = SQLiteLogStore(os.path.join(directory, "dive_logs.sqlite3"))
+            run("sqlite", sqlite_store, entries, clients)
+            sqlite_store.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
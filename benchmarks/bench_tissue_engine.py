@@ -0,0 +1,134 @@
+"""
+Per-call cost of the Bühlmann tissue math before and after the NumPy engine.
+
+The "before" functions are the pure-Python compartment loops that main.py used
+to run; the "after" calls go through tissue_engine.TissueModel. Each pair is
+checked for identical results before it is timed.
+
+    python benchmarks/bench_tissue_engine.py
+"""
+import math
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tissue_engine import TissueModel  # noqa: E402
+
+buhlmann_tissues = [
+    {"tissue": 1, "half_time": 4, "M-value": 1.57},
+    {"tissue": 2, "half_time": 8, "M-value": 1.42},
+    {"tissue": 3, "half_time": 12.5, "M-value": 1.34},
+    {"tissue": 4, "half_time": 18.5, "M-value": 1.28},
+    {"tissue": 5, "half_time": 27, "M-value": 1.23},
+    {"tissue": 6, "half_time": 38.3, "M-value": 1.20},
+    {"tissue": 7, "half_time": 54.3, "M-value": 1.17},
+    {"tissue": 8, "half_time": 77, "M-value": 1.14},
+    {"tissue": 9, "half_time": 109, "M-value": 1.11},
+    {"tissue": 10, "half_time": 146, "M-value": 1.08}
+]
+model = TissueModel(buhlmann_tissues)
+
+
+def legacy_update(tissue_state, inert_gas_pressure, dt_min):
+    for tissue in buhlmann_tissues:
+        tissue_id = tissue["tissue"]
+        k = math.log(2) / tissue["half_time"]
+        p_old = tissue_state[tissue_id]
+        tissue_state[tissue_id] = inert_gas_pressure + (p_old - inert_gas_pressure) * math.exp(-k * dt_min)
+
+
+def legacy_tension_ndl(tissue_state, depth):
+    surface_pressure = 1.0
+    ambient_pressure = surface_pressure + (depth / 10)
+    ndl_values = []
+    for tissue in buhlmann_tissues:
+        k = math.log(2) / tissue["half_time"]
+        max_tension = tissue.get("M-value", 1.0) * surface_pressure
+        numerator = ambient_pressure - max_tension
+        denominator = ambient_pressure - tissue_state[tissue["tissue"]]
+        if denominator <= 0:
+            ndl = 0
+        else:
+            try:
+                ndl = -1 / k * math.log(numerator / denominator)
+            except Exception:
+                ndl = 0
+        ndl_values.append(ndl)
+    negatives = [ndl for ndl in ndl_values if ndl < 0]
+    return sum(negatives) if negatives else min(ndl_values)
+
+
+def legacy_constant_depth_ndl(depth, time_at_depth_minutes, inert_gas_fraction):
+    inert_gas_pressure = (1.0 + depth / 10) * inert_gas_fraction
+    ndl = float("inf")
+    for tissue in buhlmann_tissues:
+        k = math.log(2) / tissue["half_time"]
+        log_arg = 1 - (tissue["M-value"] / inert_gas_pressure)
+        if log_arg <= 0:
+            continue
+        ndl = min(ndl, (math.log(log_arg) / -k) - time_at_depth_minutes)
+    return ndl
+
+
+def per_call_us(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def report(name, before, after):
+    print(f"{name:<44} {before:>10.2f} us {after:>10.2f} us {before / after:>8.1f}x")
+
+
+def main():
+    inert_gas_pressure = 4.0 * 0.79
+    dt_min = 1 / 60
+
+    # Results must match before timing anything.
+    legacy_state = {tissue["tissue"]: 0.0 for tissue in buhlmann_tissues}
+    tensions = model.new_tensions()
+    for _ in range(30):
+        legacy_update(legacy_state, inert_gas_pressure, 1.0)
+        tensions = model.haldane(tensions, inert_gas_pressure, 1.0)
+    assert np.allclose(list(legacy_state.values()), tensions)
+    for depth in (0, 10, 30, 60):
+        assert math.isclose(legacy_tension_ndl(legacy_state, depth), float(model.tension_ndl(tensions, depth)),
+                            rel_tol=1e-9, abs_tol=1e-9)
+        assert math.isclose(legacy_constant_depth_ndl(depth + 1, 5, 0.79),
+                            float(model.constant_depth_ndl(depth + 1, 5, 0.79)[0]), rel_tol=1e-9)
+
+    print(f"{'operation':<44} {'before':>13} {'after':>13} {'speedup':>9}")
+    report("tissue update, 1 session",
+           per_call_us(lambda: legacy_update(legacy_state, inert_gas_pressure, dt_min), 20000),
+           per_call_us(lambda: model.haldane(tensions, inert_gas_pressure, dt_min), 20000))
+    report("NDL from tensions, 1 session",
+           per_call_us(lambda: legacy_tension_ndl(legacy_state, 30), 20000),
+           per_call_us(lambda: model.tension_ndl(tensions, 30), 20000))
+    report("constant-depth NDL, 1 query",
+           per_call_us(lambda: legacy_constant_depth_ndl(30, 5, 0.79), 20000),
+           per_call_us(lambda: model.constant_depth_ndl(30, 5, 0.79), 20000))
+
+    for count in (100, 1000, 10000):
+        legacy_states = [dict(legacy_state) for _ in range(count)]
+        block = np.tile(tensions, (count, 1))
+        pressures = np.full(count, inert_gas_pressure)
+        dts = np.full(count, dt_min)
+        depths = np.linspace(1, 60, count)
+        number = max(1, 20000 // count)
+
+        def legacy_many():
+            for state in legacy_states:
+                legacy_update(state, inert_gas_pressure, dt_min)
+
+        report(f"tissue update, {count} sessions",
+               per_call_us(legacy_many, number),
+               per_call_us(lambda: model.haldane(block, pressures, dts), number))
+        report(f"constant-depth NDL, {count} queries",
+               per_call_us(lambda: [legacy_constant_depth_ndl(d, 5, 0.79) for d in depths], number),
+               per_call_us(lambda: model.constant_depth_ndl(depths, 5, 0.79), number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Columnar binary dive log files for offline analytics.
+
+Parsing months of JSON logs spends most of its time on repeated string keys
+and number parsing. A `.dlog` file holds one client's log as fixed-width
+columns instead:
+
+    magic (8 bytes) | header length (uint32, little-endian) | JSON header | columns
+
+The header lists each column's dtype, byte offset and encoding. Every column
+starts on a 64-byte boundary, so `ColumnarLog` memory-maps the file and hands
+out each plain column as a read-only NumPy view of the mapping, without
+copying or parsing anything; reading one column only touches that column's
+pages.
+
+`total_time` is delta-encoded: the header keeps the first value in hundredths
+of a second and the column holds int32 differences, half the width of a
+float64 column. Values are rounded to 0.01 s (the resolution the server logs
+at). A log whose total times are missing or jump by more than an int32 of
+hundredths falls back to a plain float64 column.
+
+Keys other than the standard log fields are not stored; the header lists
+them under "omitted_keys". `python columnar_log.py <log files or
+directories>...` converts `.json` (array) and `.ndjson` logs next to the
+originals.
+"""
+import json
+import os
+import struct
+import sys
+from datetime import datetime
+
+import numpy as np
+
+import log_store
+
+FORMAT_VERSION = 1
+MAGIC = b"DIVELOG\x00"
+COLUMNAR_SUFFIX = ".dlog"
+ALIGNMENT = 64
+TIME_SCALE = 100  # Delta-encoded total_time is stored in hundredths
+
+# Log entry key and the dtype of its column; timestamps are datetime64 seconds with NaT for missing ones
+COLUMNS = (
+    ("timestamp", "datetime64[s]"),
+    ("depth", "<f8"),
+    ("pressure", "<f4"),
+    ("oxygen_toxicity", "<f4"),
+    ("ndl", "<f4"),
+    ("rgbm_factor", "<f4"),
+    ("total_time", "<f8"),
+    ("time_at_depth", "<f8"),
+)
+DELTA_COLUMNS = ("total_time",)
+
+_LENGTH = struct.Struct("<I")
+
+
+class ColumnarLog:
+    """A memory-mapped `.dlog` file; `column` returns zero-copy views of its plain columns."""
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a columnar dive log")
+        start = len(MAGIC) + _LENGTH.size
+        (length,) = _LENGTH.unpack(bytes(self._buffer[len(MAGIC):start]))
+        self.header = json.loads(bytes(self._buffer[start:start + length]).decode("utf-8"))
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported columnar log version {self.header['format_version']}")
+        self._columns = {column["name"]: column for column in self.header["columns"]}
+
+    def __len__(self):
+        return self.header["count"]
+
+    @property
+    def names(self):
+        return tuple(self._columns)
+
+    def raw(self, name):
+        """The column as stored (int32 deltas for a delta-encoded one), as a read-only view of the file."""
+        column = self._columns[name]
+        dtype = np.dtype(column["dtype"])
+        start = column["offset"]
+        return self._buffer[start:start + dtype.itemsize * len(self)].view(dtype)
+
+    def column(self, name):
+        """The column's values; zero-copy unless the column is delta-encoded, which is decoded into a new array."""
+        column = self._columns[name]
+        values = self.raw(name)
+        if column["encoding"] == "delta":
+            return (column["base"] + np.cumsum(values, dtype=np.int64)) / column["scale"]
+        return values
+
+    def entries(self):
+        """Yield the entries back as dicts, with None for missing values."""
+        columns = [(name, self.column(name)) for name in self.names]
+        for i in range(len(self)):
+            entry = {}
+            for name, values in columns:
+                value = values[i]
+                if name == "timestamp":
+                    entry[name] = None if np.isnat(value) else str(value).replace("T", " ")
+                elif np.isnan(value):
+                    entry[name] = None
+                else:
+                    # str() of a float32 is its shortest repr, so 0.21 comes back as 0.21 rather than 0.2099999934
+                    entry[name] = float(str(value)) if values.dtype == np.float32 else value.item()
+            yield entry
+
+
+def write(path, entries, client_uuid=None):
+    """Write log entries (dicts as saved by save_dive_log) as a `.dlog` file, atomically."""
+    entries = list(entries)
+    count = len(entries)
+    arrays = {}
+    for name, dtype in COLUMNS:
+        if name == "timestamp":
+            arrays[name] = np.array([_timestamp(entry.get(name)) for entry in entries], dtype=dtype)
+        else:
+            arrays[name] = np.array([_number(entry.get(name)) for entry in entries], dtype=dtype)
+    omitted = sorted({key for entry in entries for key in entry}.difference(name for name, _ in COLUMNS))
+
+    columns = []
+    for name, _ in COLUMNS:
+        values = arrays[name]
+        column = {"name": name, "dtype": values.dtype.str, "encoding": "plain"}
+        if name in DELTA_COLUMNS:
+            encoded = _delta_encode(values)
+            if encoded is not None:
+                base, values = encoded
+                column = {"name": name, "dtype": values.dtype.str, "encoding": "delta", "base": base,
+                          "scale": TIME_SCALE}
+        columns.append((column, values))
+
+    header = {"format_version": FORMAT_VERSION, "client_uuid": client_uuid, "count": count,
+              "omitted_keys": omitted, "columns": [column for column, _ in columns]}
+    # The header holds the column offsets, which depend on its own length: grow the gap until it fits
+    data_start = 0
+    while True:
+        offset = data_start
+        for column, values in columns:
+            column["offset"] = offset
+            offset = _align(offset + values.nbytes)
+        header_bytes = json.dumps(header).encode("utf-8")
+        needed = _align(len(MAGIC) + _LENGTH.size + len(header_bytes))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(MAGIC + _LENGTH.pack(len(header_bytes)) + header_bytes)
+        for column, values in columns:
+            file.write(b"\x00" * (column["offset"] - file.tell()))
+            file.write(values.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return header
+
+
+def convert(source, target=None):
+    """
+    Convert a `.json` (array) or `.ndjson` log to `.dlog`, by default next to it. Returns the target path and
+    the number of entries.
+    """
+    name = os.path.basename(source)
+    if name.endswith(log_store.LOG_SUFFIX):
+        stem = name[:-len(log_store.LOG_SUFFIX)]
+        entries = list(log_store.iter_entries(source))
+    elif name.endswith(log_store.LEGACY_SUFFIX):
+        stem = name[:-len(log_store.LEGACY_SUFFIX)]
+        with open(source, "r", encoding="utf-8") as file:
+            entries = json.load(file)
+        if not isinstance(entries, list):
+            raise ValueError(f"{source} is not a JSON array")
+    else:
+        raise ValueError(f"{source} is not a .json or .ndjson log")
+    client_uuid = stem[len(log_store.LEGACY_PREFIX):] if stem.startswith(log_store.LEGACY_PREFIX) else stem
+    target = target or os.path.join(os.path.dirname(source), stem + COLUMNAR_SUFFIX)
+    write(target, entries, client_uuid)
+    return target, len(entries)
+
+
+def _timestamp(value):
+    try:
+        return np.datetime64(datetime.strptime(value, "%Y-%m-%d %H:%M:%S"), "s")
+    except (TypeError, ValueError):
+        return np.datetime64("NaT")
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _delta_encode(values):
+    """(base, int32 differences) of the values in hundredths, or None if they cannot be delta-encoded."""
+    if len(values) == 0 or not np.isfinite(values).all():
+        return None
+    scaled = np.rint(values * TIME_SCALE).astype(np.int64)
+    deltas = np.diff(scaled, prepend=scaled[0])
+    if np.abs(deltas).max() > np.iinfo(np.int32).max:
+        return None
+    return int(scaled[0]), deltas.astype("<i4")
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+if __name__ == "__main__":
+    sources = []
+    for argument in sys.argv[1:] or [os.path.join("data", "logs")]:
+        if os.path.isdir(argument):
+            for directory, _, names in os.walk(argument):
+                sources.extend(os.path.join(directory, name) for name in sorted(names)
+                               if name.endswith((log_store.LOG_SUFFIX, log_store.LEGACY_SUFFIX)))
+        else:
+            sources.append(argument)
+    total = 0
+    for source in sources:
+        target, count = convert(source)
+        total += count
+        print(f"📦 {source} -> {target} ({count} entries)")
+    print(f"Converted {len(sources)} log file(s), {total} entries")
@@ -0,0 +1,181 @@
+"""
+Bühlmann ZH-L16C decompression engine with gradient factors.
+
+Each of the 16 compartments tracks nitrogen and helium separately, using the
+ZH-L16C half-times and a/b coefficients (compartment 1 is the 4 min "1b"
+variant). The tolerated ambient pressure of a compartment is
+
+    P_tol = (P_N2 + P_He - a*GF) / (GF/b + 1 - GF)
+
+with a and b weighted by the N₂/He tensions. The ceiling is the deepest of
+these, and a schedule is built by ascending in 3 m steps, holding each stop
+until the ceiling at the next stop's gradient factor allows moving up. The
+gradient factor runs linearly from GF-low at the first stop to GF-high at the
+surface.
+
+The tension arithmetic reuses `TissueModel`, one for each gas, so a session's
+N₂ and He arrays can be advanced in the same batched Haldane updates as the
+simulator's own compartments.
+"""
+import math
+
+import numpy as np
+
+from tissue_engine import TissueModel
+
+WATER_VAPOUR_PRESSURE = 0.0627  # ATA, alveolar water vapour at 37 °C
+STOP_INTERVAL = 3.0  # Metres between decompression stops
+MAX_STOP_MINUTES = 1440  # A stop that never clears is reported as an error instead of looping forever
+_STOP_SEARCH_CHUNK = 64  # Minutes of stop time evaluated per vectorized step
+
+# tissue, N₂ half-time, N₂ a, N₂ b, He half-time, He a, He b
+ZHL16C_COMPARTMENTS = [
+    {"tissue": 1, "n2_half_time": 4.0, "n2_a": 1.2599, "n2_b": 0.5050,
+     "he_half_time": 1.51, "he_a": 1.7424, "he_b": 0.4245},
+    {"tissue": 2, "n2_half_time": 8.0, "n2_a": 1.0000, "n2_b": 0.6514,
+     "he_half_time": 3.02, "he_a": 1.3830, "he_b": 0.5747},
+    {"tissue": 3, "n2_half_time": 12.5, "n2_a": 0.8618, "n2_b": 0.7222,
+     "he_half_time": 4.72, "he_a": 1.1919, "he_b": 0.6527},
+    {"tissue": 4, "n2_half_time": 18.5, "n2_a": 0.7562, "n2_b": 0.7825,
+     "he_half_time": 6.99, "he_a": 1.0458, "he_b": 0.7223},
+    {"tissue": 5, "n2_half_time": 27.0, "n2_a": 0.6200, "n2_b": 0.8126,
+     "he_half_time": 10.21, "he_a": 0.9220, "he_b": 0.7582},
+    {"tissue": 6, "n2_half_time": 38.3, "n2_a": 0.5043, "n2_b": 0.8434,
+     "he_half_time": 14.48, "he_a": 0.8205, "he_b": 0.7957},
+    {"tissue": 7, "n2_half_time": 54.3, "n2_a": 0.4410, "n2_b": 0.8693,
+     "he_half_time": 20.53, "he_a": 0.7305, "he_b": 0.8279},
+    {"tissue": 8, "n2_half_time": 77.0, "n2_a": 0.4000, "n2_b": 0.8910,
+     "he_half_time": 29.11, "he_a": 0.6502, "he_b": 0.8553},
+    {"tissue": 9, "n2_half_time": 109.0, "n2_a": 0.3750, "n2_b": 0.9092,
+     "he_half_time": 41.20, "he_a": 0.5950, "he_b": 0.8757},
+    {"tissue": 10, "n2_half_time": 146.0, "n2_a": 0.3500, "n2_b": 0.9222,
+     "he_half_time": 55.19, "he_a": 0.5545, "he_b": 0.8903},
+    {"tissue": 11, "n2_half_time": 187.0, "n2_a": 0.3295, "n2_b": 0.9319,
+     "he_half_time": 70.69, "he_a": 0.5333, "he_b": 0.8997},
+    {"tissue": 12, "n2_half_time": 239.0, "n2_a": 0.3065, "n2_b": 0.9403,
+     "he_half_time": 90.34, "he_a": 0.5189, "he_b": 0.9073},
+    {"tissue": 13, "n2_half_time": 305.0, "n2_a": 0.2835, "n2_b": 0.9477,
+     "he_half_time": 115.29, "he_a": 0.5181, "he_b": 0.9122},
+    {"tissue": 14, "n2_half_time": 390.0, "n2_a": 0.2610, "n2_b": 0.9544,
+     "he_half_time": 147.42, "he_a": 0.5176, "he_b": 0.9171},
+    {"tissue": 15, "n2_half_time": 498.0, "n2_a": 0.2480, "n2_b": 0.9602,
+     "he_half_time": 188.24, "he_a": 0.5172, "he_b": 0.9217},
+    {"tissue": 16, "n2_half_time": 635.0, "n2_a": 0.2327, "n2_b": 0.9653,
+     "he_half_time": 240.03, "he_a": 0.5119, "he_b": 0.9267}
+]
+
+
+class ZHL16C:
+    """ZH-L16C compartments as two array-backed TissueModels, one for N₂ and one for He."""
+
+    def __init__(self, compartments=ZHL16C_COMPARTMENTS, surface_pressure=1.0,
+                 water_vapour_pressure=WATER_VAPOUR_PRESSURE):
+        self.surface_pressure = surface_pressure
+        self.water_vapour_pressure = water_vapour_pressure
+        self.nitrogen = TissueModel([{"tissue": c["tissue"], "half_time": c["n2_half_time"],
+                                      "a": c["n2_a"], "b": c["n2_b"]} for c in compartments], surface_pressure)
+        self.helium = TissueModel([{"tissue": c["tissue"], "half_time": c["he_half_time"],
+                                    "a": c["he_a"], "b": c["he_b"]} for c in compartments], surface_pressure)
+        self.ids = self.nitrogen.ids
+        # Decay factors exp(-k*t) for t = 1.._STOP_SEARCH_CHUNK minutes, shared by every stop search
+        minutes = np.arange(1, _STOP_SEARCH_CHUNK + 1, dtype=np.float64)[:, None]
+        self._nitrogen_decay = np.exp(-self.nitrogen.k * minutes)
+        self._helium_decay = np.exp(-self.helium.k * minutes)
+
+    def surface_tensions(self, sessions=None):
+        """Tensions of a diver saturated at the surface on air: (nitrogen, helium)."""
+        nitrogen = self.nitrogen.new_tensions(sessions)
+        nitrogen += self.inspired_pressure(0, 0.79)
+        return nitrogen, self.helium.new_tensions(sessions)
+
+    def inspired_pressure(self, depth, fraction):
+        """Inspired partial pressure of a gas at `depth`, net of alveolar water vapour."""
+        ambient = self.nitrogen.ambient_pressure(depth)
+        return np.maximum(ambient - self.water_vapour_pressure, 0.0) * np.asarray(fraction, dtype=np.float64)
+
+    def load(self, nitrogen, helium, depth, nitrogen_fraction, helium_fraction, dt_minutes):
+        """Constant-depth loading of both gases; arguments broadcast like `TissueModel.haldane`."""
+        return (self.nitrogen.haldane(nitrogen, self.inspired_pressure(depth, nitrogen_fraction), dt_minutes),
+                self.helium.haldane(helium, self.inspired_pressure(depth, helium_fraction), dt_minutes))
+
+    def travel(self, nitrogen, helium, start_depth, end_depth, nitrogen_fraction, helium_fraction, rate):
+        """Loading during a depth change at `rate` m/min (Schreiner equation)."""
+        dt_minutes = abs(end_depth - start_depth) / rate
+        if dt_minutes == 0:
+            return nitrogen, helium
+        pressure_rate = (end_depth - start_depth) / 10 / dt_minutes
+        return (self.nitrogen.schreiner(nitrogen, self.inspired_pressure(start_depth, nitrogen_fraction),
+                                        pressure_rate * nitrogen_fraction, dt_minutes),
+                self.helium.schreiner(helium, self.inspired_pressure(start_depth, helium_fraction),
+                                      pressure_rate * helium_fraction, dt_minutes))
+
+    def tolerated_pressures(self, nitrogen, helium, gradient_factor):
+        """Lowest ambient pressure each compartment tolerates at `gradient_factor` (0-1)."""
+        total = nitrogen + helium
+        a = (self.nitrogen.a * nitrogen + self.helium.a * helium) / total
+        inverse_b = total / (self.nitrogen.b * nitrogen + self.helium.b * helium)
+        return (total - a * gradient_factor) / (gradient_factor * inverse_b + 1 - gradient_factor)
+
+    def ceiling(self, nitrogen, helium, gradient_factor):
+        """Shallowest depth in metres the diver may ascend to (0 means a direct ascent is allowed)."""
+        tolerated = self.tolerated_pressures(nitrogen, helium, gradient_factor).max(axis=-1)
+        return np.maximum((tolerated - self.surface_pressure) * 10, 0.0)
+
+    def schedule(self, nitrogen, helium, depth, nitrogen_fraction, helium_fraction, gf_low, gf_high,
+                 ascent_rate=9.0, last_stop=STOP_INTERVAL):
+        """
+        Decompression stops for an ascent from `depth` breathing one gas throughout.
+
+        Returns a dict with the ceiling at GF-low, the stops (depth in m, duration in whole minutes and
+        the gradient factor the stop was cleared at) and the total time to surface in minutes.
+        """
+        ceiling = float(self.ceiling(nitrogen, helium, gf_low))
+        stops = []
+        first_stop = None
+        run_time = 0.0
+        current = float(depth)
+        while current > 0:
+            next_depth = math.ceil(round(current / STOP_INTERVAL, 6)) * STOP_INTERVAL - STOP_INTERVAL
+            if next_depth < last_stop:
+                next_depth = 0.0
+            gradient_factor = self._gradient_factor(next_depth, first_stop, gf_low, gf_high)
+            if self.ceiling(nitrogen, helium, gradient_factor) > next_depth:
+                if first_stop is None:
+                    first_stop = current
+                    gradient_factor = self._gradient_factor(next_depth, first_stop, gf_low, gf_high)
+                minutes, nitrogen, helium = self._stop_time(nitrogen, helium, current, next_depth,
+                                                            nitrogen_fraction, helium_fraction, gradient_factor)
+                stops.append({"depth": round(current, 1), "duration": int(minutes),
+                              "gradient_factor": round(gradient_factor, 3)})
+                run_time += minutes
+            nitrogen, helium = self.travel(nitrogen, helium, current, next_depth, nitrogen_fraction,
+                                           helium_fraction, ascent_rate)
+            run_time += (current - next_depth) / ascent_rate
+            current = next_depth
+
+        return {"ceiling": round(ceiling, 2), "stops": stops, "time_to_surface": round(run_time, 2)}
+
+    @staticmethod
+    def _gradient_factor(depth, first_stop, gf_low, gf_high):
+        """GF-low until the first stop is known, then a straight line from GF-low there to GF-high at 0 m."""
+        if first_stop is None:
+            return gf_low
+        return gf_high + (gf_low - gf_high) * depth / first_stop
+
+    def _stop_time(self, nitrogen, helium, depth, next_depth, nitrogen_fraction, helium_fraction,
+                   gradient_factor):
+        """
+        Whole minutes to hold at `depth` before the ceiling clears `next_depth`, with the tensions after the
+        stop. Candidate stop lengths are evaluated a chunk at a time as one (minutes x compartments) array.
+        """
+        inspired_nitrogen = float(self.inspired_pressure(depth, nitrogen_fraction))
+        inspired_helium = float(self.inspired_pressure(depth, helium_fraction))
+        for offset in range(0, MAX_STOP_MINUTES, _STOP_SEARCH_CHUNK):
+            nitrogen_after = inspired_nitrogen + (nitrogen - inspired_nitrogen) * self._nitrogen_decay
+            helium_after = inspired_helium + (helium - inspired_helium) * self._helium_decay
+            cleared = np.flatnonzero(self.ceiling(nitrogen_after, helium_after, gradient_factor) <= next_depth)
+            if cleared.size:
+                index = cleared[0]
+                return offset + index + 1, nitrogen_after[index], helium_after[index]
+            nitrogen, helium = nitrogen_after[-1], helium_after[-1]
+        raise ValueError(f"Stop at {depth:g} m does not clear within {MAX_STOP_MINUTES} minutes")
@@ -0,0 +1,133 @@
+"""
+Bounded, columnar in-memory dive log.
+
+Each column (depth, pressure, ppO₂, NDL, ...) is its own typed NumPy array, so
+an entry costs a few dozen bytes instead of a dict with string keys. The
+buffer holds at most `capacity` entries; once full, every append overwrites
+the oldest entry and hands it back so the caller can fold it into whatever it
+derives from the log.
+
+The arrays are allocated at twice the capacity and every entry is written to
+slot i and to its mirror at i + capacity. Any run of up to `capacity`
+consecutive entries is therefore contiguous, and `column` can return the log in
+chronological order as a zero-copy view even after the buffer has wrapped.
+Storage starts small and doubles up to the capacity, so appends are O(1)
+amortized.
+"""
+import numpy as np
+
+DEFAULT_CAPACITY = 10000
+_INITIAL_SIZE = 64
+
+# Column name, dtype, and the key the entry had in the old list-of-dicts log. The columns the accumulated
+# tissue loading is replayed from stay float64 so a replay matches the incremental tensions exactly.
+COLUMNS = (
+    ("depth", np.float64, "Depth"),
+    ("pressure", np.float32, "Pressure"),
+    ("oxygen_toxicity", np.float32, "Oxygen Toxicity"),
+    ("ndl", np.float32, "NDL"),
+    ("rgbm_factor", np.float32, "RGBM Factor"),
+    ("time_elapsed", np.float64, "Time Elapsed"),
+    ("time_at_depth", np.float64, "Time at Depth"),
+    ("inert_gas_fraction", np.float64, "Inert Gas Fraction"),
+)
+COLUMN_NAMES = tuple(name for name, _, _ in COLUMNS)
+
+
+class DiveLogBuffer:
+    """Fixed-capacity ring buffer of dive log entries, one typed array per column."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = int(capacity)
+        self._size = min(self.capacity, _INITIAL_SIZE)  # Slots allocated; grows to capacity
+        self._columns = {name: np.zeros(2 * self._size, dtype=dtype) for name, dtype, _ in COLUMNS}
+        self._next = 0  # Slot the next entry goes to
+        self._count = 0
+        self.appended = 0  # Entries ever appended, including evicted ones
+
+    def __len__(self):
+        return self._count
+
+    def append(self, depth, pressure, oxygen_toxicity, ndl, rgbm_factor, time_elapsed, time_at_depth,
+               inert_gas_fraction):
+        """Add an entry. Returns the entry it evicted as a dict (see `row`), or None while there is room."""
+        evicted = None
+        if self._count == self._size:
+            if self._size < self.capacity:
+                self._reallocate(min(self.capacity, 2 * self._size))
+            else:
+                evicted = self.row(0)
+                self._count -= 1
+
+        values = (depth, pressure, oxygen_toxicity, ndl, rgbm_factor, time_elapsed, time_at_depth,
+                  inert_gas_fraction)
+        slot = self._next
+        for name, value in zip(COLUMN_NAMES, values):
+            column = self._columns[name]
+            column[slot] = value
+            column[slot + self._size] = value
+        self._next = (slot + 1) % self._size
+        self._count += 1
+        self.appended += 1
+        return evicted
+
+    def column(self, name, start=0, stop=None):
+        """
+        Read-only view of one column in chronological order (optionally entries start:stop), without copying.
+        The view reflects the buffer as it is now; appends may overwrite it, so use it under the owner's lock.
+        """
+        start, stop, _ = slice(start, stop).indices(self._count)
+        first = (self._next - self._count) % self._size
+        view = self._columns[name][first + start:first + max(start, stop)]
+        view.flags.writeable = False
+        return view
+
+    def columns(self, start=0, stop=None):
+        """`column` for every column, keyed by name."""
+        return {name: self.column(name, start, stop) for name in COLUMN_NAMES}
+
+    def row(self, index):
+        """One entry as a dict keyed like the old list-of-dicts log ("Depth", "Time Elapsed", ...)."""
+        if not -self._count <= index < self._count:
+            raise IndexError("dive log index out of range")
+        slot = (self._next - self._count + index % self._count) % self._size
+        return {key: self._columns[name][slot].item() for name, _, key in COLUMNS}
+
+    def resize(self, capacity):
+        """Change the capacity, keeping the newest entries. Returns the entries dropped, oldest first."""
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        capacity = int(capacity)
+        dropped = [self.row(i) for i in range(max(0, self._count - capacity))]
+        self.capacity = capacity
+        self._reallocate(max(min(capacity, _INITIAL_SIZE), min(capacity, self._count)))
+        return dropped
+
+    def memory_footprint(self):
+        """Entries held, slots allocated and bytes used by the column arrays."""
+        return {
+            "entries": self._count,
+            "capacity": self.capacity,
+            "allocated_entries": self._size,
+            "appended": self.appended,
+            "evicted": self.appended - self._count,
+            "bytes": int(sum(column.nbytes for column in self._columns.values())),
+            "bytes_per_entry": int(sum(2 * np.dtype(dtype).itemsize for _, dtype, _ in COLUMNS))
+        }
+
+    def _reallocate(self, size):
+        """Move the newest min(count, size) entries into fresh arrays with `size` slots."""
+        keep = min(self._count, size)
+        columns = {}
+        for name, dtype, _ in COLUMNS:
+            values = self.column(name, self._count - keep)
+            column = np.zeros(2 * size, dtype=dtype)
+            column[:keep] = values
+            column[size:size + keep] = values
+            columns[name] = column
+        self._columns = columns
+        self._size = size
+        self._count = keep
+        self._next = keep % size
@@ -0,0 +1,247 @@
+"""
+Compaction of client dive logs into gzip-archived dives, and archive retention.
+
+A client's `.ndjson` log otherwise only grows. `compact_log` splits it into
+dives at surface events (an entry at depth 0 after deeper ones ends a dive)
+and moves every finished dive out of it, so the log keeps only the dive in
+progress and /api/v1/logs stays small.
+
+Each finished dive is appended to `<uuid>.archive.gz` as a gzip member of its
+own, so `zcat` still reads the whole history, and described by one line of
+`<uuid>.archive.idx`: dive number, byte offset and length of the member, entry
+count, first and last timestamp, maximum depth, and a digest of the dive's
+lines with the inode of the log it came from. `read_dive` seeks to one member
+and decompresses only that dive. Each row also records how many bytes its
+compaction cut from the front of the log (`cut`) and the total cut so far
+(`base`), which /api/v1/logs cursors add to their offsets so that a cursor
+issued before a compaction still points at the same entry after it.
+
+`apply_retention` drops the oldest archived dives once they are older than a
+number of days or the archive outgrows a byte budget. It copies the bytes of
+the remaining members as they are (nothing is recompressed) and shifts the
+index offsets. `python log_archive.py [log dir] [days] [bytes]` runs both over
+every log.
+
+Both run under the lock log_store.py's appends take on the client's log, so
+they are safe against writers in any process. A crash part way through a
+compaction is repaired by the next one: dives already in the index are not
+archived twice, and bytes after the last indexed member are dropped.
+"""
+import gzip
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import log_store
+
+ARCHIVE_SUFFIX = ".archive.gz"
+INDEX_SUFFIX = log_store.ARCHIVE_INDEX_SUFFIX
+
+
+def archive_paths(path):
+    """The archive and index paths that go with the log at `path`."""
+    base = path[:-len(log_store.LOG_SUFFIX)] if path.endswith(log_store.LOG_SUFFIX) else path
+    return base + ARCHIVE_SUFFIX, base + INDEX_SUFFIX
+
+
+def iter_logs(log_dir):
+    """Yield the path of every client log under `log_dir`."""
+    for directory, _, names in os.walk(log_dir):
+        for name in sorted(names):
+            if name.endswith(log_store.LOG_SUFFIX):
+                yield os.path.join(directory, name)
+
+
+def split_dives(data):
+    """
+    Split a log's bytes into finished dives. Returns ([(dive bytes, entries), ...], offset of the dive in
+    progress); the bytes from that offset on stay in the log.
+    """
+    dives = []
+    start = 0
+    position = 0
+    entries = []
+    diving = False
+    for line in data.splitlines(keepends=True):
+        position += len(line)
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue  # Blank, malformed or torn; kept as bytes, never ends a dive
+        entries.append(entry)
+        try:
+            depth = float(entry.get("depth"))
+        except (TypeError, ValueError):
+            continue
+        if depth > 0:
+            diving = True
+        elif diving:
+            dive = data[start:position]
+            dives.append((dive if dive.endswith(b"\n") else dive + b"\n", entries))
+            start, entries, diving = position, [], False
+    return dives, start
+
+
+def read_index(path):
+    """The archived dives of the log at `path`, oldest first."""
+    return [row for row in _read_index_rows(path) if not row.get("dropped")]
+
+
+def _read_index_rows(path):
+    # Including the placeholder apply_retention leaves when it drops every dive, which keeps the numbering going
+    return list(log_store.iter_entries(archive_paths(path)[1]))
+
+
+def read_dive(path, dive):
+    """The entries of archived dive number `dive` of the log at `path`; KeyError if there is no such dive."""
+    archive_path, _ = archive_paths(path)
+    for row in read_index(path):
+        if row["dive"] == dive:
+            with open(archive_path, "rb") as archive:
+                archive.seek(row["offset"])
+                data = gzip.decompress(archive.read(row["length"]))
+            if _digest(data) != row["digest"]:
+                raise ValueError(f"Archive of {path} does not match its index at dive {dive}")
+            return [json.loads(line) for line in data.splitlines() if line.strip()]
+    raise KeyError(dive)
+
+
+def compact_log(path):
+    """Archive the finished dives of the log at `path`, keeping the dive in progress. Returns the dives archived."""
+    archive_path, index_path = archive_paths(path)
+    while True:
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return 0
+        with file, log_store.locked(file):
+            if log_store.replaced(file, path):
+                continue
+            data = file.read()
+            dives, remainder = split_dives(data)
+            if not dives:
+                return 0
+
+            index = _read_index_rows(path)
+            # Each compaction replaces the log, so dives archived from this very file mean an interrupted run
+            source = os.fstat(file.fileno()).st_ino
+            archived = {row["digest"] for row in index if row.get("source") == source}
+            base = log_store.compacted_bytes(path, source) + remainder
+            rows = []
+            with open(archive_path, "ab") as archive:
+                end = index[-1]["offset"] + index[-1]["length"] if index else 0
+                if archive.tell() > end:
+                    archive.truncate(end)  # Left by a compaction that crashed before writing the index
+                number = index[-1]["dive"] + 1 if index else 1
+                for dive, entries in dives:
+                    digest = _digest(dive)
+                    if digest in archived:
+                        continue  # Archived by a compaction that crashed before rewriting the log
+                    member = gzip.compress(dive, mtime=0)
+                    archive.write(member)
+                    rows.append(_index_row(number, end, len(member), entries, digest, source, remainder, base))
+                    end += len(member)
+                    number += 1
+                archive.flush()
+                os.fsync(archive.fileno())
+            if rows:
+                log_store.append_entries(index_path, rows, sync=True)
+
+            # The log keeps only the dive in progress
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as rest:
+                rest.write(data[remainder:])
+                rest.flush()
+                os.fsync(rest.fileno())
+            os.replace(temp_path, path)
+            return len(rows)
+
+
+def apply_retention(path, max_age_days=None, max_bytes=None, now=None):
+    """
+    Drop the oldest archived dives of the log at `path` that ended more than `max_age_days` ago, then more until
+    the archive fits in `max_bytes`. Returns the dives dropped.
+    """
+    archive_path, index_path = archive_paths(path)
+    while True:
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return 0
+        with file, log_store.locked(file):
+            if log_store.replaced(file, path):
+                continue
+            index = read_index(path)
+            cutoff = None
+            if max_age_days is not None:
+                cutoff = ((now or datetime.now()) - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+            size = sum(row["length"] for row in index)
+            drop = 0
+            for row in index:
+                expired = cutoff is not None and row["end"] is not None and row["end"] < cutoff
+                if not expired and (max_bytes is None or size <= max_bytes):
+                    break
+                size -= row["length"]
+                drop += 1
+            if drop == 0:
+                return 0
+
+            kept = index[drop:] or [dict(index[-1], offset=0, length=0, dropped=True)]
+            shift = kept[0]["offset"]
+            with open(archive_path + ".tmp", "wb") as archive:
+                if kept[-1]["length"]:
+                    with open(archive_path, "rb") as source:
+                        source.seek(shift)
+                        archive.write(source.read(kept[-1]["offset"] + kept[-1]["length"] - shift))
+                archive.flush()
+                os.fsync(archive.fileno())
+            with open(index_path + ".tmp", "w", encoding="utf-8") as new_index:
+                for row in kept:
+                    new_index.write(json.dumps(dict(row, offset=row["offset"] - shift), separators=(",", ":")) + "\n")
+                new_index.flush()
+                os.fsync(new_index.fileno())
+            os.replace(archive_path + ".tmp", archive_path)
+            os.replace(index_path + ".tmp", index_path)
+            return drop
+
+
+def _index_row(number, offset, length, entries, digest, source, cut, base):
+    timestamps = [entry["timestamp"] for entry in entries if isinstance(entry.get("timestamp"), str)]
+    depths = []
+    for entry in entries:
+        try:
+            depths.append(float(entry.get("depth")))
+        except (TypeError, ValueError):
+            pass
+    return {
+        "dive": number,
+        "offset": offset,
+        "length": length,
+        "entries": len(entries),
+        "start": min(timestamps) if timestamps else None,
+        "end": max(timestamps) if timestamps else None,
+        "max_depth": max(depths) if depths else None,
+        "digest": digest,
+        "source": source,
+        "cut": cut,
+        "base": base
+    }
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+if __name__ == "__main__":
+    # python log_archive.py [log dir] [max age in days] [max archive bytes per client]
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "logs")
+    max_age_days = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    max_bytes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    archived = dropped = 0
+    for log_path in iter_logs(directory):
+        archived += compact_log(log_path)
+        if max_age_days is not None or max_bytes is not None:
+            dropped += apply_retention(log_path, max_age_days, max_bytes)
+    print(f"Archived {archived} finished dive(s) and dropped {dropped} expired one(s) under {directory}")
@@ -0,0 +1,205 @@
+"""
+In-memory LRU cache of parsed per-client dive logs in front of a LogStore.
+
+/api/v1/logs and load_dive_logs used to read and parse a client's whole log
+from storage on every call. CachedLogStore keeps the parsed entries of
+recently read clients, so a repeated read costs one `stat` to check the log's
+`version` (mtime and size) and no reads or parsing.
+
+Only full reads (`iter_entries`, `iter_json_lines`) fill the cache, keeping
+the rows as they stream past. Pages, filtered scans and streams are served
+from the cache when the log is already in it and straight from the store
+otherwise, so a page of ten entries never parses a whole log that is not
+cached.
+
+A cached log is dropped when its version changes under it (another process
+wrote to it, or it was rewritten). Writes that go through the cache keep it
+current: on an append-only store only the lines just written are read back,
+otherwise the client's cached log is dropped. The cache is bounded by the
+total size of the cached entries' JSON text, evicting the least recently read
+clients first. A log larger than the whole budget is served but not kept:
+its rows are let go as soon as they exceed it, and later full reads of the
+same version do not collect them at all.
+
+Entries handed out are shared with the cache and must not be modified.
+"""
+import itertools
+import threading
+from collections import OrderedDict
+
+from log_store import LogStore, entry_matches
+
+_OVERSIZED_CLIENTS = 1024  # Logs remembered as too large to cache, least recently read dropped first
+
+
+class _CachedLog:
+    __slots__ = ("version", "rows", "positions", "bytes")
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = []  # (cursor, JSON text, entry), in scan order
+        self.positions = {}  # cursor -> index in rows
+        self.bytes = 0
+        self.extend(rows)
+
+    def extend(self, rows):
+        for row in rows:
+            self.positions[row[0]] = len(self.rows)
+            self.rows.append(row)
+            self.bytes += len(row[1])
+
+
+class CachedLogStore(LogStore):
+    """A LogStore that serves reads of recently read clients from memory, up to `max_bytes` of log JSON."""
+
+    def __init__(self, store, max_bytes=64 * 1024 * 1024):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.append_ordered = store.append_ordered
+        self._logs = OrderedDict()  # client_uuid -> _CachedLog, least recently read first
+        self._oversized = OrderedDict()  # client_uuid -> version of a log found larger than max_bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def location(self, client_uuid):
+        return self.store.location(client_uuid)
+
+    def ensure(self, client_uuid):
+        self.store.ensure(client_uuid)
+
+    def version(self, client_uuid):
+        return self.store.version(client_uuid)
+
+    def append_many(self, client_uuid, entries, sync=False):
+        before = self.store.version(client_uuid)
+        written = self.store.append_many(client_uuid, entries, sync)
+        with self._lock:
+            self._oversized.pop(client_uuid, None)
+            log = self._logs.get(client_uuid)
+            if log is None:
+                return written
+            if not self.store.append_ordered or log.version != before:
+                self._drop(client_uuid)
+                self.invalidations += 1
+                return written
+        # Read the version before the tail, so a write racing with this one makes the next read reload
+        version = self.store.version(client_uuid)
+        tail = list(self.store.scan(client_uuid, after=log.rows[-1][0] if log.rows else None))
+        with self._lock:
+            if self._logs.get(client_uuid) is not log:
+                return written
+            size = log.bytes
+            log.extend(tail)
+            log.version = version
+            self._bytes += log.bytes - size
+            self._evict()
+        return written
+
+    def iter_entries(self, client_uuid):
+        for _, _, entry in self._read_all(client_uuid):
+            yield entry
+
+    def iter_json_lines(self, client_uuid):
+        for _, line, _ in self._read_all(client_uuid):
+            yield line
+
+    def scan(self, client_uuid, after=None, start=None, end=None, min_depth=None, max_depth=None):
+        log = self._get(client_uuid)  # Never loads: a partial read should not parse the whole log
+        first = 0
+        if log is not None and after is not None:
+            position = log.positions.get(after)
+            if position is None:
+                log = None  # Not a cursor of a cached entry; the store validates it
+            else:
+                first = position + 1
+        if log is None:
+            yield from self.store.scan(client_uuid, after, start, end, min_depth, max_depth)
+            return
+        for row in itertools.islice(log.rows, first, None):
+            if entry_matches(row[2], start, end, min_depth, max_depth):
+                yield row
+
+    def clear(self):
+        with self._lock:
+            self._logs.clear()
+            self._oversized.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "clients": len(self._logs),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _read_all(self, client_uuid):
+        """Yield every row of the client's log, from the cache or from the store, caching it if it fits."""
+        version = self.store.version(client_uuid)
+        log = self._get(client_uuid, version)
+        if log is not None:
+            yield from log.rows
+            return
+        with self._lock:
+            collect = version is not None and self._oversized.get(client_uuid) != version
+        if not collect:
+            yield from self.store.scan(client_uuid)
+            return
+
+        log = _CachedLog(version, ())
+        for row in self.store.scan(client_uuid):
+            if log is not None:
+                log.extend((row,))
+                if log.bytes > self.max_bytes:
+                    log = None  # Too large to keep; stream the rest without holding on to it
+            yield row
+        with self._lock:
+            if log is None:
+                self._oversized[client_uuid] = version
+                self._oversized.move_to_end(client_uuid)
+                if len(self._oversized) > _OVERSIZED_CLIENTS:
+                    self._oversized.popitem(last=False)
+                return
+            self._drop(client_uuid)  # Another thread may have loaded it meanwhile
+            self._logs[client_uuid] = log
+            self._bytes += log.bytes
+            self._evict()
+
+    def _get(self, client_uuid, version=None):
+        """The client's cached log if it is current, else None (also if the store cannot tell when it changes)."""
+        if version is None:
+            version = self.store.version(client_uuid)
+        if version is None:
+            return None
+        with self._lock:
+            log = self._logs.get(client_uuid)
+            if log is not None:
+                if log.version == version:
+                    self._logs.move_to_end(client_uuid)
+                    self.hits += 1
+                    return log
+                self._drop(client_uuid)
+                self.invalidations += 1
+            self.misses += 1
+        return None
+
+    def _drop(self, client_uuid):
+        log = self._logs.pop(client_uuid, None)
+        if log is not None:
+            self._bytes -= log.bytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._logs:
+            _, log = self._logs.popitem(last=False)
+            self._bytes -= log.bytes
+            self.evictions += 1
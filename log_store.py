@@ -0,0 +1,446 @@
+"""
+Append-only JSON Lines storage for per-client dive logs.
+
+Each client's log is a `.ndjson` file with one JSON object per line. Saving an
+entry appends a single line, so a write costs the same however long the log
+is, and readers parse the file one line at a time instead of loading a whole
+JSON array.
+
+Appends hold an exclusive lock on the file (flock, where available), which
+log_archive.py's compaction takes before it replaces the file with a shorter
+one; an append that finds its file replaced reopens it.
+
+A crash can leave only the last line half-written. Readers skip such a torn
+line, and the first append to a file in each process truncates it first, so
+the next entry is not glued onto it.
+
+Logs live under a data directory, sharded by a hash of the client UUID
+(`ab/cd/<uuid>.ndjson`), so no directory grows past a few dozen files however
+many clients there are. Shard directories are created once per process.
+
+Logs used to sit in one flat, publicly served directory (`static/logs`), first
+as JSON arrays in `dive_log_<uuid>.json`, then as `dive_log_<uuid>.ndjson`.
+A client's old log is moved into its shard the first time it is needed (an
+array is converted and the original renamed to `.json.migrated`), or `python
+log_store.py <old dir> <log dir>` moves them all.
+
+The endpoints reach the logs through a LogStore: NDJSONLogStore here, or
+SQLiteLogStore (sqlite_log_store.py) when LOG_STORAGE is "sqlite".
+"""
+import contextlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: logs are then only locked against other threads of this process
+    fcntl = None
+
+from tracing import tracer
+
+LOG_SUFFIX = ".ndjson"
+ARCHIVE_INDEX_SUFFIX = ".archive.idx"  # Written by log_archive.py next to a compacted log
+LEGACY_PREFIX = "dive_log_"
+LEGACY_SUFFIX = ".json"
+
+_SAFE_NAME = re.compile(r"[A-Za-z0-9_-]{1,128}")  # Client UUIDs usable as file names as they are
+
+_checked_paths = set()  # Files whose tail has been checked for a torn line in this process
+_checked_lock = threading.Lock()
+_made_dirs = set()  # Directories known to exist in this process
+_file_lock = threading.RLock()  # Stands in for flock without fcntl
+
+
+class LogStore:
+    """Per-client dive log storage used by save_dive_log, load_dive_logs and /api/v1/logs."""
+
+    append_ordered = False  # Whether new entries always come after every existing one in `scan` order
+
+    def location(self, client_uuid):
+        """Where the client's log is kept (reported by /api/v1/get_log_filename)."""
+        raise NotImplementedError
+
+    def ensure(self, client_uuid):
+        """Make sure the client's log exists and is readable."""
+        raise NotImplementedError
+
+    def version(self, client_uuid):
+        """A value that changes whenever the client's log does (see log_cache.py), or None if unknown."""
+        return None
+
+    def append(self, client_uuid, entry):
+        return self.append_many(client_uuid, [entry])
+
+    def append_many(self, client_uuid, entries, sync=False):
+        """
+        Append entries in order, as one batch where the backend supports it; `sync` makes them durable first.
+        Returns the bytes of JSON text written.
+        """
+        raise NotImplementedError
+
+    def iter_entries(self, client_uuid):
+        """Yield the client's entries, oldest first."""
+        for _, _, entry in self.scan(client_uuid):
+            yield entry
+
+    def iter_json_lines(self, client_uuid):
+        """Like `iter_entries`, but yield each entry's JSON text."""
+        for _, line, _ in self.scan(client_uuid):
+            yield line
+
+    def scan(self, client_uuid, after=None, start=None, end=None, min_depth=None, max_depth=None):
+        """
+        Yield (cursor, JSON text, entry) for the client's entries, oldest first, starting after the entry whose
+        cursor is `after`. `start`/`end` ("YYYY-MM-DD HH:MM:SS", inclusive) and `min_depth`/`max_depth` (m,
+        inclusive) filter the entries; entries without a timestamp never match a time filter. Cursors are
+        opaque strings; a cursor this store did not produce raises ValueError.
+        """
+        raise NotImplementedError
+
+
+class NDJSONLogStore(LogStore):
+    """
+    One append-only `.ndjson` file per client in the hash-sharded `log_dir`, picking up logs left in the flat
+    `legacy_dir` layout.
+    """
+
+    append_ordered = True
+
+    def __init__(self, log_dir, legacy_dir=None):
+        self.log_dir = log_dir
+        self.legacy_dir = legacy_dir
+        self._migrated = set()  # Clients already checked for a log in the old layout
+
+    def location(self, client_uuid):
+        path = log_path(self.log_dir, client_uuid)
+        make_dirs(os.path.dirname(path))
+        if client_uuid not in self._migrated:
+            if self.legacy_dir is not None:
+                migrate_client(self.legacy_dir, client_uuid, path)
+            self._migrated.add(client_uuid)
+        return path
+
+    def ensure(self, client_uuid):
+        repair(self.location(client_uuid))
+
+    def version(self, client_uuid):
+        try:
+            stat = os.stat(self.location(client_uuid))
+        except FileNotFoundError:
+            return (0, 0)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def append(self, client_uuid, entry):
+        return append_entry(self.location(client_uuid), entry)
+
+    def append_many(self, client_uuid, entries, sync=False):
+        return append_entries(self.location(client_uuid), entries, sync)
+
+    def scan(self, client_uuid, after=None, start=None, end=None, min_depth=None, max_depth=None):
+        # The cursor is the byte offset just past an entry's line, so a page starts with one seek. It counts the
+        # bytes compaction has since moved out of the log too, so the entries left keep their cursors.
+        cursor = 0
+        if after is not None:
+            try:
+                cursor = int(after)
+            except ValueError:
+                raise ValueError("Invalid cursor")
+        path = self.location(client_uuid)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            if cursor:
+                raise ValueError("Invalid cursor")
+            return
+        with file:
+            base = compacted_bytes(path, os.fstat(file.fileno()).st_ino)
+            # A cursor in the compacted part continues with the first entry still in the log
+            offset = max(0, cursor - base) if cursor >= 0 else cursor
+            for end_offset, line, entry in _read_lines(file, path, offset):
+                if entry_matches(entry, start, end, min_depth, max_depth):
+                    yield str(base + end_offset), line, entry
+
+
+def log_path(log_dir, client_uuid):
+    """
+    `<log_dir>/ab/cd/<uuid>.ndjson`, where ab and cd are the first bytes of the UUID's SHA-1. A UUID that is
+    not a plain file name (slashes, dots, ...) is stored under its digest instead.
+    """
+    digest = hashlib.sha1(client_uuid.encode("utf-8")).hexdigest()
+    name = client_uuid if _SAFE_NAME.fullmatch(client_uuid) else digest
+    return os.path.join(log_dir, digest[:2], digest[2:4], name + LOG_SUFFIX)
+
+
+def make_dirs(directory):
+    """`os.makedirs(directory, exist_ok=True)`, once per directory and process."""
+    if directory not in _made_dirs:
+        os.makedirs(directory, exist_ok=True)
+        _made_dirs.add(directory)
+
+
+def append_entry(path, entry):
+    """Append one entry as a single line."""
+    return append_entries(path, [entry])
+
+
+def append_entries(path, entries, sync=False):
+    """Append entries as lines with one buffered write, fsynced if `sync`. Returns the bytes written."""
+    lines = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries)
+    if path not in _checked_paths:
+        with _checked_lock:
+            repair(path)
+            _checked_paths.add(path)
+    while True:
+        with open(path, "a", encoding="utf-8") as file, locked(file):
+            if replaced(file, path):
+                continue  # Compaction swapped the file while this write waited for the lock
+            file.write(lines)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+            return len(lines)  # json.dumps escapes everything outside ASCII, so characters are bytes
+
+
+@contextlib.contextmanager
+def locked(file):
+    """Hold an exclusive lock on an open log file, against compaction in this or another process."""
+    if fcntl is None:
+        with _file_lock:
+            yield file
+        return
+    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    try:
+        yield file
+    finally:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def replaced(file, path):
+    """Whether `path` no longer names the open `file` (it was replaced or removed after being opened)."""
+    try:
+        return os.fstat(file.fileno()).st_ino != os.stat(path).st_ino
+    except FileNotFoundError:
+        return True
+
+
+def iter_entries(path):
+    """Yield the entries of a log file one line at a time; a missing file has none."""
+    for _, _, entry in _iter_lines(path):
+        yield entry
+
+
+def iter_json_lines(path):
+    """Like `iter_entries`, but yield each entry's JSON text (validated, not re-serialized)."""
+    for _, line, _ in _iter_lines(path):
+        yield line
+
+
+def repair(path):
+    """
+    Create the file if it is missing and drop a torn last line left by a crash (one that only lacks its newline
+    gets it back). Returns True if it truncated.
+    """
+    if not os.path.exists(path):
+        open(path, "a").close()
+        return False
+    with open(path, "rb+") as file:
+        size = file.seek(0, os.SEEK_END)
+        if size == 0:
+            return False
+        file.seek(size - 1)
+        if file.read(1) == b"\n":
+            return False
+        # Walk back to the end of the last complete line
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            file.seek(position - step)
+            chunk = file.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        file.seek(position)
+        try:
+            json.loads(file.read(size - position).decode("utf-8"))
+        except ValueError:
+            tracer.warning("log.torn_line", "⚠️ Dropping torn last line ({bytes} bytes) of {path}",
+                           bytes=size - position, path=path)
+            file.truncate(position)
+            return True
+        file.write(b"\n")  # Only the newline was lost; keep the entry
+        return False
+
+
+def migrate(legacy_path, path):
+    """
+    Convert a JSON-array log to JSON Lines at `path`, unless `path` already exists. The original is renamed to
+    `.json.migrated`. Returns the number of entries migrated, or None if there was nothing to do.
+    """
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return None
+    try:
+        with open(legacy_path, "r", encoding="utf-8") as file:
+            entries = json.load(file)
+        if not isinstance(entries, list):
+            raise ValueError("not a JSON array")
+    except ValueError as e:
+        tracer.warning("log.migrate_unreadable", "⚠️ Not migrating unreadable log {path}: {error}",
+                       path=legacy_path, error=str(e))
+        entries = []
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        for entry in entries:
+            file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    os.replace(legacy_path, legacy_path + ".migrated")
+    tracer.info("log.migrated", "📦 Migrated {entries} log entries from {source} to {path}", entries=len(entries),
+                source=legacy_path, path=path)
+    return len(entries)
+
+
+def move_log(legacy_path, path):
+    """
+    Move a JSON Lines log from the old flat layout to `path`, ahead of any entries already there. Returns False
+    if there was nothing to move.
+    """
+    if not os.path.exists(legacy_path):
+        return False
+    try:
+        repair(legacy_path)  # A torn last line would run into the entries after it
+        if not os.path.exists(path):
+            shutil.move(legacy_path, path)
+        else:
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as file:
+                for source in (legacy_path, path):
+                    with open(source, "rb") as lines:
+                        shutil.copyfileobj(lines, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, path)
+            os.remove(legacy_path)
+    except FileNotFoundError:
+        return False  # Not there, or another process moved it first
+    tracer.info("log.moved", "📦 Moved log {source} to {path}", source=legacy_path, path=path)
+    return True
+
+
+def migrate_client(legacy_dir, client_uuid, path):
+    """Bring the client's log over from the flat `legacy_dir` layout to `path`, if it has one there."""
+    if "/" in client_uuid or os.sep in client_uuid or client_uuid in (".", ".."):
+        return
+    legacy_path = os.path.join(legacy_dir, f"{LEGACY_PREFIX}{client_uuid}")
+    move_log(legacy_path + LOG_SUFFIX, path)
+    migrate(legacy_path + LEGACY_SUFFIX, path)
+
+
+def migrate_directory(legacy_dir, log_dir):
+    """Move every log in the flat `legacy_dir` into its shard of `log_dir`; returns the clients migrated."""
+    clients = set()
+    for name in sorted(os.listdir(legacy_dir)):
+        if not name.startswith(LEGACY_PREFIX):
+            continue
+        for suffix in (LOG_SUFFIX, LEGACY_SUFFIX):
+            if name.endswith(suffix):
+                client_uuid = name[len(LEGACY_PREFIX):-len(suffix)]
+                path = log_path(log_dir, client_uuid)
+                make_dirs(os.path.dirname(path))
+                migrate_client(legacy_dir, client_uuid, path)
+                clients.add(client_uuid)
+    return sorted(clients)
+
+
+def compacted_bytes(path, inode):
+    """
+    How many bytes log_archive.py's compactions have moved out of the front of the log at `path`, whose open
+    file has `inode`, read from the last row of its archive index (0 if it was never compacted).
+    """
+    index_path = (path[:-len(LOG_SUFFIX)] if path.endswith(LOG_SUFFIX) else path) + ARCHIVE_INDEX_SUFFIX
+    try:
+        with open(index_path, "rb") as index:
+            index.seek(max(0, index.seek(0, os.SEEK_END) - 4096))  # Index rows are a few hundred bytes
+            tail = index.read()
+    except FileNotFoundError:
+        return 0
+    for line in reversed(tail.splitlines()):
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue  # Torn last row, or the cut-off first line of the tail
+        if "base" not in row:
+            return 0  # Compacted before the index recorded it
+        if row["source"] == inode:
+            # The compaction that wrote this row has not replaced the file yet, which still holds its `cut` bytes
+            return row["base"] - row["cut"]
+        return row["base"]
+    return 0
+
+
+def _iter_lines(path, offset=0):
+    """Yield (byte offset after the line, line text, entry) from `offset`, which must start a line."""
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        if offset:
+            raise ValueError("Invalid cursor")
+        return
+    with file:
+        yield from _read_lines(file, path, offset)
+
+
+def _read_lines(file, path, offset=0):
+    """`_iter_lines` over an open file."""
+    if offset:
+        if offset < 0 or offset > file.seek(0, os.SEEK_END):
+            raise ValueError("Invalid cursor")
+        file.seek(offset - 1)
+        if file.read(1) != b"\n":
+            raise ValueError("Invalid cursor")
+    for line in file:
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            if not line.endswith(b"\n"):
+                break  # Torn last line from an interrupted write
+            tracer.warning("log.malformed_line", "⚠️ Skipping malformed line ending at byte {offset} of {path}",
+                           offset=offset, path=path)
+            continue
+        yield offset, line.rstrip(b"\n").decode("utf-8"), entry
+
+
+def entry_matches(entry, start, end, min_depth, max_depth):
+    """Whether an entry passes the time and depth range filters of `LogStore.scan`."""
+    if start is not None or end is not None:
+        timestamp = entry.get("timestamp")
+        if not isinstance(timestamp, str):
+            return False
+        if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+            return False
+    if min_depth is not None or max_depth is not None:
+        try:
+            depth = float(entry.get("depth"))
+        except (TypeError, ValueError):
+            return False
+        if (min_depth is not None and depth < min_depth) or (max_depth is not None and depth > max_depth):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    legacy_directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join("static", "logs")
+    log_directory = sys.argv[2] if len(sys.argv) > 2 else os.path.join("data", "logs")
+    result = migrate_directory(legacy_directory, log_directory)
+    print(f"Migrated the logs of {len(result)} client(s) from {legacy_directory} to {log_directory}")
@@ -0,0 +1,151 @@
+"""
+Write-behind queue in front of a LogStore.
+
+save_dive_log hands each entry to `LogWriter.submit`, which only queues it, so
+the /api/v1/dive and /api/v1/ascend requests no longer wait for the disk. One
+writer thread drains the queue, gathers the entries per client and writes each
+client's batch with a single `append_many` call, once `interval` seconds have
+passed since the first entry of the batch or `max_batch` entries are waiting.
+
+The durability mode sets what a write costs and what a crash can lose:
+
+- "fsync": every entry is written and synced on its own, as before, but off
+  the request path.
+- "group": one write and one sync per client per batch (group commit). A crash
+  loses at most the last `interval` seconds of entries.
+- "os": batched writes without syncing; the OS writes them back when it
+  likes, so a power loss can lose more, a process crash nothing once written.
+
+In every mode entries still in the queue are lost if the process is killed
+outright. `close` (registered with atexit by main.py) drains the queue on a
+normal shutdown, and readers call `flush` first so they see what was submitted.
+"""
+import queue
+import threading
+import time
+
+from tracing import tracer
+
+DURABILITY_MODES = ("fsync", "group", "os")
+
+_STOP = object()
+
+
+class LogWriter:
+    """Queues dive log entries and writes them to `store` in per-client batches on a background thread."""
+
+    def __init__(self, store, durability="group", interval=0.05, max_batch=256, queue_size=10000):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}")
+        self.store = store
+        self.durability = durability
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=queue_size)  # Full queue: submit blocks until the writer catches up
+        self._pending = {}  # client_uuid -> entries submitted but not yet written
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        self.syncs = 0
+        self.failed = 0
+
+    def submit(self, client_uuid, entry):
+        """Queue an entry for the client's log and return without waiting for it to be written."""
+        if self._closed:
+            # After shutdown started there is no writer left to drain the queue
+            self.store.append_many(client_uuid, [entry], sync=self.durability != "os")
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    # Started on first use so it also runs under servers that never execute main.py's __main__ block
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+        with self._lock:
+            self._pending[client_uuid] = self._pending.get(client_uuid, 0) + 1
+        self._queue.put((client_uuid, entry))
+
+    def flush(self, client_uuid=None, timeout=None):
+        """
+        Wait until everything submitted so far (only for `client_uuid`, if given) is written. Returns False if
+        `timeout` seconds passed first.
+        """
+        with self._lock:
+            if self._thread is None or not (self._pending.get(client_uuid) if client_uuid else self._pending):
+                return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Write out the queue and stop the writer; later submits write straight to the store."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            pending = sum(self._pending.values())
+        return {
+            "durability": self.durability,
+            "pending": pending,
+            "written": self.written,
+            "batches": self.batches,
+            "syncs": self.syncs,
+            "failed": self.failed
+        }
+
+    def _run(self):
+        batch = {}  # client_uuid -> entries waiting to be written
+        batched = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # The oldest entry of the batch has waited `interval` seconds
+
+            if isinstance(item, tuple):
+                client_uuid, entry = item
+                if self.durability == "fsync":
+                    self._write({client_uuid: [entry]})
+                    continue
+                batch.setdefault(client_uuid, []).append(entry)
+                batched += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+                if batched < self.max_batch:
+                    continue
+
+            self._write(batch)
+            batch, batched, deadline = {}, 0, None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def _write(self, batch):
+        sync = self.durability != "os"
+        for client_uuid, entries in batch.items():
+            try:
+                self.store.append_many(client_uuid, entries, sync=sync)
+                self.written += len(entries)
+                self.batches += 1
+                self.syncs += sync
+            except Exception as e:
+                # Dropped rather than retried forever; the session's in-memory log still has them
+                tracer.error("log.write_failed", "❌ Could not write {entries} log entries for {client_uuid}: {error}",
+                             entries=len(entries), client_uuid=client_uuid, error=str(e))
+                self.failed += len(entries)
+            with self._lock:
+                remaining = self._pending.get(client_uuid, 0) - len(entries)
+                if remaining > 0:
+                    self._pending[client_uuid] = remaining
+                else:
+                    self._pending.pop(client_uuid, None)
@@ -1,21 +1,46 @@
 from typing import TextIO
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 import os
+import atexit
 import json
+import queue
 from datetime import datetime
+import hmac
+import itertools
 import math
 import time
-from collections import defaultdict
-import traceback
+from types import MappingProxyType
 from flasgger import Swagger
+import numpy as np
 import os
 import signal
 import subprocess
 import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from flask import Blueprint, current_app, request, jsonify
 from functools import wraps
 
+from cache import LRUCache
+from decompression import ZHL16C
+import log_archive
+from log_cache import CachedLogStore
+from log_store import NDJSONLogStore
+from log_writer import LogWriter
+import metrics
+from metrics import MeteredLogStore, timed
+import montecarlo
+from profiles import MAX_DEPTH, compute_rgbm_factor, parse_segments, sample_count, simulate
+from ndl_table import NDLTable
+import profiling
+from sessions import DiveSession, SessionManager
+from sqlite_log_store import SQLiteLogStore
+from state_stream import HEARTBEAT, StateBroadcaster, format_event
+from tissue_engine import TissueModel
+import tracing
+from tracing import tracer
+
 # Create a blueprint for debug endpoints
 debug_bp = Blueprint('debug', __name__)
 
@@ -25,7 +50,9 @@ def admin_required(f):
     def decorated(*args, **kwargs):
         # Example: check for a custom API key in headers
         api_key = request.headers.get("X-DEBUG-API-KEY")
-        if not api_key or api_key != current_app.config.get("DEBUG_API_KEY"):
+        expected = current_app.config.get("DEBUG_API_KEY")
+        # Locked while no key is configured; compare_digest keeps the key from leaking through response times
+        if not api_key or not expected or not hmac.compare_digest(api_key.encode("utf-8"), expected.encode("utf-8")):
             return jsonify({"error": "Unauthorized"}), 401
         return f(*args, **kwargs)
 
@@ -41,19 +68,59 @@ def kill_port(port):
         for pid in pids:
             if pid:  # Avoid empty strings
                 os.kill(int(pid), signal.SIGKILL)
-        print(f"Killed processes on port {port}.")
+        tracer.info("debug.kill_port", "Killed processes on port {port}.", port=port)
     except subprocess.CalledProcessError:
-        print(f"No processes found on port {port}.")
+        tracer.info("debug.kill_port", "No processes found on port {port}.", port=port)
 
 
 app = Flask(__name__)
 app.config["ADMIN_TOKEN"] = "your-secret-admin-token"
+app.config["DEBUG_API_KEY"] = None  # X-DEBUG-API-KEY value the /debug endpoints require (None locks them)
 app.config["ENV"] = "development"
 app.config["DEBUG"] = True  # Optional, but useful for debugging
-
-# Now register the blueprint if in development mode:
-if app.config.get("ENV") == "development":
-    app.register_blueprint(debug_bp, url_prefix="/debug")
+app.config["SESSION_IDLE_TIMEOUT"] = 3600  # Seconds before an unused client session is dropped
+app.config["NDL_CACHE_SIZE"] = 4096  # Maximum number of memoized _calculate_ndl results
+app.config["NDL_TABLE_DIR"] = "data/ndl_tables"  # Precomputed NDL tables for the standard gas mixes
+app.config["NDL_BATCH_MAX_ROWS"] = 100000  # Largest request accepted by /api/v1/calculate_ndl/batch
+app.config["GF_LOW"] = 0.30  # Gradient factor at the first decompression stop
+app.config["GF_HIGH"] = 0.85  # Gradient factor on surfacing
+app.config["ASCENT_RATE"] = 9.0  # Metres per minute between decompression stops
+app.config["DESCENT_RATE"] = 18.0  # Metres per minute when a simulated profile goes deeper
+app.config["PROFILE_MAX_SAMPLES"] = 200000  # Largest timeline /api/v1/simulate_profile will produce
+app.config["MONTE_CARLO_WORKERS"] = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+app.config["MONTE_CARLO_MAX_ITERATIONS"] = 100000  # Largest run accepted by /api/v1/monte_carlo
+app.config["STATE_STREAM_INTERVAL"] = 1.0  # Seconds between state snapshots on /api/v1/state/stream
+app.config["STATE_STREAM_HEARTBEAT"] = 15.0  # Seconds of silence before a heartbeat event is sent
+app.config["STATE_STREAM_MAX_AGE"] = 300.0  # Seconds before a stream is ended; EventSource then reconnects
+app.config["STATE_LAZY_FIELD_TTL"] = 60.0  # Seconds snapshots keep computing an expensive state field after a read
+app.config["DIVE_LOG_CAPACITY"] = 10000  # Entries each session's in-memory dive log keeps before overwriting the oldest
+app.config["DIVE_LOG_MAX_CAPACITY"] = 1000000  # Largest capacity /api/v1/dive_log/capacity accepts
+app.config["LOG_STORAGE"] = "ndjson"  # Dive log backend: "ndjson" (one file per client) or "sqlite"
+app.config["LOG_DIR"] = "data/logs"  # Per-client .ndjson logs in ab/cd/ hash shards (ndjson storage)
+app.config["LEGACY_LOG_DIR"] = "static/logs"  # Old flat log directory; a client's log is moved from here on first use
+app.config["LOG_DATABASE"] = "data/dive_logs.sqlite3"  # Database file (sqlite storage)
+app.config["LOG_DURABILITY"] = "group"  # "fsync" (every entry on its own), "group" (one fsync per client batch) or "os"
+app.config["LOG_COMMIT_INTERVAL"] = 0.05  # Seconds the log writer gathers entries before writing a batch
+app.config["LOG_COMMIT_MAX_ENTRIES"] = 256  # Entries that make the log writer write a batch straight away
+app.config["LOG_COMPACTION_INTERVAL"] = 3600.0  # Seconds between runs archiving finished dives (0 disables)
+app.config["LOG_RETENTION_DAYS"] = None  # Archived dives that ended longer ago are deleted (None keeps them)
+app.config["LOG_ARCHIVE_MAX_BYTES"] = None  # Per-client archive size past which the oldest dives are deleted
+app.config["LOG_CACHE_MAX_BYTES"] = 64 * 1024 * 1024  # JSON text of parsed client logs kept in memory
+app.config["TRACE_LEVEL"] = "info"  # "debug" traces every NDL solve and dive step; "warning", "error" or "off" quiet it
+app.config["TRACE_SINK"] = "console"  # "console" (formatted messages on stdout) or "json" (one JSON object per event)
+app.config["TRACE_FILE"] = None  # File the json sink appends to (None: stdout)
+app.config["TRACE_SAMPLE_RATES"] = {"ndl.tissue": 0.01}  # Share of NDL solves whose per-tissue detail is traced
+app.config["LOGS_PAGE_SIZE"] = 100  # Entries per /api/v1/logs page when after= is given without limit=
+app.config["LOGS_MAX_PAGE_SIZE"] = 1000  # Largest limit= accepted by /api/v1/logs
+app.config["PROFILE_MAX_DURATION"] = 600  # Longest profiling session /debug/profile/start accepts, in seconds
+app.config["PROFILE_MAX_REQUESTS"] = 10000  # Most requests one profiling session may cover
+app.config["PROFILE_SAMPLE_INTERVAL"] = 0.005  # Default seconds between stack samples of the sampling profiler
+
+tracer.configure(level=app.config["TRACE_LEVEL"],
+                 sink=tracing.JSONSink(app.config["TRACE_FILE"]) if app.config["TRACE_SINK"] == "json"
+                 else tracing.ConsoleSink(),
+                 sample_rates=app.config["TRACE_SAMPLE_RATES"])
+atexit.register(tracer.flush)
 
 swagger_template = {
     "swagger": "2.0",
@@ -110,12 +177,151 @@ buhlmann_tissues = [
     {"tissue": 10, "half_time": 146, "M-value": 1.08}
 ]
 
-# Initialize persistent tissue state and last update time
-tissue_state = {tissue["tissue"]: 0.0 for tissue in buhlmann_tissues}
-last_update_time = time.time()
+# Array-backed view of the compartments used for all tissue loading and NDL math
+tissue_model = TissueModel(buhlmann_tissues)
+
+# ZH-L16C N₂/He compartments with a/b coefficients, used for ceilings and decompression stops
+deco_model = ZHL16C()
+
+# Memoized _calculate_ndl results, keyed on quantized depth/time/gas/RGBM inputs
+ndl_cache = LRUCache(app.config["NDL_CACHE_SIZE"])
+
+# Precomputed NDL grid for the standard mixes, built or memory-mapped on first use by get_ndl_table()
+ndl_table = None
+ndl_table_lock = threading.Lock()
+
+# Where save_dive_log, load_dive_logs and /api/v1/logs keep the per-client dive logs, with the parsed logs of
+# recently read clients cached in memory
+if app.config["LOG_STORAGE"] == "sqlite":
+    log_backend = SQLiteLogStore(app.config["LOG_DATABASE"])
+else:
+    log_backend = NDJSONLogStore(app.config["LOG_DIR"], legacy_dir=app.config["LEGACY_LOG_DIR"])
+log_storage_seconds = metrics.registry.histogram("divalgo_log_storage_seconds",
+                                                 "Time spent reading and writing dive log storage.", ["operation"],
+                                                 buckets=metrics.FUNCTION_BUCKETS)
+log_storage_bytes = metrics.registry.counter("divalgo_log_storage_bytes_total",
+                                             "JSON bytes read from and written to dive log storage.", ["operation"])
+log_size_bytes = metrics.registry.histogram("divalgo_log_size_bytes", "Size of a client log each time it is read in "
+                                            "full from storage.", buckets=metrics.BYTE_BUCKETS)
+log_storage = CachedLogStore(MeteredLogStore(log_backend, log_storage_seconds, log_storage_bytes, log_size_bytes),
+                             max_bytes=app.config["LOG_CACHE_MAX_BYTES"])
+
+# save_dive_log queues entries here; a background thread writes them to log_storage in per-client batches
+log_writer = LogWriter(log_storage, durability=app.config["LOG_DURABILITY"],
+                       interval=app.config["LOG_COMMIT_INTERVAL"], max_batch=app.config["LOG_COMMIT_MAX_ENTRIES"])
+atexit.register(log_writer.close)  # Write out queued entries on shutdown
+
+# Thread running background_state_update, started by start_background_state_update
+background_state_thread = None
+background_state_lock = threading.Lock()
+
+# Thread running background_log_compaction, started by start_background_log_compaction
+background_compaction_thread = None
+background_compaction_lock = threading.Lock()
+
+# Reads each streamed client's state snapshot once per tick and fans it out to its /api/v1/state/stream subscribers
+state_broadcaster = StateBroadcaster(lambda client_uuid: stream_state_snapshot(client_uuid),
+                                     interval=app.config["STATE_STREAM_INTERVAL"])
+
+# Worker processes for /api/v1/monte_carlo, started on first use by get_monte_carlo_executor()
+monte_carlo_executor = None
+monte_carlo_executor_lock = threading.Lock()
+
+# Profiles the requests of a /debug/profile session, between start_request_profile and finish_request_profile
+request_profiler = profiling.RequestProfiler()
+
+# Requests without a Client-UUID header share this session
+DEFAULT_CLIENT_UUID = "default"
+
+# Per-client diver state, tissue tensions, NDL smoothing and in-memory dive log
+sessions = SessionManager(lambda client_uuid: DiveSession(client_uuid, tissue_model, deco_model,
+                                                          dive_log_capacity=app.config["DIVE_LOG_CAPACITY"]))
+
+# Reported by /metrics; request timings are recorded by start_request_timer/record_request_metrics
+request_count = metrics.registry.counter("divalgo_http_requests_total", "HTTP requests served.",
+                                         ["method", "route", "status"])
+request_seconds = metrics.registry.histogram("divalgo_http_request_duration_seconds",
+                                             "Time to produce a response, by route.", ["method", "route"])
+function_seconds = metrics.registry.histogram("divalgo_function_duration_seconds",
+                                              "Time spent in the NDL, RGBM and decompression calculations.",
+                                              ["function"], buckets=metrics.FUNCTION_BUCKETS)
+metrics.registry.gauge("divalgo_sessions", "Live client sessions.", function=lambda: len(sessions))
+metrics.registry.gauge("divalgo_dive_log_entries", "Entries held by all in-memory session dive logs.",
+                       function=lambda: sum(footprint["entries"] for footprint in dive_log_footprints()))
+metrics.registry.gauge("divalgo_dive_log_bytes", "Bytes allocated by all in-memory session dive logs.",
+                       function=lambda: sum(footprint["bytes"] for footprint in dive_log_footprints()))
+metrics.registry.gauge("divalgo_physiology_clients", "Clients with data in the physiology store.",
+                       function=lambda: len(physiology_store))
+metrics.registry.gauge("divalgo_physiology_bytes", "JSON size of the data in the physiology store.",
+                       function=lambda: sum(len(json.dumps(data, default=str))
+                                            for data in list(physiology_store.values())))
+metrics.registry.counter("divalgo_cache_hits_total", "Lookups answered from the NDL and dive log caches.",
+                         ["cache"], function=lambda: cache_stats("hits"))
+metrics.registry.counter("divalgo_cache_misses_total", "Lookups the NDL and dive log caches could not answer.",
+                         ["cache"], function=lambda: cache_stats("misses"))
+metrics.registry.counter("divalgo_cache_evictions_total", "Entries evicted to keep the caches within their limits.",
+                         ["cache"], function=lambda: cache_stats("evictions"))
+metrics.registry.gauge("divalgo_cache_hit_ratio", "hits / (hits + misses) of the NDL and dive log caches.",
+                       ["cache"], function=lambda: cache_stats("hit_ratio"))
+metrics.registry.gauge("divalgo_cache_entries", "NDL results and client logs held by the caches.", ["cache"],
+                       function=lambda: {("ndl",): len(ndl_cache), ("log",): log_storage.stats()["clients"]})
+metrics.registry.gauge("divalgo_log_cache_bytes", "JSON size of the client logs held by the dive log cache.",
+                       function=lambda: log_storage.stats()["bytes"])
+metrics.registry.gauge("divalgo_log_writer_pending", "Dive log entries queued but not yet written.",
+                       function=lambda: log_writer.stats()["pending"])
+metrics.registry.counter("divalgo_log_writer_entries_total", "Dive log entries handled by the log writer.",
+                         ["result"],
+                         function=lambda: {("written",): log_writer.written, ("failed",): log_writer.failed})
+metrics.registry.counter("divalgo_log_writer_syncs_total", "fsyncs (or synced commits) made by the log writer.",
+                         function=lambda: log_writer.syncs)
+
+
+def get_session():
+    """Return the session of the requesting client, or the shared default session if no Client-UUID was sent."""
+    client_uuid = request.headers.get('Client-UUID')
+    if not client_uuid or "\x00" in client_uuid:
+        client_uuid = DEFAULT_CLIENT_UUID
+    return sessions.get(client_uuid)
+
+
+def dive_log_footprints():
+    """The `memory_footprint` of every live session's in-memory dive log."""
+    footprints = []
+    for session in sessions.all():
+        with session.lock:
+            footprints.append(session.dive_log.memory_footprint())
+    return footprints
+
+
+def cache_stats(key):
+    """One counter of the NDL and dive log caches' stats, keyed by cache for a labelled metric."""
+    return {("ndl",): ndl_cache.stats()[key], ("log",): log_storage.stats()[key]}
+
+
+def get_ndl_table():
+    """Return the precomputed NDL table, loading it from NDL_TABLE_DIR (or building it there) on first use."""
+    global ndl_table
+    if ndl_table is None:
+        with ndl_table_lock:
+            if ndl_table is None:
+                ndl_table = NDLTable.load_or_build(tissue_model, app.config["NDL_TABLE_DIR"])
+                tracer.info("ndl_table.ready", "📋 NDL table {fingerprint} ready for {mixes}",
+                            fingerprint=ndl_table.metadata["fingerprint"],
+                            mixes=", ".join(mix["name"] for mix in ndl_table.metadata["mixes"]))
+    return ndl_table
+
+
+def get_monte_carlo_executor():
+    """Return the process pool for Monte Carlo runs, creating it with MONTE_CARLO_WORKERS processes on first use."""
+    global monte_carlo_executor
+    if monte_carlo_executor is None:
+        with monte_carlo_executor_lock:
+            if monte_carlo_executor is None:
+                # Spawned workers only import montecarlo.py, not this app and its threads
+                monte_carlo_executor = ProcessPoolExecutor(max_workers=app.config["MONTE_CARLO_WORKERS"],
+                                                           mp_context=multiprocessing.get_context("spawn"))
+    return monte_carlo_executor
 
-# Global dive log (in-memory) for debugging
-dive_log = []
 
 @app.route('/swagger/')
 def swagger_ui():
@@ -147,14 +353,17 @@ def update_tissue_state_endpoint():
                 A: 1.23
                 B: 2.34
     """
-    update_tissue_state()
+    session = get_session()
+    with session.lock:
+        update_tissue_state(session)
+        tissue_state = tissue_model.as_dict(session.tissue_tensions)
     return jsonify({
         "message": "Tissue state updated successfully.",
         "tissue_state": tissue_state
     })
 
 
-def update_tissue_state():
+def update_tissue_state(session):
     """
     Example endpoint returning a message.
     ---
@@ -168,28 +377,58 @@ def update_tissue_state():
               type: string
               example: Hello, world!
     """
-    global tissue_state, last_update_time
-
     current_time = time.time()
-    dt_sec = current_time - last_update_time
+    dt_sec = current_time - session.last_update_time
     dt_min = dt_sec / 60.0  # convert seconds to minutes
-    last_update_time = current_time
+    session.last_update_time = current_time
 
-    # Get current depth from state
-    d = float(state.get("depth", 0))
-    surface_pressure = 1.0
-    # Calculate ambient pressure at current depth (assuming 1 atm per 10 m)
-    pressure_at_depth = surface_pressure + (d / 10)
-    inert_gas_pressure = pressure_at_depth * (state.get("nitrogen_fraction", 0.79) + state.get("helium_fraction", 0.0))
+    # Update every tissue compartment based on dt in one vectorized step
+    session.tissue_tensions = tissue_model.haldane(session.tissue_tensions, _inert_gas_pressure(session.state), dt_min)
+    session.nitrogen_tensions, session.helium_tensions = deco_model.load(
+        session.nitrogen_tensions, session.helium_tensions, float(session.state.get("depth", 0)),
+        session.state.get("nitrogen_fraction", 0.79), session.state.get("helium_fraction", 0.0), dt_min)
 
-    # Update each tissue compartment based on dt
-    for tissue in buhlmann_tissues:
-        tissue_id = tissue["tissue"]
-        half_time = tissue["half_time"]
-        k = math.log(2) / half_time
-        p_old = tissue_state[tissue_id]
-        p_new = inert_gas_pressure + (p_old - inert_gas_pressure) * math.exp(-k * dt_min)
-        tissue_state[tissue_id] = p_new
+
+def update_tissue_states(session_list):
+    """
+    Advance the tissue tensions of many sessions with a single (sessions x compartments) Haldane update.
+
+    Each session is read and written under its own lock; a session whose tissues were updated by
+    another thread in between keeps that newer result.
+    """
+    current_time = time.time()
+    snapshots = []
+    for session in session_list:
+        with session.lock:
+            state = session.state
+            snapshots.append((session, session.last_update_time, session.tissue_tensions,
+                              session.nitrogen_tensions, session.helium_tensions, _inert_gas_pressure(state),
+                              float(state.get("depth", 0)), state.get("nitrogen_fraction", 0.79),
+                              state.get("helium_fraction", 0.0)))
+    if not snapshots:
+        return
+
+    (session_list, last_update_times, tissue_tensions, nitrogen_tensions, helium_tensions, inert_gas_pressures,
+     depths, nitrogen_fractions, helium_fractions) = zip(*snapshots)
+    dt_min = [(current_time - last_update_time) / 60.0 for last_update_time in last_update_times]
+    tensions = tissue_model.haldane(np.vstack(tissue_tensions), inert_gas_pressures, dt_min)
+    nitrogen_tensions, helium_tensions = deco_model.load(np.vstack(nitrogen_tensions), np.vstack(helium_tensions),
+                                                         depths, nitrogen_fractions, helium_fractions, dt_min)
+
+    for session, last_update_time, new_tensions, nitrogen, helium in zip(session_list, last_update_times, tensions,
+                                                                         nitrogen_tensions, helium_tensions):
+        with session.lock:
+            if session.last_update_time == last_update_time:
+                session.tissue_tensions = new_tensions
+                session.nitrogen_tensions = nitrogen
+                session.helium_tensions = helium
+                session.last_update_time = current_time
+
+
+def _inert_gas_pressure(state):
+    """Inert gas (N₂ + He) partial pressure at the diver's current depth, assuming 1 atm per 10 m."""
+    pressure_at_depth = 1.0 + (float(state.get("depth", 0)) / 10)
+    return pressure_at_depth * (state.get("nitrogen_fraction", 0.79) + state.get("helium_fraction", 0.0))
 
 
 @app.route('/api/v1/padi_ndl_lookup', methods=['GET'])
@@ -212,11 +451,13 @@ def padi_ndl_lookup_endpoint():
               description: The residual no-decompression limit (NDL) in minutes.
               example: 30.5
     """
-    result = _padi_ndl_lookup()
+    session = get_session()
+    with session.lock:
+        result = _padi_ndl_lookup(session.state)
     return jsonify({"residual_ndl": result})
 
 
-def _padi_ndl_lookup():
+def _padi_ndl_lookup(state):
     """
     Example endpoint returning a message.
     ---
@@ -251,7 +492,7 @@ def _padi_ndl_lookup():
            140      : 5      --> 42.7 m : 5 min
 
     The function looks up (or linearly interpolates) the maximum allowed bottom time (NDL_max)
-    for the current depth (in meters) stored in the global `state`. It then subtracts the
+    for the current depth (in meters) stored in the client's `state`. It then subtracts the
     actual bottom time (in minutes) to yield the residual NDL.
     """
     # Get the current depth in meters
@@ -391,11 +632,14 @@ def log_dive_endpoint():
     except (ValueError, TypeError) as e:
         return jsonify({"error": "Invalid input", "message": str(e)}), 400
 
-    log_dive(depth, pressure, o2_toxicity, ndl, rgbm_factor, time_elapsed, time_at_depth)
+    session = get_session()
+    with session.lock:
+        log_dive(session, depth, pressure, o2_toxicity, ndl, rgbm_factor, time_elapsed, time_at_depth)
+        refresh_state_snapshot(session)  # The new entry changes accumulated_ndl
     return jsonify({"message": "Dive event logged successfully."})
 
 
-def log_dive(depth, pressure, o2_toxicity, ndl, rgbm_factor, time_elapsed, time_at_depth):
+def log_dive(session, depth, pressure, o2_toxicity, ndl, rgbm_factor, time_elapsed, time_at_depth):
     """
     A simple hello endpoint.
     ---
@@ -409,16 +653,116 @@ def log_dive(depth, pressure, o2_toxicity, ndl, rgbm_factor, time_elapsed, time_
               type: string
               example: Hello, world!
     """
-    entry = {
-        "Depth": depth,
-        "Pressure": pressure,
-        "Oxygen Toxicity": o2_toxicity,
-        "NDL": ndl,
-        "RGBM Factor": rgbm_factor,
-        "Time Elapsed": time_elapsed,
-        "Time at Depth": time_at_depth
-    }
-    dive_log.append(entry)
+    with session.lock:
+        state = session.state
+        entry = {
+            "Depth": depth,
+            "Pressure": pressure,
+            "Oxygen Toxicity": o2_toxicity,
+            "NDL": ndl,
+            "RGBM Factor": rgbm_factor,
+            "Time Elapsed": time_elapsed,
+            "Time at Depth": time_at_depth,
+            "Inert Gas Fraction": state.get("nitrogen_fraction", 0.79) + state.get("helium_fraction", 0.0)
+        }
+        evicted = session.dive_log.append(depth, pressure, o2_toxicity, ndl, rgbm_factor, time_elapsed,
+                                          time_at_depth, entry["Inert Gas Fraction"])
+        if evicted is not None:
+            # The ring buffer dropped its oldest entry; fold it into the tensions replays start from
+            session.evicted_tensions, session.evicted_time = advance_accumulated_tensions(
+                session.evicted_tensions, session.evicted_time, evicted)
+
+        # Keep the accumulated tissue tensions current so the accumulated NDL never replays the log.
+        session.accumulated_tensions, session.accumulated_time = advance_accumulated_tensions(
+            session.accumulated_tensions, session.accumulated_time, entry)
+
+
+@app.route('/api/v1/dive_log/stats', methods=['GET'])
+def dive_log_stats():
+    """
+    Report the size and memory footprint of the client's in-memory dive log.
+    ---
+    tags:
+      - Dive Logs
+    produces:
+      - application/json
+    responses:
+      200:
+        description: Entries held and bytes used by the log's column arrays.
+        schema:
+          type: object
+          properties:
+            entries:
+              type: integer
+              example: 120
+            capacity:
+              type: integer
+              description: Entries kept before the oldest are overwritten.
+              example: 10000
+            allocated_entries:
+              type: integer
+              description: Entries the arrays currently have room for; grows by doubling up to the capacity.
+              example: 128
+            appended:
+              type: integer
+              example: 120
+            evicted:
+              type: integer
+              example: 0
+            bytes:
+              type: integer
+              example: 12288
+            bytes_per_entry:
+              type: integer
+              example: 96
+    """
+    session = get_session()
+    with session.lock:
+        return jsonify(session.dive_log.memory_footprint())
+
+
+@app.route('/api/v1/dive_log/capacity', methods=['POST'])
+def set_dive_log_capacity():
+    """
+    Change how many entries the client's in-memory dive log keeps.
+    ---
+    tags:
+      - Dive Logs
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - capacity
+          properties:
+            capacity:
+              type: integer
+              description: New capacity (1 to DIVE_LOG_MAX_CAPACITY). Shrinking drops the oldest entries.
+              example: 50000
+    responses:
+      200:
+        description: The log's memory footprint after resizing.
+      400:
+        description: Missing or invalid capacity.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        capacity = int(data["capacity"])
+        if not 1 <= capacity <= app.config["DIVE_LOG_MAX_CAPACITY"]:
+            raise ValueError(f"capacity must be between 1 and {app.config['DIVE_LOG_MAX_CAPACITY']}")
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": "Invalid input", "message": str(e)}), 400
+
+    session = get_session()
+    with session.lock:
+        for entry in session.dive_log.resize(capacity):
+            session.evicted_tensions, session.evicted_time = advance_accumulated_tensions(
+                session.evicted_tensions, session.evicted_time, entry)
+        return jsonify(session.dive_log.memory_footprint())
 
 
 @app.route('/api/v1/get_log_filename', methods=['GET'])
@@ -445,7 +789,7 @@ def get_log_filename_endpoint():
             log_filename:
               type: string
               description: The file path for the client's dive log.
-              example: "static/logs/dive_log_12345.json"
+              example: "data/logs/8c/b2/12345.ndjson"
       400:
         description: Missing Client-UUID header.
         schema:
@@ -477,9 +821,7 @@ def get_log_filename(client_uuid):
               type: string
               example: Hello, world!
     """
-    log_dir = "static/logs"
-    os.makedirs(log_dir, exist_ok=True)
-    return os.path.join(log_dir, f"dive_log_{client_uuid}.json")
+    return log_storage.location(client_uuid)
 
 
 @app.route('/api/v1/ensure_log_file', methods=['POST'])
@@ -552,17 +894,7 @@ def ensure_log_file(client_uuid):
               type: string
               example: Hello, world!
     """
-    log_file = get_log_filename(client_uuid)
-    if not os.path.exists(log_file):
-        with open(log_file, "w") as file:
-            json.dump([], file)
-    else:
-        try:
-            with open(log_file, "r") as file:
-                json.load(file)
-        except json.JSONDecodeError:
-            with open(log_file, "w") as file:
-                json.dump([], file)
+    log_storage.ensure(client_uuid)
 
 
 @app.route('/api/v1/load_dive_logs', methods=['GET'])
@@ -623,8 +955,7 @@ def load_dive_logs_endpoint():
         return jsonify({"status": "error", "message": "Missing or invalid Client-UUID header"}), 400
 
     try:
-        logs = load_dive_logs(client_uuid)
-        return jsonify(logs)
+        return stream_dive_logs(client_uuid)
     except Exception as e:
         return jsonify({"error": "Internal server error", "message": str(e)}), 500
 
@@ -643,16 +974,27 @@ def load_dive_logs(client_uuid):
               type: string
               example: Hello, world!
     """
-    log_file = get_log_filename(client_uuid)
-    if not os.path.exists(log_file):
-        ensure_log_file(client_uuid)
-    try:
-        with open(log_file, "r") as file:
-            return json.load(file)
-    except json.JSONDecodeError:
-        print("Warning: Log file corrupted. Resetting...")
-        ensure_log_file(client_uuid)
-        return []
+    log_writer.flush(client_uuid)
+    return list(log_storage.iter_entries(client_uuid))
+
+
+def stream_dive_logs(client_uuid, lines=None):
+    """
+    A JSON array response of the client's log (or of the given JSON texts), streamed from storage without
+    building one list.
+    """
+    if lines is None:
+        log_writer.flush(client_uuid)
+        lines = log_storage.iter_json_lines(client_uuid)
+
+    def generate():
+        separator = "["
+        for line in lines:
+            yield separator + line
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    return Response(generate(), mimetype="application/json")
 
 
 @app.route('/api/v1/save_dive_log', methods=['POST'])
@@ -761,51 +1103,20 @@ def save_dive_log(client_uuid, entry):
               type: string
               example: Hello, world!
     """
-    log_file = get_log_filename(client_uuid)
-    logs = load_dive_logs(client_uuid)
-
     # Reset values at surface
     if entry["depth"] == 0:
         entry["time_at_depth"] = 0
         entry["rgbm_factor"] = 1.0
 
-    logs.append(entry)
-    temp_file = log_file + ".tmp"
-    with open(temp_file, "w") as file:
-        json.dump(logs, file, indent=4)
-    os.replace(temp_file, log_file)
+    log_writer.submit(client_uuid, entry)  # Written in the background; see log_writer.py
 
-    # Print all fields in the log entry
-    print("📝 Saved Log Entry:")
-    for key, value in entry.items():
-        print(f"{key}: {value}")
+    tracer.debug("log.saved", "📝 Saved Log Entry: {entry}", client_uuid=client_uuid, entry=entry)
 
     # Call log_dive with the required fields
-    log_dive(entry['depth'], entry['pressure'], entry['oxygen_toxicity'], entry['ndl'],
+    log_dive(sessions.get(client_uuid), entry['depth'], entry['pressure'], entry['oxygen_toxicity'], entry['ndl'],
              entry['rgbm_factor'], entry['total_time'], entry['time_at_depth'])
 
 
-# Global diver state
-state = {
-    "depth": 0,
-    "last_depth": 0,
-    "time_elapsed": 0,
-    "time_at_depth": 0,
-    "depth_start_time": time.time(),
-    "depth_durations": defaultdict(float),  # Changed to defaultdict to avoid KeyError
-    "ndl": -999,
-    "rgbm_factor": 1.0,
-    "pressure": 1.0,
-    "oxygen_toxicity": 0.21,
-    "oxygen_fraction": 0.21,
-    "nitrogen_fraction": 0.79,
-    "helium_fraction": 0.0,  # Added explicit helium_fraction initialization
-    "selected_deco_model": "bühlmann",
-    "use_rgbm_for_ndl": False,
-    "dive_start_time": None  # Initialize dive_start_time
-}
-
-
 @app.route('/api/v1/calculate_rgbm', methods=['GET'])
 def calculate_rgbm_endpoint():
     """
@@ -826,13 +1137,16 @@ def calculate_rgbm_endpoint():
               description: The RGBM factor, adjusted based on depth, time at depth, and gas mix.
               example: 1.23456
     """
-    factor = calculate_rgbm()
+    session = get_session()
+    with session.lock:
+        factor = calculate_rgbm(session.state)
     return jsonify({"rgbm_factor": factor})
 
 
-def calculate_rgbm():
+@timed(function_seconds, function="calculate_rgbm")
+def calculate_rgbm(state):
     """
-    Calculate the RGBM factor with higher precision, using the global `state` structure.
+    Calculate the RGBM factor with higher precision, using the client's `state` structure.
     """
     depth = state["depth"]
     time_at_depth = state["time_at_depth"]
@@ -840,19 +1154,12 @@ def calculate_rgbm():
     nitrogen_fraction = state["nitrogen_fraction"]
     helium_fraction = state.get("helium_fraction", 0.0)  # Default to 0 if not set
 
-    # Prevent division by zero for time_at_depth
-    if time_at_depth < 0.1:
-        time_at_depth = 0.1
-
-    inert_gas_fraction = nitrogen_fraction + helium_fraction  # Inert gas load in the body
-    base_rgbm_factor = (1 + time_at_depth / 60) * math.exp(-depth / 100)
+    state["rgbm_factor"] = float(compute_rgbm_factor(depth, time_at_depth, nitrogen_fraction, helium_fraction))
 
-    # Adjust RGBM factor based on the gas mix
-    gas_penalty_factor = 1 + (inert_gas_fraction - nitrogen_fraction) * 0.2  # Adjust based on inert gas fraction
-    state["rgbm_factor"] = round(base_rgbm_factor * gas_penalty_factor, 5)
-
-    print(f"🌊 Depth: {depth}m, Time: {time_at_depth}s, RGBM Factor: {state['rgbm_factor']}, "
-          f"Gas Mix: O₂={oxygen_fraction}, N₂={nitrogen_fraction}, He={helium_fraction}")
+    tracer.debug("rgbm.factor", "🌊 Depth: {depth}m, Time: {time_at_depth}s, RGBM Factor: {rgbm_factor}, "
+                 "Gas Mix: O₂={oxygen_fraction}, N₂={nitrogen_fraction}, He={helium_fraction}",
+                 depth=depth, time_at_depth=time_at_depth, rgbm_factor=state["rgbm_factor"],
+                 oxygen_fraction=oxygen_fraction, nitrogen_fraction=nitrogen_fraction, helium_fraction=helium_fraction)
 
     return state["rgbm_factor"]
 
@@ -866,6 +1173,12 @@ def calculate_accumulated_ndl_endpoint():
       - NDL Calculation
     produces:
       - application/json
+    parameters:
+      - name: verify
+        in: query
+        type: boolean
+        required: false
+        description: Also replay the whole dive log from scratch and report how far it is from the incremental result.
     responses:
       200:
         description: The accumulated NDL value, calculated using either the Bühlmann decompression model equations or the PADI Recreational Dive Planner method, optionally adjusted by the RGBM factor.
@@ -876,19 +1189,39 @@ def calculate_accumulated_ndl_endpoint():
               type: number
               description: The accumulated no-decompression limit in minutes.
               example: 35.0
+            replayed_accumulated_ndl:
+              type: number
+              description: (verify only) The same NDL computed by replaying the whole dive log from scratch.
+              example: 35.0
+            max_tension_difference:
+              type: number
+              description: (verify only) Largest difference between incremental and replayed tissue tensions.
+              example: 0.0
     """
-    ndl_result = calculate_accumulated_ndl()
-    return jsonify({"accumulated_ndl": ndl_result})
+    session = get_session()
+    with session.lock:
+        ndl_result = calculate_accumulated_ndl(session)
+        if request.args.get("verify", "").lower() not in ("1", "true", "yes"):
+            return jsonify({"accumulated_ndl": ndl_result})
+
+        replayed = replay_accumulated_tensions(session)
+        return jsonify({
+            "accumulated_ndl": ndl_result,
+            "replayed_accumulated_ndl": calculate_accumulated_ndl(session, tissue_tensions=replayed),
+            "max_tension_difference": float(np.max(np.abs(replayed - session.accumulated_tensions)))
+        })
 
 
-def calculate_accumulated_ndl():
+@timed(function_seconds, function="calculate_accumulated_ndl")
+def calculate_accumulated_ndl(session, tissue_tensions=None):
     """
     Calculate the accumulated NDL using either the Bühlmann decompression model equations
     or the PADI Recreational Dive Planner table, depending on a flag in the state.
 
-    For each tissue compartment, the tissue tension is updated using:
-        P(t+Δt) = P_A + (P(t) - P_A)*exp(-k*Δt)
-    where k = ln(2)/half_time and P_A is the ambient pressure at the compartment's depth.
+    The tissue tensions behind the accumulated NDL are kept up to date by `log_dive`, which
+    advances them by one log entry at a time (see `advance_accumulated_tensions`), so this
+    costs O(compartments) however long the dive has been running. `tissue_tensions` overrides
+    them, e.g. with the result of `replay_accumulated_tensions` when verifying.
 
     When the tissue compartment includes Bühlmann coefficients (a and b), the maximum allowed
     tissue tension is:
@@ -903,93 +1236,20 @@ def calculate_accumulated_ndl():
 
     Finally, if state["use_rgbm_for_ndl"] is True, the resulting NDL is divided by the current rgbm_factor.
     """
+    state = session.state
+
     # Use the PADI Recreational Dive Planner method if indicated.
     if state.get("use_padi_ndl", False):
-        ndl_result = _padi_ndl_lookup()
-    else:
+        ndl_result = _padi_ndl_lookup(state)
+    elif tissue_tensions is None and not session.dive_log:
         # Ensure we have some log entries.
-        if not dive_log:
-            ndl_result = 0
-        else:
-            # Initialize tissue gas tensions for each compartment (starting at 0)
-            tissue_tensions = {tissue["tissue"]: 0.0 for tissue in buhlmann_tissues}
-            surface_pressure = 1.0
-
-            # Sort the dive log by cumulative time at depth.
-            sorted_log = sorted(dive_log, key=lambda e: float(e.get("time_at_depth", e.get("Time at Depth", 0))))
-            previous_time = 0.0
-
-            for entry in sorted_log:
-                # Extract current cumulative time (in seconds)
-                current_time = float(entry.get("time_at_depth", entry.get("Time at Depth", 0)))
-                dt = (current_time - previous_time) / 60.0  # convert difference to minutes
-                previous_time = current_time
-                if dt <= 0:
-                    continue  # Skip if no time has elapsed
-
-                # Get the depth for this log entry
-                d = float(entry.get("depth", entry.get("Depth", 0)))
-                # Ambient pressure at this segment (1 atm at surface + 1 atm per 10 m)
-                pressure_at_depth = surface_pressure + (d / 10)
-                inert_gas_pressure = pressure_at_depth * (state.get("nitrogen_fraction", 0.79) +
-                                                          state.get("helium_fraction", 0.0))
-                # Update each tissue compartment using the time increment dt:
-                for tissue in buhlmann_tissues:
-                    tissue_id = tissue["tissue"]
-                    half_time = tissue["half_time"]
-                    k = math.log(2) / half_time
-                    p_old = tissue_tensions[tissue_id]
-                    # Equation: P(t+dt) = P_A + (P(t) - P_A)*exp(-k*dt)
-                    p_new = inert_gas_pressure + (p_old - inert_gas_pressure) * math.exp(-k * dt)
-                    tissue_tensions[tissue_id] = p_new
-
-            # Now, using the final tissue tensions, compute the allowed additional time (NDL)
-            current_depth = state["depth"]
-            ambient_pressure = surface_pressure + (current_depth / 10)
-            ndl_values = []
-
-            for tissue in buhlmann_tissues:
-                tissue_id = tissue["tissue"]
-                half_time = tissue["half_time"]
-                k = math.log(2) / half_time
-                current_tension = tissue_tensions[tissue_id]
-                # If Bühlmann coefficients are provided, use them.
-                a = tissue.get("a")
-                b = tissue.get("b")
-                if a is not None and b is not None:
-                    # Maximum allowable tissue tension according to Bühlmann:
-                    p_max = (ambient_pressure - a) / b
-                    numerator = ambient_pressure - p_max
-                    denominator = ambient_pressure - current_tension
-                    if denominator <= 0:
-                        ndl = 0
-                    else:
-                        try:
-                            ratio = numerator / denominator
-                            ndl = -1 / k * math.log(ratio)
-                        except Exception:
-                            ndl = 0
-                else:
-                    # Fallback: use the simplified M-value method.
-                    max_tension = tissue.get("M-value", 1.0) * surface_pressure
-                    numerator = ambient_pressure - max_tension
-                    denominator = ambient_pressure - current_tension
-                    if denominator <= 0:
-                        ndl = 0
-                    else:
-                        try:
-                            ratio = numerator / denominator
-                            ndl = -1 / k * math.log(ratio)
-                        except Exception:
-                            ndl = 0
-                ndl_values.append(ndl)
-
-            # Combine negative NDL values if any exist; otherwise, choose the smallest positive value.
-            negatives = [ndl for ndl in ndl_values if ndl < 0]
-            if negatives:
-                ndl_result = sum(negatives)
-            else:
-                ndl_result = min(ndl_values) if ndl_values else 0
+        ndl_result = 0
+    else:
+        if tissue_tensions is None:
+            tissue_tensions = session.accumulated_tensions
+        # Using the accumulated tissue tensions, compute the allowed additional time (NDL).
+        # Negative compartment times are summed; otherwise the smallest positive value is used.
+        ndl_result = float(tissue_model.tension_ndl(tissue_tensions, state["depth"]))
 
     # Integrate RGBM adjustment if enabled.
     if state.get("use_rgbm_for_ndl", False):
@@ -1000,6 +1260,41 @@ def calculate_accumulated_ndl():
     return round(ndl_result, 2)
 
 
+def advance_accumulated_tensions(tissue_tensions, previous_time, entry):
+    """
+    Load the tissues with one dive log entry.
+
+    The interval since the previous entry (by "Time Elapsed", in seconds) is spent at the entry's
+    depth breathing the entry's inert gas fraction:
+        P(t+Δt) = P_A + (P(t) - P_A)*exp(-k*Δt)
+    A clock that goes backwards (a reset dive timer) restarts the interval count without loading.
+    Returns the new tensions and the time they are valid for.
+    """
+    current_time = float(entry.get("Time Elapsed", 0))
+    if current_time <= previous_time:
+        return tissue_tensions, current_time  # No time has elapsed, or the dive clock restarted
+
+    dt = (current_time - previous_time) / 60.0  # convert difference to minutes
+    d = float(entry.get("Depth", 0))
+    # Ambient pressure at this segment (1 atm at surface + 1 atm per 10 m)
+    inert_gas_pressure = (1.0 + (d / 10)) * entry.get("Inert Gas Fraction", 0.79)
+    return tissue_model.haldane(tissue_tensions, inert_gas_pressure, dt), current_time
+
+
+def replay_accumulated_tensions(session):
+    """
+    Rebuild the accumulated tissue tensions by replaying every entry the dive log still holds, starting from the
+    tensions of the entries it has evicted (verification only).
+    """
+    tissue_tensions, previous_time = session.evicted_tensions, session.evicted_time
+    columns = session.dive_log.columns()
+    for time_elapsed, depth, inert_gas_fraction in zip(columns["time_elapsed"].tolist(), columns["depth"].tolist(),
+                                                       columns["inert_gas_fraction"].tolist()):
+        entry = {"Time Elapsed": time_elapsed, "Depth": depth, "Inert Gas Fraction": inert_gas_fraction}
+        tissue_tensions, previous_time = advance_accumulated_tensions(tissue_tensions, previous_time, entry)
+    return tissue_tensions
+
+
 @app.route('/api/v1/toggle-padi-ndl', methods=['POST'])
 def toggle_padi_ndl():
     """
@@ -1037,11 +1332,15 @@ def toggle_padi_ndl():
               example: true
     """
     data = request.get_json()
-    # Update the global state flag for using PADI table lookup
-    state["use_padi_ndl"] = data.get("use_padi_ndl", False)
-    message = f"PADI tables lookup {'enabled' if state['use_padi_ndl'] else 'disabled'}"
-    print(message)
-    return jsonify({"message": message, "use_padi_ndl": state["use_padi_ndl"]})
+    session = get_session()
+    with session.lock:
+        # Update the client's state flag for using PADI table lookup
+        state = session.state
+        state["use_padi_ndl"] = data.get("use_padi_ndl", False)
+        refresh_state_snapshot(session)
+        message = f"PADI tables lookup {'enabled' if state['use_padi_ndl'] else 'disabled'}"
+        tracer.info("padi.toggled", message, use_padi_ndl=state["use_padi_ndl"])
+        return jsonify({"message": message, "use_padi_ndl": state["use_padi_ndl"]})
 
 
 @app.route('/api/v1/update_time_at_depth', methods=['GET'])
@@ -1075,16 +1374,19 @@ def update_time_at_depth_endpoint():
               description: The recalculated RGBM factor.
               example: 1.05
     """
-    update_time_at_depth()
-    return jsonify({
-        "message": "Dive time and RGBM factor updated successfully.",
-        "time_elapsed": state["time_elapsed"],
-        "time_at_depth": state["time_at_depth"],
-        "rgbm_factor": state["rgbm_factor"]
-    })
+    session = get_session()
+    with session.lock:
+        state = session.state
+        update_time_at_depth(state)
+        return jsonify({
+            "message": "Dive time and RGBM factor updated successfully.",
+            "time_elapsed": state["time_elapsed"],
+            "time_at_depth": state["time_at_depth"],
+            "rgbm_factor": state["rgbm_factor"]
+        })
 
 
-def update_time_at_depth():
+def update_time_at_depth(state):
     """Update dive time and recalc time at depth and RGBM factor."""
     now = time.time()
 
@@ -1106,16 +1408,17 @@ def update_time_at_depth():
     state["depth_durations"][state["depth"]] += elapsed_at_depth
     state["time_at_depth"] = round(state["depth_durations"][state["depth"]], 2)
     state["depth_start_time"] = now
-    state["rgbm_factor"] = calculate_rgbm()
-    print(
-        f"🟢 DEBUG: Depth: {state['depth']}m, Time at Depth: {state['time_at_depth']} sec, RGBM: {state['rgbm_factor']:.5f}")
+    state["rgbm_factor"] = calculate_rgbm(state)
+    tracer.debug("state.time_at_depth", "🟢 DEBUG: Depth: {depth}m, Time at Depth: {time_at_depth} sec, RGBM: "
+                 "{rgbm_factor:.5f}", depth=state["depth"], time_at_depth=state["time_at_depth"],
+                 rgbm_factor=state["rgbm_factor"])
     state["last_depth"] = state["depth"]
 
 
 @app.route('/api/v1/calculate_ndl_stops', methods=['POST'])
 def calculate_ndl_stops():
     """
-    Calculate decompression stops based on dive parameters.
+    Calculate decompression stops from the client's live ZH-L16C tissue tensions.
     ---
     tags:
       - Decompression
@@ -1124,54 +1427,69 @@ def calculate_ndl_stops():
     parameters:
       - in: body
         name: body
-        description: Dive parameters required to calculate decompression stops.
+        description: >
+          Depth the ascent starts from and, optionally, the gas and gradient factors. The stops follow the
+          session's tissue tensions, so ndl, pressure, oxygen_toxicity, rgbm_factor, time_elapsed and time_at_depth
+          are accepted for compatibility but not used.
         required: true
         schema:
           type: object
+          required:
+            - depth
           properties:
             ndl:
               type: number
-              description: No-decompression limit in minutes.
+              description: (Optional, not used) No-decompression limit in minutes.
               example: -5.0
             depth:
               type: number
-              description: Current depth in meters.
+              description: Current depth in meters, from 0 to 350.
               example: 30
             pressure:
               type: number
-              description: Ambient pressure in ATA.
+              description: (Optional, not used) Ambient pressure in ATA.
               example: 4.0
             oxygen_toxicity:
               type: number
-              description: Calculated oxygen toxicity.
+              description: (Optional, not used) Calculated oxygen toxicity.
               example: 0.84
             rgbm_factor:
               type: number
-              description: Current RGBM factor applied to NDL calculation.
+              description: (Optional, not used) Current RGBM factor applied to NDL calculation.
               example: 1.0
             time_elapsed:
               type: number
-              description: Total elapsed dive time in seconds.
+              description: (Optional, not used) Total elapsed dive time in seconds.
               example: 600
             time_at_depth:
               type: number
-              description: Time spent at the current depth in seconds.
+              description: (Optional, not used) Time spent at the current depth in seconds.
               example: 120
             oxygen_fraction:
               type: number
-              description: (Optional) Fraction of oxygen in the breathing gas.
+              description: (Optional) Fraction of oxygen in the breathing gas, 0-1. Defaults to the session's gas.
               example: 0.21
             nitrogen_fraction:
               type: number
-              description: (Optional) Fraction of nitrogen in the breathing gas.
+              description: (Optional) Fraction of nitrogen in the breathing gas, 0-1. Defaults to the session's gas.
               example: 0.79
             helium_fraction:
               type: number
-              description: (Optional) Fraction of helium in the breathing gas.
+              description: >
+                (Optional) Fraction of helium in the breathing gas, 0-1; nitrogen and helium together at most 1.
+                Defaults to the session's gas.
               example: 0.0
+            gf_low:
+              type: number
+              description: (Optional) Gradient factor at the first stop, 0-1. Defaults to the server's GF_LOW.
+              example: 0.3
+            gf_high:
+              type: number
+              description: (Optional) Gradient factor on surfacing, 0-1. Defaults to the server's GF_HIGH.
+              example: 0.85
     responses:
       200:
-        description: A list of decompression stops with depth, duration, and reason.
+        description: ZH-L16C decompression stops from the client's current tissue tensions, with ceiling and time to surface.
         schema:
           type: object
           properties:
@@ -1183,23 +1501,47 @@ def calculate_ndl_stops():
                   depth:
                     type: number
                     description: The depth of the decompression stop in meters.
-                    example: 20
+                    example: 6
                   duration:
                     type: number
-                    description: The duration of the decompression stop in minutes.
-                    example: 10
+                    description: The duration of the decompression stop in whole minutes.
+                    example: 12
+                  gradient_factor:
+                    type: number
+                    description: Gradient factor the stop is cleared at.
+                    example: 0.65
                   reason:
                     type: string
                     description: The reason for the decompression stop.
-                    example: "NDL exceeded"
+                    example: "Ceiling must clear 3 m (GF 65%)"
+            ceiling:
+              type: number
+              description: Current ZH-L16C ceiling in meters at GF-low (0 when a direct ascent is allowed).
+              example: 19.2
+            gf_low:
+              type: number
+              example: 0.3
+            gf_high:
+              type: number
+              example: 0.85
+            time_to_surface:
+              type: number
+              description: Ascent time including stops, in minutes.
+              example: 55.4
+            deco_required:
+              type: boolean
+              example: true
       400:
-        description: Missing or invalid input parameters.
+        description: Missing or invalid depth, gas fractions or gradient factors, or no schedule clears within a day.
         schema:
           type: object
           properties:
             error:
               type: string
-              example: "Missing keys: ndl, depth, pressure, oxygen_toxicity, rgbm_factor, time_elapsed, time_at_depth"
+              example: "Invalid input"
+            message:
+              type: string
+              example: "Gas fractions must be between 0 and 1, with nitrogen and helium summing to at most 1"
       500:
         description: Internal server error.
         schema:
@@ -1212,46 +1554,50 @@ def calculate_ndl_stops():
               type: string
               example: "Detailed error message"
     """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({"error": "No JSON data received"}), 400
+
+    session = get_session()
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No JSON data received"}), 400
+        depth = _ascent_depth(data["depth"])
+        gf_low, gf_high = _gradient_factors(data)
+        # Gas fractions not given default to the session's gas, read under its lock
+        with session.lock:
+            state = session.state
+            oxygen_fraction = float(data.get("oxygen_fraction", state.get("oxygen_fraction", 0.21)))
+            nitrogen_fraction = float(data.get("nitrogen_fraction", state.get("nitrogen_fraction", 0.79)))
+            helium_fraction = float(data.get("helium_fraction", state.get("helium_fraction", 0.0)))
+        if not all(0 <= fraction <= 1 for fraction in (oxygen_fraction, nitrogen_fraction, helium_fraction)) \
+                or nitrogen_fraction + helium_fraction > 1:
+            raise ValueError("Gas fractions must be between 0 and 1, with nitrogen and helium summing to at most 1")
+    except KeyError:
+        return jsonify({"error": "Invalid input", "message": "Missing key: depth"}), 400
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": "Invalid input", "message": str(e)}), 400
 
-        required_keys = ["ndl", "depth", "pressure", "oxygen_toxicity", "rgbm_factor", "time_elapsed", "time_at_depth"]
-        missing_keys = [key for key in required_keys if key not in data]
-        if missing_keys:
-            return jsonify({"error": f"Missing keys: {', '.join(missing_keys)}"}), 400
-
-        ndl = float(data["ndl"])
-        depth = float(data["depth"])
-        pressure = float(data["pressure"])
-        oxygen_toxicity = float(data["oxygen_toxicity"])
-        rgbm_factor = float(data["rgbm_factor"])
-        time_elapsed = int(data["time_elapsed"])
-        time_at_depth = int(data["time_at_depth"])
-        # Use default values if gas fractions are not provided
-        oxygen_fraction = float(data.get("oxygen_fraction", state.get("oxygen_fraction", 0.21)))
-        nitrogen_fraction = float(data.get("nitrogen_fraction", state.get("nitrogen_fraction", 0.79)))
-        helium_fraction = float(data.get("helium_fraction", state.get("helium_fraction", 0.0)))
-
-        print(f"📩 Received: NDL={ndl}, Depth={depth}, Pressure={pressure}, O₂ Toxicity={oxygen_toxicity}, "
-              f"RGBM={rgbm_factor}, Time Elapsed={time_elapsed}, Time at Depth={time_at_depth}, "
-              f"O2={oxygen_fraction}, N₂={nitrogen_fraction}, He={helium_fraction}")
-
-        stops = generate_decompression_stops(ndl, depth, pressure, oxygen_toxicity, rgbm_factor, time_elapsed,
-                                             time_at_depth)
-        return jsonify({"stops": stops})
+    tracer.debug("deco.request", "📩 Received: Depth={depth}, O2={oxygen_fraction}, N₂={nitrogen_fraction}, "
+                 "He={helium_fraction}, GF {gf_low}/{gf_high}", depth=depth, oxygen_fraction=oxygen_fraction,
+                 nitrogen_fraction=nitrogen_fraction, helium_fraction=helium_fraction, gf_low=gf_low,
+                 gf_high=gf_high)
 
+    try:
+        with session.lock:
+            update_tissue_state(session)
+            schedule = generate_decompression_stops(session, depth, nitrogen_fraction, helium_fraction,
+                                                    gf_low, gf_high)
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": "Could not build a decompression schedule", "message": str(e)}), 400
     except Exception as e:
-        print(f"❌ Error processing request: {str(e)}")
-        traceback.print_exc()
+        tracer.error("deco.failed", "❌ Error processing request: {error}", exc_info=True, error=str(e))
         return jsonify({"error": "Internal server error", "message": str(e)}), 500
+    return jsonify(schedule)
 
 
 @app.route('/api/v1/decompression_stops', methods=['POST'])
 def get_decompression_stops():
     """
-    Generate decompression stops based on dive parameters.
+    Generate ZH-L16C decompression stops from the client's live tissue tensions.
     ---
     tags:
       - Decompression
@@ -1271,7 +1617,7 @@ def get_decompression_stops():
               example: -5.0
             depth:
               type: number
-              description: Current depth in meters.
+              description: Current depth in meters, from 0 to 350.
               example: 30
             pressure:
               type: number
@@ -1293,26 +1639,58 @@ def get_decompression_stops():
               type: number
               description: Time spent at the current depth in seconds.
               example: 120
+            gf_low:
+              type: number
+              description: (Optional) Gradient factor at the first stop, 0-1. Defaults to the server's GF_LOW.
+              example: 0.3
+            gf_high:
+              type: number
+              description: (Optional) Gradient factor on surfacing, 0-1. Defaults to the server's GF_HIGH.
+              example: 0.85
     responses:
       200:
-        description: A list of decompression stops with their depth, duration, and reason.
+        description: ZH-L16C decompression stops from the client's current tissue tensions, with ceiling and time to surface.
         schema:
-          type: array
-          items:
-            type: object
-            properties:
-              depth:
-                type: number
-                description: The depth at which a decompression stop is required.
-                example: 20
-              duration:
-                type: number
-                description: The duration in minutes of the decompression stop.
-                example: 10
-              reason:
-                type: string
-                description: The reason for the decompression stop.
-                example: "NDL exceeded"
+          type: object
+          properties:
+            stops:
+              type: array
+              items:
+                type: object
+                properties:
+                  depth:
+                    type: number
+                    description: The depth of the decompression stop in meters.
+                    example: 6
+                  duration:
+                    type: number
+                    description: The duration of the decompression stop in whole minutes.
+                    example: 12
+                  gradient_factor:
+                    type: number
+                    description: Gradient factor the stop is cleared at.
+                    example: 0.65
+                  reason:
+                    type: string
+                    description: The reason for the decompression stop.
+                    example: "Ceiling must clear 3 m (GF 65%)"
+            ceiling:
+              type: number
+              description: Current ZH-L16C ceiling in meters at GF-low (0 when a direct ascent is allowed).
+              example: 19.2
+            gf_low:
+              type: number
+              example: 0.3
+            gf_high:
+              type: number
+              example: 0.85
+            time_to_surface:
+              type: number
+              description: Ascent time including stops, in minutes.
+              example: 55.4
+            deco_required:
+              type: boolean
+              example: true
       400:
         description: Invalid or missing input parameters.
         schema:
@@ -1327,62 +1705,59 @@ def get_decompression_stops():
         return jsonify({"error": "Missing JSON data"}), 400
 
     try:
-        ndl = float(data.get("ndl"))
-        depth = float(data.get("depth"))
-        pressure = float(data.get("pressure"))
-        oxygen_toxicity = float(data.get("oxygen_toxicity"))
-        rgbm_factor = float(data.get("rgbm_factor"))
-        time_elapsed = float(data.get("time_elapsed"))
-        time_at_depth = float(data.get("time_at_depth"))
-    except (TypeError, ValueError):
-        return jsonify({"error": "Invalid input. Ensure all parameters are numeric."}), 400
-
-    stops = generate_decompression_stops(ndl, depth, pressure, oxygen_toxicity, rgbm_factor, time_elapsed,
-                                         time_at_depth)
-    return jsonify(stops)
+        # Stops follow the session's tissue tensions; the other dive parameters are no longer needed
+        depth = _ascent_depth(data.get("depth"))
+        gf_low, gf_high = _gradient_factors(data)
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": "Invalid input. Ensure all parameters are numeric.", "message": str(e)}), 400
+
+    session = get_session()
+    with session.lock:
+        update_tissue_state(session)
+        state = session.state
+        try:
+            schedule = generate_decompression_stops(session, depth, state.get("nitrogen_fraction", 0.79),
+                                                    state.get("helium_fraction", 0.0), gf_low, gf_high)
+        except (ValueError, OverflowError) as e:
+            return jsonify({"error": "Could not build a decompression schedule", "message": str(e)}), 400
+    return jsonify(schedule)
 
 
-def generate_decompression_stops(ndl, depth, pressure, oxygen_toxicity, rgbm_factor, time_elapsed, time_at_depth):
-    """
-    Example endpoint returning a message.
-    ---
-    responses:
-      200:
-        description: A successful response
-        schema:
-          type: object
-          properties:
-            message:
-              type: string
-              example: Hello, world!
-    """
-    """Generate decompression stops based on dive parameters."""
-    stops = []
-    if ndl <= 0:
-        # Start with a reasonable first stop depth
-        stop_depth = (depth // 10) * 10 - 10  # Round to nearest 10m and subtract 10
+def _ascent_depth(value):
+    """The depth an ascent starts from; ValueError outside 0-MAX_DEPTH m, which also bounds the schedule's loop."""
+    depth = float(value)
+    if not 0 <= depth <= MAX_DEPTH:  # Also false for NaN
+        raise ValueError(f"depth must be between 0 and {MAX_DEPTH:g} m")
+    return depth
 
-        # Make sure stop_depth is at least 3m and not greater than current depth - 3m
-        stop_depth = min(max(3, stop_depth), depth - 3)
 
-        while stop_depth > 0:
-            # Calculate stop time based on depth and NDL deficit
-            stop_time = max(3, int(abs(ndl) * (1 + (stop_depth / depth) * 0.5)))
-            reason = "NDL exceeded" if ndl < 0 else "NDL reached"
+def _gradient_factors(data):
+    """GF-low/GF-high from a request body, falling back to the configured defaults."""
+    gf_low = float(data.get("gf_low", app.config["GF_LOW"]))
+    gf_high = float(data.get("gf_high", app.config["GF_HIGH"]))
+    if not 0 < gf_low <= gf_high <= 1:
+        raise ValueError("Gradient factors must satisfy 0 < gf_low <= gf_high <= 1")
+    return gf_low, gf_high
 
-            stops.append({
-                "depth": stop_depth,
-                "duration": stop_time,
-                "reason": reason
-            })
 
-            # More frequent stops at shallower depths
-            if stop_depth > 9:
-                stop_depth -= 3
-            else:
-                stop_depth -= 3
+@timed(function_seconds, function="generate_decompression_stops")
+def generate_decompression_stops(session, depth, nitrogen_fraction, helium_fraction, gf_low, gf_high):
+    """
+    Build a ZH-L16C schedule with gradient factors from the session's current N₂/He tensions.
+    The ascent starts at `depth` and the given gas is breathed throughout.
+    """
+    schedule = deco_model.schedule(session.nitrogen_tensions, session.helium_tensions, max(0.0, depth),
+                                   nitrogen_fraction, helium_fraction, gf_low, gf_high,
+                                   ascent_rate=app.config["ASCENT_RATE"])
+    for stop in schedule["stops"]:
+        next_depth = max(0, stop["depth"] - 3)
+        stop["reason"] = f"Ceiling must clear {next_depth:g} m (GF {stop['gradient_factor'] * 100:.0f}%)"
 
-    return stops
+    schedule.update({"gf_low": gf_low, "gf_high": gf_high, "deco_required": bool(schedule["stops"])})
+    tracer.debug("deco.schedule", "🛑 ZH-L16C ceiling {ceiling} m, {stops} stops, TTS {time_to_surface} min "
+                 "(GF {gf_low:.0%}/{gf_high:.0%})", ceiling=schedule["ceiling"], stops=len(schedule["stops"]),
+                 time_to_surface=schedule["time_to_surface"], gf_low=gf_low, gf_high=gf_high)
+    return schedule
 
 
 @app.route('/api/v1/current_state', methods=['GET'])
@@ -1475,16 +1850,18 @@ def get_current_state_endpoint():
               description: Epoch time when the dive started.
               example: 1616580000.0
     """
-    current_state = get_current_state()
+    session = get_session()
+    with session.lock:
+        current_state = get_current_state(session.state)
     return jsonify(current_state)
 
 
-def get_current_state():
+def get_current_state(state):
     """
     Returns the current state as a dictionary.
     This includes all the fields you want to log.
     """
-    update_time_at_depth()  # Ensure state is up-to-date
+    update_time_at_depth(state)  # Ensure state is up-to-date
     return {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "depth": int(state["depth"]),
@@ -1494,7 +1871,7 @@ def get_current_state():
         "time_at_depth": state["time_at_depth"],
         "depth_start_time": state["depth_start_time"],
         "depth_durations": dict(state["depth_durations"]),
-        "ndl": _calculate_ndl(state["depth"], state["time_at_depth"] / 60),
+        "ndl": _calculate_ndl(state["depth"], state["time_at_depth"] / 60, state=state),
         "rgbm_factor": state["rgbm_factor"],
         "pressure": state["pressure"],
         "oxygen_toxicity": state["oxygen_toxicity"],
@@ -1566,31 +1943,33 @@ def dive():
     if not client_uuid or "\x00" in client_uuid:
         return jsonify({"status": "error", "message": "Missing or invalid Client-UUID header"}), 400
 
-    if 0 <= state["depth"] < 350:
-        # Capture the complete state (and update time if needed)
-        current_state = get_current_state()
+    session = sessions.get(client_uuid)
+    with session.lock:
+        state = session.state
+        if 0 <= state["depth"] < 350:
+            # Capture the complete state (and update time if needed)
+            current_state = get_current_state(state)
 
-        # Print all key-value pairs for debugging
-        print("📝 Current State:")
-        for key, value in current_state.items():
-            print(f"{key}: {value}")
+            tracer.debug("dive.state", "📝 Current State: {state}", client_uuid=client_uuid, state=current_state)
 
-        # Use the current state as the log entry
-        log_entry = current_state
-        save_dive_log(client_uuid, log_entry)
+            # Use the current state as the log entry
+            log_entry = current_state
+            save_dive_log(client_uuid, log_entry)
 
-        # Update state for the next depth (if needed)
-        state["last_depth"] = state["depth"]
-        state["depth"] += 10
-        state["pressure"] += 1
-        state["depth_start_time"] = time.time()
-        # Optionally, initialize the new depth in depth_durations
-        state["time_at_depth"] = state["depth_durations"][state["depth"]]
-        state["oxygen_toxicity"] = round(state["oxygen_fraction"] * state["pressure"], 2)
-        state["rgbm_factor"] = calculate_rgbm()
-        print(json.dumps(state, indent=4))
+            # Update state for the next depth (if needed)
+            state["last_depth"] = state["depth"]
+            state["depth"] += 10
+            state["pressure"] += 1
+            state["depth_start_time"] = time.time()
+            # Optionally, initialize the new depth in depth_durations
+            state["time_at_depth"] = state["depth_durations"][state["depth"]]
+            state["oxygen_toxicity"] = round(state["oxygen_fraction"] * state["pressure"], 2)
+            state["rgbm_factor"] = calculate_rgbm(state)
+            refresh_state_snapshot(session)
+            tracer.debug("dive.descended", "🌊 Descended to {depth} m: {state}", client_uuid=client_uuid,
+                         depth=state["depth"], state=state)
 
-    return jsonify(state)
+        return jsonify(state)
 
 
 @app.route('/api/v1/ascend', methods=['POST'])
@@ -1656,89 +2035,593 @@ def ascend():
     if not client_uuid or "\x00" in client_uuid:
         return jsonify({"status": "error", "message": "Missing or invalid Client-UUID header"}), 400
 
-    if state["depth"] > 0:
-        update_time_at_depth()
-        state["last_depth"] = state["depth"]
-        state["depth"] -= 10
-        if state["depth"] < 0:
-            state["depth"] = 0
-        state["depth_start_time"] = time.time()
-        state["time_at_depth"] = state["depth_durations"][state["depth"]]  # Using defaultdict, so no .get() needed
-
-        state["ndl"] = _calculate_ndl(state["depth"], state["time_at_depth"] / 60)
-        state["pressure"] = round(1 + (state["depth"] / 10), 2)
-        state["oxygen_toxicity"] = round(state["oxygen_fraction"] * state["pressure"], 2)
-        state["rgbm_factor"] = calculate_rgbm()
-
-        log_entry = {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "depth": state["depth"],
-            "pressure": state["pressure"],
-            "oxygen_toxicity": state["oxygen_toxicity"],
-            "ndl": state["ndl"],
-            "rgbm_factor": state["rgbm_factor"],
-            "total_time": max(1, round(state["time_elapsed"], 2)),
-            "time_at_depth": max(1, round(state["time_at_depth"], 2))
-        }
-        print(f"Ascending: {log_entry}")
-        save_dive_log(client_uuid, log_entry)
-
-    return jsonify(state)
-
-
-@app.route('/api/v1/logs', methods=['GET'])
-def get_logs():
+    session = sessions.get(client_uuid)
+    with session.lock:
+        state = session.state
+        if state["depth"] > 0:
+            update_time_at_depth(state)
+            state["last_depth"] = state["depth"]
+            state["depth"] -= 10
+            if state["depth"] < 0:
+                state["depth"] = 0
+            state["depth_start_time"] = time.time()
+            state["time_at_depth"] = state["depth_durations"][state["depth"]]  # Using defaultdict, so no .get() needed
+
+            state["ndl"] = _calculate_ndl(state["depth"], state["time_at_depth"] / 60, state=state)
+            state["pressure"] = round(1 + (state["depth"] / 10), 2)
+            state["oxygen_toxicity"] = round(state["oxygen_fraction"] * state["pressure"], 2)
+            state["rgbm_factor"] = calculate_rgbm(state)
+
+            log_entry = {
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "depth": state["depth"],
+                "pressure": state["pressure"],
+                "oxygen_toxicity": state["oxygen_toxicity"],
+                "ndl": state["ndl"],
+                "rgbm_factor": state["rgbm_factor"],
+                "total_time": max(1, round(state["time_elapsed"], 2)),
+                "time_at_depth": max(1, round(state["time_at_depth"], 2))
+            }
+            tracer.debug("dive.ascending", "Ascending: {entry}", client_uuid=client_uuid, entry=log_entry)
+            save_dive_log(client_uuid, log_entry)
+            refresh_state_snapshot(session)
+
+        return jsonify(state)
+
+
+@app.route('/api/v1/simulate_profile', methods=['POST'])
+def simulate_profile_endpoint():
     """
-    Retrieve dive logs for a given client.
+    Simulate a multi-level dive profile offline and stream its timeline.
     ---
     tags:
-      - Dive Logs
-    produces:
+      - Dive Simulation
+    consumes:
       - application/json
+    produces:
+      - application/x-ndjson
     parameters:
-      - name: Client-UUID
-        in: header
+      - in: header
+        name: Client-UUID
         type: string
+        required: false
+        description: Client whose gas mix fills in missing segment fractions (and whose tissues are used with use_session_tissues).
+      - in: body
+        name: body
         required: true
-        description: Unique identifier for the client whose dive logs are being requested.
-    responses:
-      200:
-        description: A JSON array containing the dive logs.
-        schema:
-          type: array
-          items:
-            type: object
-            # Define properties of a dive log entry if known, for example:
-            # properties:
-            #   timestamp:
-            #     type: string
-            #     description: The time when the log entry was recorded.
-            #     example: "2025-03-11 14:30:00"
-            #   depth:
-            #     type: number
-            #     description: The depth recorded in the dive log.
-            #     example: 30
-            #   pressure:
-            #     type: number
-            #     description: The ambient pressure in ATA.
-            #     example: 4.0
-      400:
-        description: Missing Client-UUID header.
         schema:
           type: object
+          required: [segments]
           properties:
-            error:
-              type: string
-              example: Missing Client-UUID
-    """
-    client_uuid = request.headers.get('Client-UUID')
-    if not client_uuid or "\x00" in client_uuid:
-        return jsonify({"status": "error", "message": "Missing or invalid Client-UUID header"}), 400
-
-    logs = load_dive_logs(client_uuid)
-    print(f"Loaded logs: {logs}")
-    return jsonify(logs)
-
+            segments:
+              type: array
+              description: Levels in dive order. The diver travels to each depth at the descent/ascent rate, then stays for duration minutes.
+              items:
+                type: object
+                required: [depth, duration]
+                properties:
+                  depth:
+                    type: number
+                    example: 30
+                  duration:
+                    type: number
+                    description: Minutes at this depth, not counting travel.
+                    example: 20
+                  oxygen_fraction:
+                    type: number
+                    example: 0.21
+                  nitrogen_fraction:
+                    type: number
+                    example: 0.79
+                  helium_fraction:
+                    type: number
+                    example: 0.0
+            interval_minutes:
+              type: number
+              description: Time between timeline rows. Every phase also gets a row at its end.
+              example: 1
+            descent_rate:
+              type: number
+              description: Metres per minute; defaults to DESCENT_RATE.
+              example: 18
+            ascent_rate:
+              type: number
+              description: Metres per minute; defaults to ASCENT_RATE.
+              example: 9
+            use_session_tissues:
+              type: boolean
+              description: Start from the client's current tissue tensions instead of unloaded tissues.
+              example: false
+            use_rgbm_for_ndl:
+              type: boolean
+              description: Divide each NDL by the row's RGBM factor.
+              example: false
+    responses:
+      200:
+        description: >
+          NDJSON timeline, one object per line with segment, time_minutes, depth, pressure, ppo2, ndl,
+          rgbm_factor, the gas fractions and tissue_tensions (compartment -> tension).
+      400:
+        description: Missing or invalid profile.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: "Segment 2 is missing duration"
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Missing JSON data"}), 400
+
+    session = get_session()
+    with session.lock:
+        state = session.state
+        defaults = {key: state.get(key, default) for key, default in (("oxygen_fraction", 0.21),
+                                                                      ("nitrogen_fraction", 0.79),
+                                                                      ("helium_fraction", 0.0))}
+        tensions = session.tissue_tensions.copy() if data.get("use_session_tissues", False) else None
+
+    try:
+        segments = parse_segments(data.get("segments"), defaults)
+        interval_minutes = float(data.get("interval_minutes", 1))
+        descent_rate = float(data.get("descent_rate", app.config["DESCENT_RATE"]))
+        ascent_rate = float(data.get("ascent_rate", app.config["ASCENT_RATE"]))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": "Invalid profile", "message": str(e)}), 400
+    if not all(math.isfinite(value) and value > 0 for value in (interval_minutes, descent_rate, ascent_rate)):
+        return jsonify({"error": "interval_minutes, descent_rate and ascent_rate must be greater than 0"}), 400
+
+    samples = sample_count(segments, interval_minutes, descent_rate, ascent_rate)
+    if samples > app.config["PROFILE_MAX_SAMPLES"]:
+        return jsonify({"error": f"Profile would produce {samples} rows; the limit is "
+                                 f"{app.config['PROFILE_MAX_SAMPLES']}. Use a larger interval_minutes."}), 400
+
+    tracer.info("profile.simulate", "🗺️ Simulating {segments} segments, {samples} rows every {interval_minutes} min",
+                segments=len(segments), samples=samples, interval_minutes=interval_minutes)
+    timeline = _profile_timeline(segments, interval_minutes, descent_rate, ascent_rate, tensions,
+                                 bool(data.get("use_rgbm_for_ndl", False)))
+    return Response(timeline, mimetype="application/x-ndjson")
+
+
+def _profile_timeline(segments, interval_minutes, descent_rate, ascent_rate, tensions, use_rgbm_for_ndl):
+    """Generate the NDJSON lines of a simulated profile, one chunk per phase."""
+    for phase in simulate(tissue_model, segments, interval_minutes, descent_rate, ascent_rate, tensions):
+        depths = phase["depth"]
+        pressures = tissue_model.ambient_pressure(depths)
+        ndl = tissue_model.tension_ndl(phase["tensions"], depths)
+        rgbm_factors = compute_rgbm_factor(depths, phase["time_at_depth"], phase["nitrogen_fraction"],
+                                    phase["helium_fraction"])
+        if use_rgbm_for_ndl:
+            ndl = ndl / rgbm_factors
+
+        columns = zip(phase["time"].round(2).tolist(), depths.round(2).tolist(), pressures.round(3).tolist(),
+                      (pressures * phase["oxygen_fraction"]).round(3).tolist(), np.round(ndl, 2).tolist(),
+                      rgbm_factors.tolist(), phase["tensions"].round(5).tolist())
+        lines = []
+        for time_minutes, depth, pressure, ppo2, ndl_value, rgbm_factor, tissue_row in columns:
+            lines.append(json.dumps({
+                "segment": phase["segment"],
+                "time_minutes": time_minutes,
+                "depth": depth,
+                "pressure": pressure,
+                "ppo2": ppo2,
+                "ndl": ndl_value,
+                "rgbm_factor": rgbm_factor,
+                "oxygen_fraction": phase["oxygen_fraction"],
+                "nitrogen_fraction": phase["nitrogen_fraction"],
+                "helium_fraction": phase["helium_fraction"],
+                "tissue_tensions": dict(zip(tissue_model.ids, tissue_row))
+            }))
+        yield "\n".join(lines) + "\n"
+
+
+@app.route('/api/v1/monte_carlo', methods=['POST'])
+def monte_carlo_endpoint():
+    """
+    Monte Carlo sensitivity analysis of a dive plan.
+    ---
+    tags:
+      - Dive Simulation
+    consumes:
+      - application/json
+    parameters:
+      - in: header
+        name: Client-UUID
+        type: string
+        required: false
+        description: Client whose gas mix fills in missing segment fractions.
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required: [segments]
+          properties:
+            segments:
+              type: array
+              description: The plan, in the same format as /api/v1/simulate_profile.
+              items:
+                type: object
+            iterations:
+              type: integer
+              description: Number of perturbed variants to evaluate.
+              example: 2000
+            seed:
+              type: integer
+              description: Seed for the perturbations; the same seed and iterations always give the same result.
+              example: 0
+            descent_rate:
+              type: number
+              example: 18
+            ascent_rate:
+              type: number
+              example: 9
+            gf_low:
+              type: number
+              example: 0.3
+            gf_high:
+              type: number
+              example: 0.85
+            use_rgbm_for_ndl:
+              type: boolean
+              example: false
+            perturbation:
+              type: object
+              description: Overrides for the default perturbation sizes.
+              properties:
+                descent_rate_sd:
+                  type: number
+                  description: Relative standard deviation of the descent rate.
+                  example: 0.2
+                bottom_time_sd:
+                  type: number
+                  description: Relative standard deviation of each segment's duration.
+                  example: 0.1
+                gas_fraction_tolerance:
+                  type: number
+                  description: The oxygen fraction varies uniformly by this much either way.
+                  example: 0.01
+                gradient_factor_tolerance:
+                  type: number
+                  description: GF-low and GF-high vary uniformly by this much either way.
+                  example: 0.05
+    responses:
+      200:
+        description: >
+          Distributions (mean, std, min, p5, p25, p50, p75, p95, max) of NDL at the deepest segment, RGBM factor,
+          ZH-L16C time to surface and stop count, plus the share of variants needing deco or violating the ceiling.
+        schema:
+          type: object
+          properties:
+            iterations:
+              type: integer
+              example: 2000
+            seed:
+              type: integer
+              example: 0
+            workers:
+              type: integer
+              example: 4
+            ndl:
+              type: object
+            rgbm_factor:
+              type: object
+            time_to_surface:
+              type: object
+            stop_count:
+              type: object
+            deco_required_probability:
+              type: number
+              example: 0.12
+            ceiling_violations:
+              type: object
+              properties:
+                count:
+                  type: integer
+                  example: 3
+                probability:
+                  type: number
+                  example: 0.0015
+      400:
+        description: Missing or invalid plan.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: "Invalid plan"
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Missing JSON data"}), 400
+
+    session = get_session()
+    with session.lock:
+        state = session.state
+        defaults = {key: state.get(key, default) for key, default in (("oxygen_fraction", 0.21),
+                                                                      ("nitrogen_fraction", 0.79),
+                                                                      ("helium_fraction", 0.0))}
+
+    try:
+        gf_low, gf_high = _gradient_factors(data)
+        perturbation = dict(montecarlo.DEFAULT_PERTURBATION)
+        overrides = data.get("perturbation") or {}
+        if not isinstance(overrides, dict):
+            raise ValueError("perturbation must be an object")
+        for key, value in overrides.items():
+            if key not in perturbation:
+                raise ValueError(f"Unknown perturbation '{key}'")
+            perturbation[key] = float(value)
+            if not 0 <= perturbation[key] <= 1:
+                raise ValueError(f"{key} must be between 0 and 1")
+        plan = {
+            "segments": parse_segments(data.get("segments"), defaults),
+            "descent_rate": float(data.get("descent_rate", app.config["DESCENT_RATE"])),
+            "ascent_rate": float(data.get("ascent_rate", app.config["ASCENT_RATE"])),
+            "gf_low": gf_low,
+            "gf_high": gf_high,
+            "use_rgbm_for_ndl": bool(data.get("use_rgbm_for_ndl", False)),
+            "perturbation": perturbation,
+            "compartments": buhlmann_tissues
+        }
+        iterations = int(data.get("iterations", 1000))
+        seed = int(data.get("seed", 0))
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": "Invalid plan", "message": str(e)}), 400
+    if not all(math.isfinite(rate) and rate > 0 for rate in (plan["descent_rate"], plan["ascent_rate"])):
+        return jsonify({"error": "descent_rate and ascent_rate must be greater than 0"}), 400
+    if not 1 <= iterations <= app.config["MONTE_CARLO_MAX_ITERATIONS"]:
+        return jsonify({"error": f"iterations must be between 1 and {app.config['MONTE_CARLO_MAX_ITERATIONS']}"}), 400
+    if seed < 0:
+        return jsonify({"error": "seed must not be negative"}), 400
+
+    started = time.time()
+    try:
+        result = montecarlo.run(plan, iterations, seed, get_monte_carlo_executor())
+    except ValueError as e:
+        return jsonify({"error": "Could not evaluate the plan", "message": str(e)}), 400
+    result["workers"] = app.config["MONTE_CARLO_WORKERS"]
+    tracer.info("monte_carlo.run", "🎲 Monte Carlo: {iterations} variants of {segments} segments in {seconds:.2f}s on "
+                "{workers} workers", iterations=iterations, segments=len(plan["segments"]),
+                seconds=time.time() - started, workers=result["workers"])
+    return jsonify(result)
+
+
+@app.route('/api/v1/logs', methods=['GET'])
+def get_logs():
+    """
+    Retrieve dive logs for a given client.
+    ---
+    tags:
+      - Dive Logs
+    produces:
+      - application/json
+    parameters:
+      - name: Client-UUID
+        in: header
+        type: string
+        required: true
+        description: Unique identifier for the client whose dive logs are being requested.
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Return one page of at most this many entries as {"entries", "next_cursor"} instead of the whole log.
+      - in: query
+        name: after
+        type: string
+        required: false
+        description: >
+          Opaque cursor from a previous page's next_cursor; the page starts with the entry after it. Compacting
+          the log into archived dives keeps cursors valid; one whose entry was archived continues with the
+          first entry still in the log.
+      - in: query
+        name: start
+        type: string
+        required: false
+        description: Only entries logged at or after this time (ISO 8601, e.g. "2025-03-11 14:00:00").
+      - in: query
+        name: end
+        type: string
+        required: false
+        description: Only entries logged at or before this time.
+      - in: query
+        name: min_depth
+        type: number
+        required: false
+        description: Only entries at least this deep (metres).
+      - in: query
+        name: max_depth
+        type: number
+        required: false
+        description: Only entries at most this deep (metres).
+      - in: query
+        name: stream
+        type: boolean
+        required: false
+        description: Stream the matching entries as JSON Lines (application/x-ndjson), one entry per line as it is read from storage.
+    responses:
+      200:
+        description: >
+          A JSON array containing the dive logs, or with limit/after a page {"entries": [...], "next_cursor": ...}
+          where next_cursor is null on the last page.
+        schema:
+          type: array
+          items:
+            type: object
+            # Define properties of a dive log entry if known, for example:
+            # properties:
+            #   timestamp:
+            #     type: string
+            #     description: The time when the log entry was recorded.
+            #     example: "2025-03-11 14:30:00"
+            #   depth:
+            #     type: number
+            #     description: The depth recorded in the dive log.
+            #     example: 30
+            #   pressure:
+            #     type: number
+            #     description: The ambient pressure in ATA.
+            #     example: 4.0
+      400:
+        description: Missing Client-UUID header, or an invalid parameter or cursor.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: Missing Client-UUID
+    """
+    client_uuid = request.headers.get('Client-UUID')
+    if not client_uuid or "\x00" in client_uuid:
+        return jsonify({"status": "error", "message": "Missing or invalid Client-UUID header"}), 400
+
+    try:
+        filters = parse_log_filters(request.args)
+        limit = request.args.get("limit")
+        after = request.args.get("after") or None  # An empty cursor starts from the beginning
+        if limit is not None:
+            limit = int(limit)
+            if not 1 <= limit <= app.config["LOGS_MAX_PAGE_SIZE"]:
+                raise ValueError(f"limit must be between 1 and {app.config['LOGS_MAX_PAGE_SIZE']}")
+        elif after is not None:
+            limit = app.config["LOGS_PAGE_SIZE"]
+        log_writer.flush(client_uuid)  # Include entries still queued for the writer
+        # Start the scan here so a bad cursor is a 400 rather than a broken stream
+        entries = log_storage.scan(client_uuid, after=after, **filters)
+        first = next(entries, None)
+    except ValueError as e:
+        return jsonify({"error": "Invalid input", "message": str(e)}), 400
+    if first is not None:
+        entries = itertools.chain([first], entries)
+
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        if limit is not None:
+            entries = itertools.islice(entries, limit)
+        return Response((line + "\n" for _, line, _ in entries), mimetype="application/x-ndjson")
+    if limit is None:
+        return stream_dive_logs(client_uuid, (line for _, line, _ in entries))
+
+    page = list(itertools.islice(entries, limit + 1))  # One extra entry tells whether there is a next page
+    next_cursor = page[limit - 1][0] if len(page) > limit else None
+    return jsonify({"entries": [entry for _, _, entry in page[:limit]], "next_cursor": next_cursor})
+
+
+def parse_log_filters(args):
+    """The time and depth range filters of a /api/v1/logs request, as keyword arguments for LogStore.scan."""
+    filters = {}
+    for name in ("start", "end"):
+        value = args.get(name)
+        if value is not None:
+            # Log timestamps are "YYYY-MM-DD HH:MM:SS" strings, which compare in time order
+            filters[name] = datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+    for name in ("min_depth", "max_depth"):
+        value = args.get(name)
+        if value is not None:
+            filters[name] = float(value)
+            if not math.isfinite(filters[name]):
+                raise ValueError(f"{name} must be a finite number")
+    return filters
+
+
+@app.route('/api/v1/logs/dives', methods=['GET'])
+def list_archived_dives():
+    """
+    List the client's finished dives that compaction has archived.
+    ---
+    tags:
+      - Dive Logs
+    produces:
+      - application/json
+    parameters:
+      - name: Client-UUID
+        in: header
+        type: string
+        required: true
+        description: Unique identifier for the client whose dives are listed.
+    responses:
+      200:
+        description: >
+          Archived dives, oldest first (empty with sqlite storage, which is not compacted). /api/v1/logs only
+          returns the entries since the last archived dive.
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              dive:
+                type: integer
+                example: 3
+              start:
+                type: string
+                example: "2025-03-11 14:00:00"
+              end:
+                type: string
+                example: "2025-03-11 14:45:10"
+              entries:
+                type: integer
+                example: 42
+              max_depth:
+                type: number
+                example: 30
+              length:
+                type: integer
+                description: Compressed size in bytes.
+                example: 812
+      400:
+        description: Missing Client-UUID header.
+    """
+    client_uuid = request.headers.get('Client-UUID')
+    if not client_uuid or "\x00" in client_uuid:
+        return jsonify({"status": "error", "message": "Missing or invalid Client-UUID header"}), 400
+    if not isinstance(log_backend, NDJSONLogStore):
+        return jsonify([])
+
+    fields = ("dive", "start", "end", "entries", "max_depth", "length")
+    return jsonify([{key: row[key] for key in fields}
+                    for row in log_archive.read_index(log_backend.location(client_uuid))])
+
+
+@app.route('/api/v1/logs/dives/<int:dive>', methods=['GET'])
+def get_archived_dive(dive):
+    """
+    Retrieve the log entries of one archived dive, decompressing only that dive.
+    ---
+    tags:
+      - Dive Logs
+    produces:
+      - application/json
+    parameters:
+      - name: Client-UUID
+        in: header
+        type: string
+        required: true
+        description: Unique identifier for the client whose dive is requested.
+      - name: dive
+        in: path
+        type: integer
+        required: true
+        description: Dive number from /api/v1/logs/dives.
+    responses:
+      200:
+        description: A JSON array with the dive's log entries.
+      400:
+        description: Missing Client-UUID header.
+      404:
+        description: No such archived dive.
+    """
+    client_uuid = request.headers.get('Client-UUID')
+    if not client_uuid or "\x00" in client_uuid:
+        return jsonify({"status": "error", "message": "Missing or invalid Client-UUID header"}), 400
+    if not isinstance(log_backend, NDJSONLogStore):
+        return jsonify({"error": "Dive not found"}), 404
+
+    try:
+        return jsonify(log_archive.read_dive(log_backend.location(client_uuid), dive))
+    except KeyError:
+        return jsonify({"error": "Dive not found"}), 404
+
 
 @app.route('/api/v1/state', methods=['GET'])
 def get_state():
@@ -1749,12 +2632,54 @@ def get_state():
       - Dive State
     produces:
       - application/json
+    parameters:
+      - in: query
+        name: mode
+        type: string
+        enum: [exact, fast]
+        required: false
+        description: >
+          "fast" reads the NDL from the precomputed table for the standard gas mixes; other mixes and depths fall
+          back to the exact solver. Snapshots hold both NDLs while they are being read, so the mode only picks
+          which one is returned.
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: >
+          Comma-separated fields to return (e.g. "ndl,accumulated_ndl"). The NDL, accumulated_ndl and
+          buhlmann_ndl are only kept up to date in the background while they are read (STATE_LAZY_FIELD_TTL
+          seconds); the first read after a pause computes them on the spot.
+      - in: query
+        name: since
+        type: integer
+        required: false
+        description: Return only the fields that changed since this version, with "delta" true; if the version is no longer known the full payload is returned with "delta" false.
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
+        description: ETag of a previous response; answered with 304 while the state version is unchanged.
     responses:
       200:
         description: Dive state information including current depth, pressure, oxygen toxicity, NDL values, and decompression model settings.
+        headers:
+          ETag:
+            type: string
+            description: Identifies the state version (and NDL mode) of this response.
         schema:
           type: object
           properties:
+            version:
+              type: integer
+              description: >
+                Version of the snapshot served. Snapshots are recomputed every second in the background and
+                right after any change; the version increases whenever a value differs.
+              example: 42
+            delta:
+              type: boolean
+              description: Only present with since; true when the payload holds just the fields changed since that version.
+              example: true
             depth:
               type: number
               description: Current depth in meters.
@@ -1783,6 +2708,10 @@ def get_state():
               type: number
               description: Calculated no-decompression limit (NDL) in minutes.
               example: 35.0
+            ndl_mode:
+              type: string
+              description: How the NDL was obtained, "exact" (solver) or "fast" (precomputed table).
+              example: exact
             accumulated_ndl:
               type: number
               description: Accumulated NDL based on the entire dive log.
@@ -1826,80 +2755,291 @@ def get_state():
                   items:
                     type: object
                   description: Tissue compartments used in the Bühlmann decompression model.
+      304:
+        description: The snapshot has not changed since the version named in If-None-Match.
+      400:
+        description: Unknown field in fields, or since is not an integer.
     """
-    # Update time tracking before returning state
-    update_time_at_depth()
+    try:
+        fields = parse_state_fields(request.args.get("fields"))
+        since = request.args.get("since")
+        since = int(since) if since is not None else None
+    except ValueError as e:
+        return jsonify({"error": "Invalid input", "message": str(e)}), 400
 
-    log_entry = {
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "depth": state["depth"],
-        "pressure": state["pressure"],
-        "oxygen_toxicity": state["oxygen_toxicity"],
-        "ndl": state["ndl"],
-        "rgbm_factor": state["rgbm_factor"],
-        "total_time": max(1, round(state["time_elapsed"], 2)),
-        "time_at_depth": max(1, round(state["time_at_depth"], 2)),
-        "oxygen_fraction": state.get("oxygen_fraction", 0.21),
-        "nitrogen_fraction": state.get("nitrogen_fraction", 0.79),
-        "helium_fraction": state.get("helium_fraction", 0.0)
-    }
+    ndl_mode = "fast" if request.args.get("mode") == "fast" else "exact"
+
+    session = get_session()
+    snapshot = current_state_snapshot(session, lazy_state_fields(fields, ndl_mode))
+    variant = (ndl_mode + "+" + "+".join(sorted(fields) if fields else ["all"])
+               + (f"+since{since}" if since is not None else ""))
+    etag = f"{session.state_epoch}-{snapshot['version']}-{variant}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        payload = state_view(snapshot, ndl_mode, fields)
+        if since is not None:
+            with session.lock:
+                payload = state_delta(session, payload, since, ndl_mode)
+        response = jsonify(payload)
+    response.set_etag(etag)
+    # Always revalidate, and keep caches from mixing up clients that share the URL
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Client-UUID")
+    return response
+
+
+# Top-level fields of the /api/v1/state payload that can be requested with fields=; "version" is always sent
+STATE_FIELDS = (
+    "depth", "pressure", "oxygen_toxicity", "oxygen_fraction", "nitrogen_fraction", "helium_fraction", "ndl",
+    "ndl_mode", "accumulated_ndl", "rgbm_factor", "time_at_depth_minutes", "time_elapsed_minutes",
+    "selected_deco_model", "use_rgbm_for_ndl", "buhlmann_ndl"
+)
+
+
+def parse_state_fields(value):
+    """The set of fields named in a comma-separated fields= parameter, or None for all of them."""
+    if value is None:
+        return None
+    fields = {field.strip() for field in value.split(",") if field.strip()}
+    unknown = sorted(fields.difference(STATE_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown state field(s): {', '.join(unknown)}")
+    if not fields:
+        raise ValueError("fields must name at least one state field")
+    return fields
+
+
+# Expensive snapshot values, computed only for sessions that read them in the last STATE_LAZY_FIELD_TTL seconds:
+# the exact NDL (with ndl_mode), the table NDL of mode=fast (fast_ndl, fast_ndl_mode), the accumulated NDL and
+# the Bühlmann compartment table
+LAZY_STATE_FIELDS = ("ndl", "fast_ndl", "accumulated_ndl", "buhlmann_ndl")
+
+
+def lazy_state_fields(fields, ndl_mode):
+    """The LAZY_STATE_FIELDS that a read of `fields` (None: all) in `ndl_mode` needs."""
+    names = STATE_FIELDS if fields is None else fields
+    lazy = {name for name in ("accumulated_ndl", "buhlmann_ndl") if name in names}
+    if "ndl" in names or "ndl_mode" in names:
+        lazy.add("fast_ndl" if ndl_mode == "fast" else "ndl")
+    return lazy
+
+
+def state_view(snapshot, ndl_mode="exact", fields=None):
+    """
+    The /api/v1/state payload in `ndl_mode` from a snapshot, or from the values `session.record_state` kept for a
+    version: with mode=fast, fast_ndl and fast_ndl_mode are reported as ndl and ndl_mode. Only `fields` (None:
+    all) and the version are kept.
+    """
+    payload = {key: value for key, value in snapshot.items() if key not in ("fast_ndl", "fast_ndl_mode")}
+    if ndl_mode == "fast" and "fast_ndl" in snapshot:
+        payload["ndl"], payload["ndl_mode"] = snapshot["fast_ndl"], snapshot["fast_ndl_mode"]
+    if fields is not None:
+        payload = {key: value for key, value in payload.items() if key in fields or key == "version"}
+    return payload
 
-    print(f"Logging State: {log_entry}")
-    log_dive(log_entry['depth'], log_entry['pressure'], log_entry['oxygen_toxicity'],
-             log_entry['ndl'], log_entry['rgbm_factor'], log_entry['total_time'], log_entry['time_at_depth'])
+
+def current_state_snapshot(session, lazy=()):
+    """
+    The session's latest state snapshot, after noting that the LAZY_STATE_FIELDS in `lazy` were read. It is
+    computed right away if the background ticker has not made one yet, or if it lacks one of those fields
+    because nobody read it recently.
+    """
+    now = time.time()
+    for name in lazy:
+        session.state_reads[name] = now
+    snapshot = session.state_snapshot
+    if snapshot is None or not all(name in snapshot for name in lazy):
+        with session.lock:
+            snapshot = session.state_snapshot
+            if snapshot is None or not all(name in snapshot for name in lazy):
+                snapshot = refresh_state_snapshot(session)
+    return snapshot
+
+
+def wanted_state_fields(session):
+    """The LAZY_STATE_FIELDS read from the session's snapshots in the last STATE_LAZY_FIELD_TTL seconds."""
+    cutoff = time.time() - app.config["STATE_LAZY_FIELD_TTL"]
+    return {name for name, read in list(session.state_reads.items()) if read >= cutoff}
+
+
+def refresh_state_snapshot(session):
+    """
+    Recompute the session's derived state into a new read-only snapshot, which /api/v1/state and
+    /api/v1/state/stream serve as-is. Called for every session by `background_state_update` and right away
+    by endpoints that change the state. Of the LAZY_STATE_FIELDS, only those read recently are computed.
+    Hold `session.lock`.
+    """
+    payload = compute_state(session, wanted_state_fields(session))
+    payload["version"] = session.record_state(payload)
+    session.state_snapshot = MappingProxyType(payload)
+    return session.state_snapshot
+
+
+def compute_state(session, lazy=LAZY_STATE_FIELDS):
+    """
+    The STATE_FIELDS values of one session: advances the time at depth and refreshes the RGBM factor. Of the
+    LAZY_STATE_FIELDS, only those in `lazy` are derived; "fast_ndl" adds fast_ndl and fast_ndl_mode, the NDL
+    mode=fast reports. Nothing is logged; see `log_state_event`. Hold `session.lock`.
+    """
+    state = session.state
+
+    # Update time tracking before returning state
+    update_time_at_depth(state)
 
     depth = state["depth"]
-    pressure = state["pressure"]
-    oxygen_toxicity = state["oxygen_toxicity"]
-    time_at_depth_sec = state["time_at_depth"]
-    time_elapsed_sec = state["time_elapsed"]
-    rgbm_factor = state["rgbm_factor"]
-    selected_deco_model = state.get("selected_deco_model", "bühlmann")
     oxygen_fraction = state.get("oxygen_fraction", 0.21)
     nitrogen_fraction = state.get("nitrogen_fraction", 0.79)
     helium_fraction = state.get("helium_fraction", 0.0)
+    rgbm_factor = state["rgbm_factor"]
 
-    time_at_depth_min = round(time_at_depth_sec / 60, 2)
-    time_elapsed_min = round(time_elapsed_sec / 60, 2)
+    time_at_depth_min = round(state["time_at_depth"] / 60, 2)
+    time_elapsed_min = round(state["time_elapsed"] / 60, 2)
 
     # Ensure a minimum value for time_at_depth_min to avoid division by zero issues
-    if time_at_depth_min < 0.01:
-        time_at_depth_min = 0.01
-
-    # Calculate current NDL based on the current depth and time at that depth
-    ndl_value = _calculate_ndl(depth, time_at_depth_min, oxygen_fraction, nitrogen_fraction, helium_fraction)
+    ndl_time = max(time_at_depth_min, 0.01)
+    ndls = {}  # payload key -> (NDL, how it was obtained)
+    if "ndl" in lazy:
+        ndls["ndl"] = _calculate_ndl(depth, ndl_time, oxygen_fraction, nitrogen_fraction, helium_fraction,
+                                     state=state), "exact"
+    if "fast_ndl" in lazy:
+        ndls["fast_ndl"] = _fast_ndl(depth, ndl_time, oxygen_fraction, nitrogen_fraction, helium_fraction,
+                                     state=state)
     # Recalculate RGBM factor (if needed)
-    state["rgbm_factor"] = calculate_rgbm()
-
-    # Compute the accumulated NDL based on the entire dive log
-    accumulated_ndl = calculate_accumulated_ndl()
+    state["rgbm_factor"] = calculate_rgbm(state)
 
-    # Optionally adjust NDL if RGBM-based adjustment is enabled
-    if state.get("use_rgbm_for_ndl", False):
-        if state["rgbm_factor"] > 0:
-            ndl_value *= (1 / state["rgbm_factor"])
-        ndl_value = round(ndl_value, 2)
-
-    return jsonify({
+    payload = {
         "depth": depth,
-        "pressure": pressure,
-        "oxygen_toxicity": oxygen_toxicity,
+        "pressure": state["pressure"],
+        "oxygen_toxicity": state["oxygen_toxicity"],
         "oxygen_fraction": oxygen_fraction,
         "nitrogen_fraction": nitrogen_fraction,
         "helium_fraction": helium_fraction,
-        "ndl": ndl_value,
-        "accumulated_ndl": accumulated_ndl,
         "rgbm_factor": rgbm_factor,
         "time_at_depth_minutes": time_at_depth_min,
         "time_elapsed_minutes": time_elapsed_min,
-        "selected_deco_model": selected_deco_model,
-        "use_rgbm_for_ndl": state.get("use_rgbm_for_ndl", False),
-        "buhlmann_ndl": {
+        "selected_deco_model": state.get("selected_deco_model", "bühlmann"),
+        "use_rgbm_for_ndl": state.get("use_rgbm_for_ndl", False)
+    }
+
+    for key, (ndl_value, ndl_mode) in ndls.items():
+        # Optionally adjust NDL if RGBM-based adjustment is enabled
+        if state.get("use_rgbm_for_ndl", False):
+            if state["rgbm_factor"] > 0:
+                ndl_value *= (1 / state["rgbm_factor"])
+            ndl_value = round(ndl_value, 2)
+        payload[key] = ndl_value
+        payload[key + "_mode"] = ndl_mode
+
+    if "accumulated_ndl" in lazy:
+        # The accumulated NDL covers the logged events plus the time spent at the current depth since the last one
+        pending_entry = {"Time Elapsed": state["time_elapsed"], "Depth": depth,
+                         "Inert Gas Fraction": nitrogen_fraction + helium_fraction}
+        tissue_tensions, _ = advance_accumulated_tensions(session.accumulated_tensions, session.accumulated_time,
+                                                          pending_entry)
+        payload["accumulated_ndl"] = calculate_accumulated_ndl(session, tissue_tensions)
+
+    if "buhlmann_ndl" in lazy:
+        payload["buhlmann_ndl"] = {
             "gas_type": f"{oxygen_fraction * 100:.0f}% O₂, {nitrogen_fraction * 100:.0f}% N₂, {helium_fraction * 100:.0f}% He",
             "hlf_times": [tissue["half_time"] for tissue in buhlmann_tissues],
             "compartments": buhlmann_tissues
         }
-    })
+    return payload
+
+def log_state_event(session):
+    """
+    Append the current state to the session's dive log, like /api/v1/dive and /api/v1/ascend do through
+    `save_dive_log`. Called on explicit events before the state changes, so the entry covers the time spent in
+    the state it leaves; reads never log. Hold `session.lock`.
+    """
+    state = session.state
+    update_time_at_depth(state)
+    log_entry = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "depth": state["depth"],
+        "pressure": state["pressure"],
+        "oxygen_toxicity": state["oxygen_toxicity"],
+        "ndl": state["ndl"],
+        "rgbm_factor": state["rgbm_factor"],
+        "total_time": max(1, round(state["time_elapsed"], 2)),
+        "time_at_depth": max(1, round(state["time_at_depth"], 2))
+    }
+    tracer.debug("dive.logged", "Logging State: {entry}", client_uuid=session.client_uuid, entry=log_entry)
+    log_dive(session, log_entry['depth'], log_entry['pressure'], log_entry['oxygen_toxicity'],
+             log_entry['ndl'], log_entry['rgbm_factor'], log_entry['total_time'], log_entry['time_at_depth'])
+
+
+def state_delta(session, payload, since, ndl_mode="exact"):
+    """
+    Reduce a payload in `ndl_mode` to the fields that differ from what version `since` recorded. If that version
+    is no longer (or was never) known, the whole payload is returned with "delta" set to false.
+    """
+    base = session.state_snapshots.get(since)
+    if base is None:
+        return {**payload, "delta": False}
+    base = state_view(base, ndl_mode)
+    changes = {key: value for key, value in payload.items()
+               if key != "version" and (key not in base or base[key] != value)}
+    return {**changes, "version": payload["version"], "delta": True}
+
+
+@app.route('/api/v1/state/stream', methods=['GET'])
+def stream_state():
+    """
+    Stream the dive state as Server-Sent Events.
+    ---
+    tags:
+      - Dive State
+    produces:
+      - text/event-stream
+    parameters:
+      - in: query
+        name: client_uuid
+        type: string
+        required: false
+        description: Client to stream; EventSource cannot send the Client-UUID header, so it may be passed here instead.
+    responses:
+      200:
+        description: >
+          An event stream. Each message's data is the /api/v1/state payload, sent when it changes, at most once
+          per STATE_STREAM_INTERVAL seconds; the event id counts snapshots. A "heartbeat" event is sent after
+          STATE_STREAM_HEARTBEAT seconds without one, and the stream ends after STATE_STREAM_MAX_AGE seconds so
+          that no server thread is held indefinitely; EventSource reconnects after the advertised retry delay.
+    """
+    client_uuid = request.headers.get('Client-UUID') or request.args.get('client_uuid')
+    if not client_uuid or "\x00" in client_uuid:
+        client_uuid = DEFAULT_CLIENT_UUID
+    heartbeat = app.config["STATE_STREAM_HEARTBEAT"]
+    max_age = app.config["STATE_STREAM_MAX_AGE"]
+
+    def events():
+        # Subscribe inside the generator so the finally block always runs once streaming has started
+        subscriber = state_broadcaster.subscribe(client_uuid)
+        tracer.info("state_stream.opened", "📡 State stream opened for {client_uuid} ({subscribers} subscribers)",
+                    client_uuid=client_uuid, subscribers=state_broadcaster.subscriber_count())
+        try:
+            yield f"retry: {int(app.config['STATE_STREAM_INTERVAL'] * 3000)}\n\n"
+            deadline = time.monotonic() + max_age
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break  # The browser reconnects, and the server thread is free for other requests meanwhile
+                try:
+                    yield format_event(subscriber.get(timeout=min(heartbeat, remaining)))
+                except queue.Empty:
+                    yield HEARTBEAT
+        finally:
+            state_broadcaster.unsubscribe(client_uuid, subscriber)
+            tracer.info("state_stream.closed", "📡 State stream closed for {client_uuid}", client_uuid=client_uuid)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def stream_state_snapshot(client_uuid):
+    """State pushed to /api/v1/state/stream subscribers: the session's latest /api/v1/state snapshot, in full."""
+    return state_view(current_state_snapshot(sessions.get(client_uuid), lazy_state_fields(None, "exact")))
 
 
 @app.route('/api/v1/toggle-rgbm-ndl', methods=['POST'])
@@ -1934,12 +3074,12 @@ def toggle_rgbm_ndl():
               example: RGBM-based NDL calculation enabled
     """
     data = request.json
-    state["use_rgbm_for_ndl"] = data.get("use_rgbm", False)
-    return jsonify({"message": f"RGBM-based NDL calculation {'enabled' if state['use_rgbm_for_ndl'] else 'disabled'}"})
-
-
-# Global variable for smoothed NDL (initialize to a high value)
-smoothed_ndl = 200
+    session = get_session()
+    with session.lock:
+        state = session.state
+        state["use_rgbm_for_ndl"] = data.get("use_rgbm", False)
+        refresh_state_snapshot(session)
+        return jsonify({"message": f"RGBM-based NDL calculation {'enabled' if state['use_rgbm_for_ndl'] else 'disabled'}"})
 
 
 @app.route('/api/v1/compute_ndl', methods=['GET'])
@@ -1962,59 +3102,19 @@ def compute_ndl_endpoint():
               description: The computed no-decompression limit in minutes.
               example: 35.0
     """
-    ndl = compute_ndl()  # Call your compute_ndl function
+    session = get_session()
+    with session.lock:
+        ndl = compute_ndl(session)
     return jsonify({"ndl": ndl})
 
 
-def compute_ndl():
-    global smoothed_ndl
+@timed(function_seconds, function="compute_ndl")
+def compute_ndl(session):
+    state = session.state
 
-    surface_pressure = 1.0
-    current_depth = state.get("depth", 0)
-    ambient_pressure = surface_pressure + (current_depth / 10)
-    ndl_values = []
-
-    for tissue in buhlmann_tissues:
-        tissue_id = tissue["tissue"]
-        half_time = tissue["half_time"]
-        k = math.log(2) / half_time
-        current_tension = tissue_state[tissue_id]
-
-        # Use Bühlmann coefficients if available, otherwise use the M-value.
-        a = tissue.get("a")
-        b = tissue.get("b")
-        if a is not None and b is not None:
-            p_max = (ambient_pressure - a) / b
-            numerator = ambient_pressure - p_max
-            denominator = ambient_pressure - current_tension
-            if denominator <= 0:
-                ndl = 0
-            else:
-                try:
-                    ratio = numerator / denominator
-                    ndl = -1 / k * math.log(ratio)
-                except Exception:
-                    ndl = 0
-        else:
-            max_tension = tissue.get("M-value", 1.0) * surface_pressure
-            numerator = ambient_pressure - max_tension
-            denominator = ambient_pressure - current_tension
-            if denominator <= 0:
-                ndl = 0
-            else:
-                try:
-                    ratio = numerator / denominator
-                    ndl = -1 / k * math.log(ratio)
-                except Exception:
-                    ndl = 0
-        ndl_values.append(ndl)
-
-    # Combine negative values if present, otherwise choose the minimum positive value
-    negatives = [ndl for ndl in ndl_values if ndl < 0]
-    if negatives:
-        accumulated_ndl = sum(negatives)
-    else:
-        accumulated_ndl = min(ndl_values) if ndl_values else 0
+    # Use Bühlmann coefficients if available, otherwise the M-value. Negative compartment
+    # times are combined, otherwise the minimum positive value is chosen.
+    accumulated_ndl = float(tissue_model.tension_ndl(session.tissue_tensions, state.get("depth", 0)))
 
     # Apply RGBM adjustment if enabled
     if state.get("use_rgbm_for_ndl", False):
@@ -2024,9 +3124,9 @@ def compute_ndl():
 
     # Smooth the NDL output using exponential smoothing.
     alpha = 0.1  # smoothing factor: smaller values yield smoother, slower updates.
-    smoothed_ndl = smoothed_ndl + alpha * (accumulated_ndl - smoothed_ndl)
+    session.smoothed_ndl = session.smoothed_ndl + alpha * (accumulated_ndl - session.smoothed_ndl)
 
-    return round(smoothed_ndl, 2)
+    return round(session.smoothed_ndl, 2)
 
 
 @app.route('/api/v1/calculate_ndl', methods=['POST'])
@@ -2086,6 +3186,13 @@ def calculate_ndl_endpoint():
               example: 0.0
               minimum: 0
               maximum: 1
+            mode:
+              type: string
+              enum: [exact, fast]
+              description: >
+                "fast" reads the NDL from the precomputed table for the standard gas mixes; other mixes and depths
+                fall back to the exact solver.
+              example: exact
     responses:
       200:
         description: The calculated no-decompression limit (NDL) in minutes.
@@ -2096,6 +3203,10 @@ def calculate_ndl_endpoint():
               type: number
               description: The calculated no-decompression limit (NDL).
               example: 35.0
+            mode:
+              type: string
+              description: How the NDL was obtained, "fast" (precomputed table) or "exact" (solver).
+              example: exact
       400:
         description: Missing or invalid input.
         schema:
@@ -2126,16 +3237,185 @@ def calculate_ndl_endpoint():
     except (TypeError, ValueError) as e:
         return jsonify({"error": "Invalid input", "message": str(e)}), 400
 
-    # Check for invalid values
-    if time_at_depth_minutes <= 0:
+    # Check for invalid values
+    if time_at_depth_minutes <= 0:
+        return jsonify({"error": "time_at_depth_minutes must be greater than 0"}), 400
+
+    mode = data.get("mode", request.args.get("mode", "exact"))
+    if mode not in ("exact", "fast"):
+        return jsonify({"error": "mode must be 'exact' or 'fast'"}), 400
+
+    session = get_session()
+    with session.lock:
+        if mode == "fast":
+            ndl_value, mode = _fast_ndl(depth, time_at_depth_minutes, oxygen_fraction, nitrogen_fraction,
+                                        helium_fraction, state=session.state)
+        else:
+            ndl_value = _calculate_ndl(depth, time_at_depth_minutes, oxygen_fraction, nitrogen_fraction,
+                                       helium_fraction, state=session.state)
+    return jsonify({"ndl": ndl_value, "mode": mode})
+
+
+# Request fields of /api/v1/calculate_ndl/batch in column order, with the defaults of /api/v1/calculate_ndl
+NDL_BATCH_FIELDS = (
+    ("depth", None),
+    ("time_at_depth_minutes", None),
+    ("oxygen_fraction", 0.21),
+    ("nitrogen_fraction", 0.79),
+    ("helium_fraction", 0.0)
+)
+
+
+@app.route('/api/v1/calculate_ndl/batch', methods=['POST'])
+def calculate_ndl_batch_endpoint():
+    """
+    Calculate the no-decompression limit (NDL) for many depth/time/gas combinations in one request.
+    ---
+    tags:
+      - NDL Calculation
+    consumes:
+      - application/json
+      - application/x-ndjson
+    produces:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - in: header
+        name: Client-UUID
+        type: string
+        required: false
+        description: Client whose RGBM setting adjusts the results, as in /api/v1/calculate_ndl.
+      - in: body
+        name: body
+        description: >
+          Columnar JSON: arrays of equal length, where a gas fraction may also be a single number shared by
+          every row. Alternatively send Content-Type application/x-ndjson with one
+          /api/v1/calculate_ndl body per line; the response is then NDJSON too.
+        required: true
+        schema:
+          type: object
+          properties:
+            depth:
+              type: array
+              items:
+                type: number
+              example: [18, 30, 40]
+            time_at_depth_minutes:
+              type: array
+              items:
+                type: number
+              example: [20, 10, 5]
+            oxygen_fraction:
+              type: array
+              items:
+                type: number
+              example: [0.21, 0.32, 0.21]
+            nitrogen_fraction:
+              type: array
+              items:
+                type: number
+              example: [0.79, 0.68, 0.79]
+            helium_fraction:
+              type: array
+              items:
+                type: number
+              example: [0.0, 0.0, 0.0]
+    responses:
+      200:
+        description: One result per input row, in input order.
+        schema:
+          type: object
+          properties:
+            count:
+              type: integer
+              example: 3
+            ndl:
+              type: array
+              items:
+                type: number
+              description: NDL in minutes, computed like /api/v1/calculate_ndl.
+              example: [36.39, 12.81, 4.12]
+            limiting_tissue:
+              type: array
+              items:
+                type: integer
+              description: Compartment that limits each row, or null when none does (NDL 999).
+              example: [4, 2, 1]
+      400:
+        description: Missing, malformed or inconsistent input.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              example: "All columns must have the same length"
+    """
+    ndjson = request.mimetype == "application/x-ndjson"
+    try:
+        if ndjson:
+            rows = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            if not all(isinstance(row, dict) for row in rows):
+                raise ValueError("Every NDJSON line must be a JSON object")
+            data = {field: [row.get(field, default) for row in rows] for field, default in NDL_BATCH_FIELDS}
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({"error": "Missing JSON data"}), 400
+        if data.get("depth") is None or data.get("time_at_depth_minutes") is None:
+            return jsonify({"error": "depth and time_at_depth_minutes are required"}), 400
+        columns = [np.asarray(data.get(field, default), dtype=np.float64) for field, default in NDL_BATCH_FIELDS]
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": "Invalid input", "message": str(e)}), 400
+
+    if any(column.ndim > 1 for column in columns):
+        return jsonify({"error": "Columns must be arrays of numbers"}), 400
+    try:
+        depths, times, oxygen, nitrogen, helium = np.broadcast_arrays(*columns)
+    except ValueError:
+        return jsonify({"error": "All columns must have the same length"}), 400
+    if depths.ndim == 0:
+        depths, times, oxygen, nitrogen, helium = (column.reshape(1) for column in (depths, times, oxygen,
+                                                                                    nitrogen, helium))
+    if depths.size > app.config["NDL_BATCH_MAX_ROWS"]:
+        return jsonify({"error": f"At most {app.config['NDL_BATCH_MAX_ROWS']} rows per request"}), 400
+    if not np.isfinite(np.stack([depths, times, oxygen, nitrogen, helium])).all():
+        return jsonify({"error": "Values must be finite numbers"}), 400
+    if (times <= 0).any():
         return jsonify({"error": "time_at_depth_minutes must be greater than 0"}), 400
 
-    ndl_value = _calculate_ndl(depth, time_at_depth_minutes, oxygen_fraction, nitrogen_fraction, helium_fraction)
-    return jsonify({"ndl": ndl_value})
+    session = get_session()
+    with session.lock:
+        ndl, limiting_tissue = _calculate_ndl_batch(depths, times, nitrogen, helium, state=session.state)
+
+    if ndjson:
+        lines = (json.dumps({"ndl": value, "limiting_tissue": tissue}) + "\n"
+                 for value, tissue in zip(ndl, limiting_tissue))
+        return Response(lines, mimetype="application/x-ndjson")
+    return jsonify({"count": len(ndl), "ndl": ndl, "limiting_tissue": limiting_tissue})
+
+
+def _calculate_ndl_batch(depths, times, nitrogen_fractions, helium_fractions, state=None):
+    """
+    Vectorized `_calculate_ndl` for arrays of inputs, without the cache or per-tissue logging.
+    Returns (ndl list, limiting tissue id list); the tissue id is None where no compartment limits the dive.
+    """
+    times = np.maximum(0.01, np.round(times, 2))
+    ndl, limiting_index, _ = tissue_model.constant_depth_ndl(depths, times, nitrogen_fractions + helium_fractions)
+    # Same clamp as _solve_ndl: infinite or very large NDLs are reported as 999 minutes
+    ndl = np.where(np.isinf(ndl) | (ndl > 999), 999.0, ndl)
+    if state is not None and state.get("use_rgbm_for_ndl", False):
+        rgbm_factor = state.get("rgbm_factor", 1)
+        if rgbm_factor > 0:
+            ndl = np.round(ndl / rgbm_factor, 2)
+    limiting_tissue = [tissue_model.ids[i] if i >= 0 else None for i in limiting_index.tolist()]
+    tracer.debug("ndl.batch", "📦 Batch NDL: {rows} rows", rows=len(limiting_tissue))
+    return np.round(ndl, 2).tolist(), limiting_tissue
 
 
 @app.route('/api/v1/_calculate_ndl', methods=['POST'])
-def _calculate_ndl(depth, time_at_depth_minutes, oxygen_fraction=0.21, nitrogen_fraction=0.79, helium_fraction=0.0):
+@timed(function_seconds, function="_calculate_ndl")
+def _calculate_ndl(depth, time_at_depth_minutes, oxygen_fraction=0.21, nitrogen_fraction=0.79, helium_fraction=0.0,
+                   state=None):
     """
     Calculate the no-decompression limit (NDL) for a given depth and time at depth.
     ---
@@ -2193,9 +3473,28 @@ def _calculate_ndl(depth, time_at_depth_minutes, oxygen_fraction=0.21, nitrogen_
     """Calculate NDL using an adapted Bühlmann ZH-L16 model.
        time_at_depth_minutes is expected in minutes.
        Inert gas loading is computed from nitrogen and helium.
+       `state` is the client's dive state; its RGBM flag and factor adjust the result.
+
+       Results are memoized in `ndl_cache`, keyed on the inputs after quantizing the time to
+       the 0.01 min resolution the solver works at, so repeated polls cost a dictionary lookup.
     """
     # Ensure time_at_depth_minutes is positive to avoid math domain errors
     time_at_depth_minutes = max(0.01, round(time_at_depth_minutes, 2))
+    rgbm_factor = None
+    if state is not None and state.get("use_rgbm_for_ndl", False):
+        rgbm_factor = state.get("rgbm_factor", 1)
+
+    key = (depth, time_at_depth_minutes, oxygen_fraction, nitrogen_fraction, helium_fraction, rgbm_factor)
+    ndl = ndl_cache.get(key)
+    if ndl is None:
+        ndl = _solve_ndl(depth, time_at_depth_minutes, oxygen_fraction, nitrogen_fraction, helium_fraction,
+                         rgbm_factor)
+        ndl_cache.put(key, ndl)
+    return ndl
+
+
+def _solve_ndl(depth, time_at_depth_minutes, oxygen_fraction, nitrogen_fraction, helium_fraction, rgbm_factor=None):
+    """Uncached NDL solve behind `_calculate_ndl`; `rgbm_factor` is None unless RGBM adjustment is enabled."""
     surface_pressure = 1.0
     pressure_at_depth = surface_pressure + (depth / 10)
 
@@ -2203,68 +3502,254 @@ def _calculate_ndl(depth, time_at_depth_minutes, oxygen_fraction=0.21, nitrogen_
     inert_gas_fraction = nitrogen_fraction + helium_fraction
     inert_gas_pressure = pressure_at_depth * inert_gas_fraction
 
-    # Log the fractions used.
-    print(
-        f"Oxygen Fraction: {oxygen_fraction}, Nitrogen Fraction: {nitrogen_fraction}, Helium Fraction: {helium_fraction}")
-    print(f"🌊 Depth: {depth}m, 🔺 Pressure: {pressure_at_depth:.2f} ATA, 🧪 Inert Gas Pressure: {inert_gas_pressure:.3f}")
-
-    ndl = float("inf")
-    limiting_tissue = None
-
-    for tissue in buhlmann_tissues:
-        half_time = tissue["half_time"]
-        m_value = tissue["M-value"]
-        k = math.log(2) / half_time
-
-        # Calculate inert gas loading in the tissue using the inert gas pressure.
-        inert_gas_loading = inert_gas_pressure * (1 - math.exp(-k * time_at_depth_minutes))
-        max_inert_tension = m_value * surface_pressure
-
-        print(f"📊 Tissue {tissue['tissue']}: Half-Time {half_time} min, M-Value {m_value}")
-        print(f"   → Inert Gas Loading: {inert_gas_loading:.5f}")
-        print(f"   → Max Inert Tension: {max_inert_tension:.5f}")
-
-        try:
-            # Check for negative or zero result in the logarithm
-            log_arg = 1 - (max_inert_tension / inert_gas_pressure)
-            if log_arg <= 0:
-                print(f"🚨 Log argument <= 0 in tissue {tissue['tissue']}: {log_arg}")
-                continue
-
-            compartment_ndl = (math.log(log_arg) / -k) - time_at_depth_minutes
-            if compartment_ndl < ndl:
-                ndl = compartment_ndl
-                limiting_tissue = tissue["tissue"]
-                print(f"🔄 New limiting compartment: {tissue['tissue']} (NDL: {ndl:.2f} min)")
-        except (ValueError, ZeroDivisionError) as e:
-            print(f"🚨 Error in tissue {tissue['tissue']}: {str(e)}")
-            continue
+    tracer.debug("ndl.inputs", "🌊 Depth: {depth}m, 🔺 Pressure: {pressure:.2f} ATA, 🧪 Inert Gas Pressure: "
+                 "{inert_gas_pressure:.3f} (O₂ {oxygen_fraction}, N₂ {nitrogen_fraction}, He {helium_fraction})",
+                 depth=depth, pressure=pressure_at_depth, inert_gas_pressure=inert_gas_pressure,
+                 oxygen_fraction=oxygen_fraction, nitrogen_fraction=nitrogen_fraction, helium_fraction=helium_fraction)
+
+    # Solve every compartment at once; the limiting compartment is the one with the smallest NDL.
+    ndl, limiting_index, compartment_ndl = tissue_model.constant_depth_ndl(depth, time_at_depth_minutes,
+                                                                           inert_gas_fraction)
+    ndl = float(ndl)
+    limiting_tissue = tissue_model.ids[limiting_index] if limiting_index >= 0 else None
+
+    # Per-compartment detail is the bulk of the trace output, so it is sampled (TRACE_SAMPLE_RATES["ndl.tissue"])
+    if tracer.sampled(tracing.DEBUG, "ndl.tissue"):
+        inert_gas_loading = inert_gas_pressure * (1 - np.exp(-tissue_model.k * time_at_depth_minutes))
+        for i, tissue in enumerate(buhlmann_tissues):
+            tracer.event(tracing.DEBUG, "ndl.tissue", "📊 Tissue {tissue}: Half-Time {half_time} min, M-Value "
+                         "{m_value}, Inert Gas Loading {loading:.5f}, Max Inert Tension {max_tension:.5f}"
+                         "{no_limit}", tissue=tissue["tissue"], half_time=tissue["half_time"],
+                         m_value=tissue["M-value"], loading=float(inert_gas_loading[i]),
+                         max_tension=float(tissue_model.max_tensions[i]),
+                         no_limit=" 🚨 (log argument <= 0)" if math.isinf(compartment_ndl[i]) else "")
 
     deco_required = False  # Flag to indicate decompression is required
 
     # Handle extreme values
     if math.isinf(ndl) or ndl > 999:
         ndl = 999
-        print(f"⚠️ NDL was infinity or too large, setting to {ndl:.2f} minutes")
+        tracer.debug("ndl.clamped", "⚠️ NDL was infinity or too large, setting to {ndl:.2f} minutes", ndl=ndl)
 
     # Allow negative NDL and set deco_required flag
     if ndl < 0:
         deco_required = True
-        print(f"⚠️ Negative NDL calculated: {ndl:.2f} minutes. Decompression required.")
+        tracer.debug("ndl.negative", "⚠️ Negative NDL calculated: {ndl:.2f} minutes. Decompression required.",
+                     ndl=ndl)
 
     # Apply RGBM adjustment if enabled
-    if state.get("use_rgbm_for_ndl", False):
-        rgbm_factor = state.get("rgbm_factor", 1)
-        if rgbm_factor > 0:
-            ndl /= rgbm_factor  # Adjust NDL using RGBM factor
-            ndl = round(ndl, 2)  # Keep precision
+    if rgbm_factor is not None and rgbm_factor > 0:
+        ndl /= rgbm_factor  # Adjust NDL using RGBM factor
+        ndl = round(ndl, 2)  # Keep precision
 
-    print(f"✅ Final Computed NDL: {ndl:.2f} minutes (Limited by Tissue {limiting_tissue})\n")
+    tracer.debug("ndl.result", "✅ Final Computed NDL: {ndl:.2f} minutes (Limited by Tissue {limiting_tissue})",
+                 ndl=ndl, limiting_tissue=limiting_tissue)
     # return {"ndl": round(ndl, 2), "deco_required": deco_required}
 
     return round(ndl, 2)
 
 
+def _fast_ndl(depth, time_at_depth_minutes, oxygen_fraction=0.21, nitrogen_fraction=0.79, helium_fraction=0.0,
+              state=None):
+    """
+    NDL from the precomputed table, with the same RGBM adjustment as `_calculate_ndl`.
+    Returns (ndl, mode): mode is "exact" when the point is not tabulated and the solver answered instead.
+    """
+    ndl = get_ndl_table().lookup(depth, time_at_depth_minutes, nitrogen_fraction + helium_fraction)
+    if ndl is None:
+        return _calculate_ndl(depth, time_at_depth_minutes, oxygen_fraction, nitrogen_fraction, helium_fraction,
+                              state=state), "exact"
+
+    if state is not None and state.get("use_rgbm_for_ndl", False):
+        rgbm_factor = state.get("rgbm_factor", 1)
+        if rgbm_factor > 0:
+            ndl = round(ndl / rgbm_factor, 2)
+    return ndl, "fast"
+
+
+@app.route('/api/v1/ndl_table', methods=['GET'])
+def ndl_table_info():
+    """
+    Describe the precomputed NDL table used by mode=fast.
+    ---
+    tags:
+      - NDL Calculation
+    produces:
+      - application/json
+    responses:
+      200:
+        description: Table version, grid and the measured interpolation error per gas mix.
+        schema:
+          type: object
+          properties:
+            format_version:
+              type: integer
+              example: 1
+            fingerprint:
+              type: string
+              description: Hash of the compartment parameters and grid the table was built from.
+              example: 3f9a0c51d2e4
+            max_depth:
+              type: number
+              example: 350.0
+            depth_step:
+              type: number
+              example: 0.25
+            max_time:
+              type: number
+              example: 300.0
+            time_step:
+              type: number
+              example: 5.0
+            mixes:
+              type: array
+              items:
+                type: object
+                properties:
+                  name:
+                    type: string
+                    example: Air
+                  inert_fraction:
+                    type: number
+                    example: 0.79
+                  max_error:
+                    type: number
+                    description: Largest difference in minutes from the exact solver on the validation points.
+                    example: 0.01
+                  exact_depth_cells:
+                    type: integer
+                    description: Depth cells answered by the exact solver because the NDL changes too steeply there.
+                    example: 37
+    """
+    metadata = get_ndl_table().metadata
+    info = {key: metadata[key] for key in ("format_version", "fingerprint", "max_depth", "depth_step",
+                                           "max_time", "time_step")}
+    info["mixes"] = [{"name": mix["name"], "inert_fraction": mix["inert_fraction"], "max_error": mix["max_error"],
+                      "exact_depth_cells": len(mix["exact_cells"])} for mix in metadata["mixes"]]
+    return jsonify(info)
+
+
+@app.route('/api/v1/ndl_cache', methods=['GET'])
+def ndl_cache_stats():
+    """
+    Report the size and hit/miss counters of the NDL solver cache.
+    ---
+    tags:
+      - NDL Calculation
+    produces:
+      - application/json
+    responses:
+      200:
+        description: NDL cache statistics.
+        schema:
+          type: object
+          properties:
+            size:
+              type: integer
+              description: Number of cached NDL results.
+              example: 120
+            maxsize:
+              type: integer
+              description: Maximum number of cached results before the least recently used is evicted.
+              example: 4096
+            hits:
+              type: integer
+              description: Lookups answered from the cache.
+              example: 950
+            misses:
+              type: integer
+              description: Lookups that had to run the solver.
+              example: 50
+            evictions:
+              type: integer
+              description: Entries dropped to stay within maxsize.
+              example: 0
+            hit_ratio:
+              type: number
+              description: hits / (hits + misses).
+              example: 0.95
+    """
+    return jsonify(ndl_cache.stats())
+
+
+@app.route('/api/v1/log_cache', methods=['GET'])
+def log_cache_stats():
+    """
+    Report the size and hit/miss counters of the in-memory cache of parsed client dive logs.
+    ---
+    tags:
+      - Dive Logs
+    produces:
+      - application/json
+    responses:
+      200:
+        description: Dive log cache statistics.
+        schema:
+          type: object
+          properties:
+            clients:
+              type: integer
+              description: Number of clients whose log is cached.
+              example: 12
+            bytes:
+              type: integer
+              description: Size of the cached entries' JSON text.
+              example: 1048576
+            max_bytes:
+              type: integer
+              description: Budget in bytes before the least recently read logs are evicted.
+              example: 67108864
+            hits:
+              type: integer
+              description: Reads answered from memory.
+              example: 950
+            misses:
+              type: integer
+              description: Reads that loaded the log from storage.
+              example: 50
+            evictions:
+              type: integer
+              description: Logs dropped to stay within max_bytes.
+              example: 0
+            invalidations:
+              type: integer
+              description: Cached logs dropped because the log changed on disk or was rewritten.
+              example: 3
+            hit_ratio:
+              type: number
+              description: hits / (hits + misses).
+              example: 0.95
+    """
+    return jsonify(log_storage.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Report request latency, calculation timings, storage I/O, cache counters and in-memory sizes for Prometheus.
+    ---
+    tags:
+      - Monitoring
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: >
+          Every metric in the Prometheus text exposition format (version 0.0.4): per-route request counts and
+          latency histograms, timing histograms of _calculate_ndl, calculate_rgbm, compute_ndl,
+          calculate_accumulated_ndl and generate_decompression_stops, dive log storage read/write bytes and
+          durations, NDL and dive log cache counters and hit ratios, log writer queue, live sessions, and the
+          sizes of the in-memory dive logs and physiology store.
+        schema:
+          type: string
+          example: |
+            # HELP divalgo_sessions Live client sessions.
+            # TYPE divalgo_sessions gauge
+            divalgo_sessions 3
+    """
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/')
 def serve_frontend():
     return send_from_directory('static', 'divalgo.html')
@@ -2289,25 +3774,10 @@ def reset():
               type: string
               example: Simulation reset successfully
     """
-    global state
-    state = {
-        "depth": 0,
-        "last_depth": 0,
-        "time_elapsed": 0,
-        "time_at_depth": 0,
-        "depth_start_time": time.time(),
-        "depth_durations": defaultdict(float),  # Use defaultdict to avoid KeyErrors
-        "ndl": -999,
-        "rgbm_factor": 1.0,
-        "pressure": 1.0,
-        "oxygen_toxicity": 0.21,
-        "oxygen_fraction": 0.21,
-        "nitrogen_fraction": 0.79,
-        "helium_fraction": 0.0,
-        "selected_deco_model": "bühlmann",
-        "use_rgbm_for_ndl": False,
-        "dive_start_time": None  # Reset dive_start_time
-    }
+    session = get_session()
+    with session.lock:
+        session.reset_state()
+        refresh_state_snapshot(session)
     return jsonify({"message": "Simulation reset successfully"})
 
 
@@ -2422,7 +3892,10 @@ def set_deco_model():
     selected_model = data.get("deco_model")
     if selected_model not in ["bühlmann", "rgbm", "vpm", "deepstops", "custom"]:
         return jsonify({"error": "Invalid decompression model"}), 400
-    state["selected_deco_model"] = selected_model
+    session = get_session()
+    with session.lock:
+        session.state["selected_deco_model"] = selected_model
+        refresh_state_snapshot(session)
     return jsonify({"message": f"Decompression model set to {selected_model}"}), 200
 
 
@@ -2515,51 +3988,150 @@ def update_gas_mix():
         if not data:
             return jsonify({"error": "No JSON data received"}), 400
 
-        # Validate that required keys exist and are valid numbers
-        try:
-            oxygen_fraction = float(data.get("oxygen_fraction", state.get("oxygen_fraction", 0.21)))
-            nitrogen_fraction = float(data.get("nitrogen_fraction", state.get("nitrogen_fraction", 0.79)))
-            helium_fraction = float(data.get("helium_fraction", state.get("helium_fraction", 0.0)))
-        except (TypeError, ValueError):
-            return jsonify({"error": "Invalid or missing gas mix values"}), 400
-        # Validate that gas fractions sum to 1.0 (or very close to 1.0 accounting for floating point errors)
-        total = oxygen_fraction + nitrogen_fraction + helium_fraction
-        if not (0.999 <= total <= 1.001):
-            # Normalize if needed
-            factor = 1.0 / total
-            oxygen_fraction *= factor
-            nitrogen_fraction *= factor
-            helium_fraction *= factor
-
-        # Update state
-        state["oxygen_fraction"] = round(oxygen_fraction, 5)
-        state["nitrogen_fraction"] = round(nitrogen_fraction, 5)
-        state["helium_fraction"] = round(helium_fraction, 5)
-
-        # Recalculate oxygen toxicity based on new gas mix
-        state["oxygen_toxicity"] = round(state["oxygen_fraction"] * state["pressure"], 2)
-
-        print(f"Updated gas mix: O₂={oxygen_fraction}, N₂={nitrogen_fraction}, He={helium_fraction}")
-        return jsonify({
-            "message": "Gas mix updated",
-            "oxygen_fraction": state["oxygen_fraction"],
-            "nitrogen_fraction": state["nitrogen_fraction"],
-            "helium_fraction": state["helium_fraction"],
-            "oxygen_toxicity": state["oxygen_toxicity"]
-        })
+        session = get_session()
+        with session.lock:
+            state = session.state
+            # Validate that required keys exist and are valid numbers
+            try:
+                oxygen_fraction = float(data.get("oxygen_fraction", state.get("oxygen_fraction", 0.21)))
+                nitrogen_fraction = float(data.get("nitrogen_fraction", state.get("nitrogen_fraction", 0.79)))
+                helium_fraction = float(data.get("helium_fraction", state.get("helium_fraction", 0.0)))
+            except (TypeError, ValueError):
+                return jsonify({"error": "Invalid or missing gas mix values"}), 400
+            # Validate that gas fractions sum to 1.0 (or very close to 1.0 accounting for floating point errors)
+            total = oxygen_fraction + nitrogen_fraction + helium_fraction
+            if not (0.999 <= total <= 1.001):
+                # Normalize if needed
+                factor = 1.0 / total
+                oxygen_fraction *= factor
+                nitrogen_fraction *= factor
+                helium_fraction *= factor
+
+            # Log the time spent on the previous gas before switching
+            log_state_event(session)
+
+            # Update state
+            state["oxygen_fraction"] = round(oxygen_fraction, 5)
+            state["nitrogen_fraction"] = round(nitrogen_fraction, 5)
+            state["helium_fraction"] = round(helium_fraction, 5)
+
+            # Recalculate oxygen toxicity based on new gas mix
+            state["oxygen_toxicity"] = round(state["oxygen_fraction"] * state["pressure"], 2)
+            refresh_state_snapshot(session)
+
+            tracer.debug("gas.updated", "Updated gas mix: O₂={oxygen_fraction}, N₂={nitrogen_fraction}, "
+                         "He={helium_fraction}", oxygen_fraction=oxygen_fraction, nitrogen_fraction=nitrogen_fraction,
+                         helium_fraction=helium_fraction)
+            return jsonify({
+                "message": "Gas mix updated",
+                "oxygen_fraction": state["oxygen_fraction"],
+                "nitrogen_fraction": state["nitrogen_fraction"],
+                "helium_fraction": state["helium_fraction"],
+                "oxygen_toxicity": state["oxygen_toxicity"]
+            })
     except Exception as e:
-        print(f"Error updating gas mix: {str(e)}")
-        traceback.print_exc()
+        tracer.error("gas.failed", "Error updating gas mix: {error}", exc_info=True, error=str(e))
         return jsonify({"error": "Internal server error", "message": str(e)}), 500
 
 
 def background_state_update():
     while True:
-        update_tissue_state()
-        # Optionally update other state values...
+        session_list = sessions.all()
+        update_tissue_states(session_list)
+        # Recompute every session's /api/v1/state snapshot so requests only read it; the expensive fields only
+        # for sessions whose clients read them recently (see LAZY_STATE_FIELDS)
+        for session in session_list:
+            try:
+                with session.lock:
+                    refresh_state_snapshot(session)
+            except Exception as e:
+                tracer.error("state.snapshot_failed", "❌ State snapshot for {client_uuid} failed: {error}",
+                             client_uuid=session.client_uuid, error=str(e))
+        sessions.expire_idle(app.config["SESSION_IDLE_TIMEOUT"], keep=(DEFAULT_CLIENT_UUID,))
         time.sleep(1)  # Update every second
 
 
+def start_background_state_update():
+    """Start `background_state_update` once per process."""
+    global background_state_thread
+    if background_state_thread is None:
+        with background_state_lock:
+            if background_state_thread is None:
+                background_state_thread = threading.Thread(target=background_state_update, name="state-update",
+                                                           daemon=True)
+                background_state_thread.start()
+
+
+@app.before_request
+def ensure_background_state_update():
+    # Started on the first request so the snapshots are also kept fresh under WSGI servers, which never run __main__
+    start_background_state_update()
+    start_background_log_compaction()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses (stream=1 logs, /api/v1/state/stream) count until their first byte is ready
+    started = g.pop("request_started", None)
+    if started is not None:
+        # The URL rule rather than the path, so per-client or per-dive URLs do not each become a series
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_seconds.observe(time.perf_counter() - started, method=request.method, route=route)
+        request_count.inc(method=request.method, route=route, status=response.status_code)
+    return response
+
+
+@app.before_request
+def start_request_profile():
+    # The profiling endpoints themselves are never profiled
+    if request.blueprint != "debug":
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.request_profiled = request_profiler.begin_request(route)
+
+
+@app.teardown_request
+def finish_request_profile(exception=None):
+    if g.pop("request_profiled", False):
+        request_profiler.end_request()
+
+
+def background_log_compaction():
+    """Archive every client's finished dives, then apply the retention limits, every LOG_COMPACTION_INTERVAL."""
+    while True:
+        time.sleep(app.config["LOG_COMPACTION_INTERVAL"])
+        started = time.time()
+        archived = dropped = 0
+        for path in log_archive.iter_logs(log_backend.log_dir):
+            try:
+                archived += log_archive.compact_log(path)
+                if app.config["LOG_RETENTION_DAYS"] is not None or app.config["LOG_ARCHIVE_MAX_BYTES"] is not None:
+                    dropped += log_archive.apply_retention(path, app.config["LOG_RETENTION_DAYS"],
+                                                           app.config["LOG_ARCHIVE_MAX_BYTES"])
+            except Exception as e:
+                tracer.error("log.compaction_failed", "❌ Compacting {path} failed: {error}", path=path,
+                             error=str(e))
+        if archived or dropped:
+            tracer.info("log.compacted", "🗜️ Archived {archived} finished dives, dropped {dropped} expired ones in "
+                        "{seconds:.2f}s", archived=archived, dropped=dropped, seconds=time.time() - started)
+
+
+def start_background_log_compaction():
+    """Start `background_log_compaction` once per process, when logs are NDJSON files and compaction is enabled."""
+    global background_compaction_thread
+    if (background_compaction_thread is None and app.config["LOG_COMPACTION_INTERVAL"]
+            and isinstance(log_backend, NDJSONLogStore)):
+        with background_compaction_lock:
+            if background_compaction_thread is None:
+                background_compaction_thread = threading.Thread(target=background_log_compaction,
+                                                                name="log-compaction", daemon=True)
+                background_compaction_thread.start()
+
+
 # In-memory store for demonstration purposes
 physiology_store = {}
 
@@ -2648,7 +4220,269 @@ def update_physiology():
     return jsonify(response_data), 200
 
 
+
+@debug_bp.route('/profile', methods=['GET'])
+@admin_required
+def profile_status():
+    """
+    Report the running or last CPU profiling session.
+    ---
+    tags:
+      - Debug
+    produces:
+      - application/json
+    parameters:
+      - name: X-DEBUG-API-KEY
+        in: header
+        type: string
+        required: true
+        description: The server's DEBUG_API_KEY.
+    responses:
+      200:
+        description: Profiling session status.
+        schema:
+          id: ProfileStatus
+          type: object
+          properties:
+            running:
+              type: boolean
+              example: true
+            profiler:
+              type: string
+              example: sampling
+            route:
+              type: string
+              description: URL rule the session is limited to, or null for every route.
+              example: /api/v1/state
+            duration:
+              type: number
+              example: 30
+            max_requests:
+              type: integer
+              example: 100
+            interval:
+              type: number
+              description: Seconds between stack samples (sampling profiler).
+              example: 0.005
+            started:
+              type: number
+              description: Unix time the session started.
+              example: 1760000000.0
+            elapsed:
+              type: number
+              description: Seconds the session has run (or ran).
+              example: 12.5
+            requests:
+              type: integer
+              description: Profiled requests that have finished.
+              example: 42
+            in_progress:
+              type: integer
+              example: 1
+            skipped:
+              type: integer
+              description: Requests cProfile could not profile because another profile was active.
+              example: 0
+            samples:
+              type: integer
+              description: Stacks recorded (sampling profiler).
+              example: 5120
+      401:
+        description: Missing or wrong X-DEBUG-API-KEY.
+    """
+    return jsonify(request_profiler.status())
+
+
+@debug_bp.route('/profile/start', methods=['POST'])
+@admin_required
+def start_profile():
+    """
+    Start profiling the requests the server handles, for a time window or the next N requests.
+    ---
+    tags:
+      - Debug
+    consumes:
+      - application/json
+    produces:
+      - application/json
+    parameters:
+      - name: X-DEBUG-API-KEY
+        in: header
+        type: string
+        required: true
+        description: The server's DEBUG_API_KEY.
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            profiler:
+              type: string
+              enum: [sampling, cprofile]
+              description: >
+                "sampling" records the stacks of the profiled requests every interval seconds (low overhead,
+                collapsed stacks available); "cprofile" traces every call (exact counts, slows the requests down).
+              example: sampling
+            duration:
+              type: number
+              description: Seconds to profile for, up to PROFILE_MAX_DURATION.
+              example: 30
+            requests:
+              type: integer
+              description: >
+                Number of requests to profile, up to PROFILE_MAX_REQUESTS. With duration, the session ends at
+                whichever comes first.
+              example: 100
+            route:
+              type: string
+              description: Only profile requests to this URL rule (as in /metrics), e.g. /api/v1/state.
+              example: /api/v1/state
+            interval:
+              type: number
+              description: Seconds between samples of the sampling profiler (default PROFILE_SAMPLE_INTERVAL).
+              example: 0.005
+    responses:
+      200:
+        description: The session started.
+        schema:
+          $ref: '#/definitions/ProfileStatus'
+      400:
+        description: Invalid settings.
+      401:
+        description: Missing or wrong X-DEBUG-API-KEY.
+      409:
+        description: A profiling session is already running.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Missing JSON data"}), 400
+    try:
+        duration = float(data["duration"]) if data.get("duration") is not None else None
+        requests = int(data["requests"]) if data.get("requests") is not None else None
+        interval = float(data.get("interval") or app.config["PROFILE_SAMPLE_INTERVAL"])
+        route = data.get("route") or None
+        if duration is not None and not (math.isfinite(duration) and duration <= app.config["PROFILE_MAX_DURATION"]):
+            raise ValueError(f"duration must be at most {app.config['PROFILE_MAX_DURATION']} seconds")
+        if requests is not None and requests > app.config["PROFILE_MAX_REQUESTS"]:
+            raise ValueError(f"requests must be at most {app.config['PROFILE_MAX_REQUESTS']}")
+        if route is not None and route not in {rule.rule for rule in app.url_map.iter_rules()}:
+            raise ValueError(f"Unknown route '{route}'")
+        status = request_profiler.start(data.get("profiler", "sampling"), duration, requests, route, interval)
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": "Invalid input", "message": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": "Profiler busy", "message": str(e)}), 409
+    limits = [f"{duration:g}s"] if duration is not None else []
+    if requests is not None:
+        limits.append(f"{requests} request{'s' if requests != 1 else ''}")
+    tracer.info("profile.started", "🔬 Profiling {route} with {profiler} for {limits}",
+                profiler=status["profiler"], duration=duration, requests=requests, route=route or "every route",
+                limits=" or ".join(limits) + (", whichever ends first" if len(limits) > 1 else ""))
+    return jsonify(status)
+
+
+@debug_bp.route('/profile/stop', methods=['POST'])
+@admin_required
+def stop_profile():
+    """
+    Stop the running profiling session; its results stay available for download.
+    ---
+    tags:
+      - Debug
+    produces:
+      - application/json
+    parameters:
+      - name: X-DEBUG-API-KEY
+        in: header
+        type: string
+        required: true
+        description: The server's DEBUG_API_KEY.
+    responses:
+      200:
+        description: The session's final status.
+        schema:
+          $ref: '#/definitions/ProfileStatus'
+      401:
+        description: Missing or wrong X-DEBUG-API-KEY.
+    """
+    return jsonify(request_profiler.stop())
+
+
+@debug_bp.route('/profile/pstats', methods=['GET'])
+@admin_required
+def download_profile_pstats():
+    """
+    Download the last profiling session's results as a pstats file.
+    ---
+    tags:
+      - Debug
+    produces:
+      - application/octet-stream
+    parameters:
+      - name: X-DEBUG-API-KEY
+        in: header
+        type: string
+        required: true
+        description: The server's DEBUG_API_KEY.
+    responses:
+      200:
+        description: Marshalled pstats data, readable with pstats.Stats(path) or snakeviz.
+      401:
+        description: Missing or wrong X-DEBUG-API-KEY.
+      404:
+        description: No profiling results yet.
+    """
+    data = request_profiler.pstats_data()
+    if data is None:
+        return jsonify({"error": "No profiling results"}), 404
+    return Response(data, mimetype="application/octet-stream",
+                    headers={"Content-Disposition": "attachment; filename=divalgo.pstats"})
+
+
+@debug_bp.route('/profile/collapsed', methods=['GET'])
+@admin_required
+def download_profile_collapsed():
+    """
+    Download the last sampling session's stacks in collapsed format for flame graphs.
+    ---
+    tags:
+      - Debug
+    produces:
+      - text/plain
+    parameters:
+      - name: X-DEBUG-API-KEY
+        in: header
+        type: string
+        required: true
+        description: The server's DEBUG_API_KEY.
+    responses:
+      200:
+        description: One "frame;frame;frame count" line per distinct stack (flamegraph.pl, speedscope).
+      400:
+        description: The last session used cProfile, which does not record whole stacks.
+      401:
+        description: Missing or wrong X-DEBUG-API-KEY.
+      404:
+        description: No profiling results yet.
+    """
+    try:
+        text = request_profiler.collapsed_stacks()
+    except ValueError as e:
+        return jsonify({"error": "Invalid input", "message": str(e)}), 400
+    if text is None:
+        return jsonify({"error": "No profiling results"}), 404
+    return Response(text, mimetype="text/plain",
+                    headers={"Content-Disposition": "attachment; filename=divalgo.collapsed.txt"})
+
+
+# Registered once its routes exist (a blueprint cannot take routes after registration), in development mode only
+if app.config.get("ENV") == "development":
+    app.register_blueprint(debug_bp, url_prefix="/debug")
+
+
 if __name__ == '__main__':
-    threading.Thread(target=background_state_update, daemon=True).start()
+    start_background_state_update()
+    start_background_log_compaction()
 
     app.run(debug=True)
@@ -0,0 +1,237 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+/metrics renders everything registered with the shared `registry` as the
+plain text Prometheus reads (curl reads it just as well), so no client
+library, agent or external service is needed:
+
+- Counter: a total that only goes up, such as requests served or bytes read.
+- Gauge: a value that goes up and down, such as live sessions.
+- Histogram: observations counted into cumulative `le` buckets, with their
+  sum and count, from which a scraper derives rates and quantiles.
+
+Recording a value is a dictionary lookup and a few additions under a lock.
+Values another object already keeps (cache counters, dive log sizes) are not
+copied on every change: such a metric is given a `function` that reads them
+when /metrics is scraped.
+
+`timed` records how long each call of a function takes in a histogram, and
+MeteredLogStore does the same for the reads and writes of a LogStore, with the
+bytes of JSON they moved.
+"""
+import bisect
+import math
+import threading
+import time
+from functools import wraps
+
+from log_store import LogStore
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the histogram buckets, in seconds or bytes; every histogram also has a +Inf bucket
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FUNCTION_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 1.0)
+BYTE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B to 64 MiB
+
+
+class Metric:
+    """A named metric with one value per combination of `labelnames`, or read from `function` when collected."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Returns the value, or a dict of label value tuples to values when the metric has labels
+        self.function = function
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(name suffix, labels, value) of every sample, in exposition order."""
+        if self.function is not None:
+            values = self.function()
+            if not self.labelnames:
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield "", dict(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)  # First bucket whose upper bound is >= value
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of the observations
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", dict(labels, le=_format_value(float(bound))), cumulative
+            yield "_sum", labels, counts[-1]
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    """The metrics /metrics reports, in the order they were created."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self._register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Every metric in the text exposition format."""
+        with self._lock:
+            registered = list(self._metrics.values())
+        lines = []
+        for metric in registered:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation, quote=False)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(f'{name}="{_escape(str(label))}"' for name, label in labels.items())
+                    lines.append(f"{metric.name}{suffix}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{metric.name}{suffix} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram, **labels):
+    """Decorator recording how long each call of the function takes, in seconds, in `histogram` under `labels`."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+class MeteredLogStore(LogStore):
+    """
+    A LogStore that records the duration (`seconds`) and JSON bytes (`bytes_total`) of every read and write of
+    `store` under an `operation` label, and the size of every log read in full in `log_bytes`.
+    """
+
+    def __init__(self, store, seconds, bytes_total, log_bytes):
+        self.store = store
+        self.append_ordered = store.append_ordered
+        self.seconds = seconds
+        self.bytes_total = bytes_total
+        self.log_bytes = log_bytes
+
+    def location(self, client_uuid):
+        return self.store.location(client_uuid)
+
+    def ensure(self, client_uuid):
+        self.store.ensure(client_uuid)
+
+    def version(self, client_uuid):
+        return self.store.version(client_uuid)
+
+    def append_many(self, client_uuid, entries, sync=False):
+        started = time.perf_counter()
+        written = self.store.append_many(client_uuid, entries, sync)
+        self.seconds.observe(time.perf_counter() - started, operation="write")
+        self.bytes_total.inc(written or 0, operation="write")
+        return written
+
+    def scan(self, client_uuid, after=None, start=None, end=None, min_depth=None, max_depth=None):
+        # The time covers the whole scan, including the caller's work between rows
+        started = time.perf_counter()
+        read = 0
+        complete = False
+        try:
+            for row in self.store.scan(client_uuid, after, start, end, min_depth, max_depth):
+                read += len(row[1])
+                yield row
+            complete = True
+        finally:
+            self.seconds.observe(time.perf_counter() - started, operation="read")
+            self.bytes_total.inc(read, operation="read")
+            if complete and after is None and start is None and end is None and min_depth is None \
+                    and max_depth is None:
+                self.log_bytes.observe(read)
+
+
+def _escape(text, quote=True):
+    text = text.replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quote else text
+
+
+def _format_value(value):
+    if isinstance(value, bool) or isinstance(value, int):
+        return str(int(value))
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+# Shared by every module; rendered by main.py's /metrics endpoint
+registry = Registry()
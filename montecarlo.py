@@ -0,0 +1,179 @@
+"""
+Monte Carlo sensitivity analysis of a dive plan.
+
+A plan (the segments accepted by /api/v1/simulate_profile plus rates and
+gradient factors) is perturbed many times: descent rate and bottom times are
+scaled by normally distributed factors, the oxygen fraction is shifted within
+a tolerance (the inert gases take up the difference in their original ratio)
+and GF-low/GF-high are shifted to model more or less conservatism.
+
+Every variant is flown through the same calculations the API uses:
+  - ndl: `_calculate_ndl`'s square-profile Bühlmann NDL for the deepest segment, clamped to 999
+    and divided by the RGBM factor when the plan uses RGBM
+  - rgbm_factor: `calculate_rgbm` at the end of the deepest segment
+  - time_to_surface / stop_count: the ZH-L16C schedule from the end of the last segment
+  - ceiling violation: the diver is shallower than the ZH-L16C ceiling at GF-high on arriving
+    at, or leaving, any segment
+
+Variants are evaluated in fixed-size chunks, each seeded from
+`SeedSequence(seed).spawn()`, so the result depends only on the seed and the
+iteration count, never on how many worker processes ran the chunks.
+"""
+import json
+
+import numpy as np
+
+from decompression import ZHL16C
+from profiles import compute_rgbm_factor
+from tissue_engine import TissueModel
+
+CHUNK_SIZE = 250
+
+DEFAULT_PERTURBATION = {
+    "descent_rate_sd": 0.2,  # Relative standard deviation of the descent rate
+    "bottom_time_sd": 0.1,  # Relative standard deviation of every segment's duration
+    "gas_fraction_tolerance": 0.01,  # Oxygen fraction varies uniformly by ± this much
+    "gradient_factor_tolerance": 0.05  # GF-low and GF-high vary uniformly by ± this much
+}
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+_models = {}
+
+
+def run(plan, iterations, seed, executor=None):
+    """
+    Evaluate `iterations` perturbed variants of `plan` and summarize them.
+    Chunks are spread over `executor` (e.g. a ProcessPoolExecutor) when one is given.
+    """
+    sizes = [CHUNK_SIZE] * (iterations // CHUNK_SIZE)
+    if iterations % CHUNK_SIZE:
+        sizes.append(iterations % CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(plan, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    chunks = list(executor.map(evaluate_chunk, jobs) if executor is not None else map(evaluate_chunk, jobs))
+
+    results = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+    violations = int(results["ceiling_violation"].sum())
+    return {
+        "iterations": iterations,
+        "seed": seed,
+        "ndl": _distribution(results["ndl"]),
+        "rgbm_factor": _distribution(results["rgbm_factor"]),
+        "time_to_surface": _distribution(results["time_to_surface"]),
+        "stop_count": _distribution(results["stop_count"]),
+        "deco_required_probability": round(float((results["stop_count"] > 0).mean()), 4),
+        "ceiling_violations": {"count": violations, "probability": round(violations / iterations, 4)}
+    }
+
+
+def evaluate_chunk(job):
+    """Worker entry point: draw and evaluate one chunk of variants. Returns one array per metric."""
+    plan, count, seed_sequence = job
+    tissue_model, deco_model = _get_models(plan["compartments"])
+    rng = np.random.default_rng(seed_sequence)
+    variants = _perturb(plan, count, rng)
+
+    depths = variants["depths"]
+    nitrogen, helium = deco_model.surface_tensions(count)
+    current_depth = np.zeros(count)
+    violation = np.zeros(count, dtype=bool)
+    gf_high = variants["gf_high"][:, None]
+    for segment in range(depths.shape[1]):
+        target = depths[:, segment]
+        nitrogen_fraction = variants["nitrogen"][:, segment]
+        helium_fraction = variants["helium"][:, segment]
+        rate = np.where(target > current_depth, variants["descent_rate"], plan["ascent_rate"])
+        nitrogen, helium = _travel(deco_model, nitrogen, helium, current_depth, target, nitrogen_fraction,
+                                   helium_fraction, rate)
+        violation |= deco_model.ceiling(nitrogen, helium, gf_high) > target + 1e-9
+        nitrogen, helium = deco_model.load(nitrogen, helium, target, nitrogen_fraction, helium_fraction,
+                                           variants["durations"][:, segment])
+        violation |= deco_model.ceiling(nitrogen, helium, gf_high) > target + 1e-9
+        current_depth = target
+
+    # NDL and RGBM factor at the deepest segment, as _calculate_ndl and calculate_rgbm see it
+    deepest = int(np.argmax(depths[0]))
+    depth = depths[:, deepest]
+    bottom_time = np.maximum(0.01, np.round(variants["durations"][:, deepest], 2))
+    nitrogen_fraction = variants["nitrogen"][:, deepest]
+    helium_fraction = variants["helium"][:, deepest]
+    ndl = tissue_model.constant_depth_ndl(depth, bottom_time, nitrogen_fraction + helium_fraction)[0]
+    ndl = np.where(np.isinf(ndl) | (ndl > 999), 999.0, ndl)
+    rgbm_factor = compute_rgbm_factor(depth, bottom_time * 60, nitrogen_fraction, helium_fraction)
+    if plan["use_rgbm_for_ndl"]:
+        ndl = ndl / rgbm_factor
+
+    time_to_surface = np.empty(count)
+    stop_count = np.empty(count)
+    for i in range(count):
+        schedule = deco_model.schedule(nitrogen[i], helium[i], current_depth[i], variants["nitrogen"][i, -1],
+                                       variants["helium"][i, -1], variants["gf_low"][i], variants["gf_high"][i],
+                                       ascent_rate=plan["ascent_rate"])
+        time_to_surface[i] = schedule["time_to_surface"]
+        stop_count[i] = len(schedule["stops"])
+
+    return {"ndl": np.round(ndl, 2), "rgbm_factor": rgbm_factor, "time_to_surface": time_to_surface,
+            "stop_count": stop_count, "ceiling_violation": violation}
+
+
+def _perturb(plan, count, rng):
+    """Draw `count` variants of the plan; every array has one row per variant (and one column per segment)."""
+    perturbation = plan["perturbation"]
+    segments = plan["segments"]
+    shape = (count, len(segments))
+
+    def column(key):
+        return np.tile(np.array([segment[key] for segment in segments], dtype=np.float64), (count, 1))
+
+    durations = column("duration") * np.maximum(rng.normal(1.0, perturbation["bottom_time_sd"], shape), 0.0)
+    descent_rate = plan["descent_rate"] * np.maximum(rng.normal(1.0, perturbation["descent_rate_sd"], count), 0.1)
+
+    oxygen = column("oxygen_fraction")
+    inert = column("nitrogen_fraction") + column("helium_fraction")
+    tolerance = perturbation["gas_fraction_tolerance"]
+    varied_oxygen = np.clip(oxygen + rng.uniform(-tolerance, tolerance, shape), 0.0, 1.0)
+    # The inert gases fill what oxygen leaves, keeping their N₂:He ratio
+    scale = np.divide(inert - (varied_oxygen - oxygen), inert, out=np.zeros(shape), where=inert > 0)
+    scale = np.maximum(scale, 0.0)
+
+    tolerance = perturbation["gradient_factor_tolerance"]
+    gf_low = np.clip(plan["gf_low"] + rng.uniform(-tolerance, tolerance, count), 0.05, 1.0)
+    gf_high = np.clip(plan["gf_high"] + rng.uniform(-tolerance, tolerance, count), 0.05, 1.0)
+    return {
+        "depths": column("depth"),
+        "durations": durations,
+        "descent_rate": descent_rate,
+        "nitrogen": column("nitrogen_fraction") * scale,
+        "helium": column("helium_fraction") * scale,
+        "gf_low": np.minimum(gf_low, gf_high),
+        "gf_high": gf_high
+    }
+
+
+def _travel(deco_model, nitrogen, helium, start_depth, end_depth, nitrogen_fraction, helium_fraction, rate):
+    """Per-variant Schreiner loading of a depth change; variants that do not move keep their tensions."""
+    dt_minutes = np.abs(end_depth - start_depth) / rate
+    pressure_rate = np.divide(end_depth - start_depth, 10 * dt_minutes, out=np.zeros_like(dt_minutes),
+                              where=dt_minutes > 0)
+    return (deco_model.nitrogen.schreiner(nitrogen, deco_model.inspired_pressure(start_depth, nitrogen_fraction),
+                                          pressure_rate * nitrogen_fraction, dt_minutes),
+            deco_model.helium.schreiner(helium, deco_model.inspired_pressure(start_depth, helium_fraction),
+                                        pressure_rate * helium_fraction, dt_minutes))
+
+
+def _get_models(compartments):
+    """The simulator and ZH-L16C models, built once per worker process."""
+    key = json.dumps(compartments, sort_keys=True)
+    if key not in _models:
+        _models[key] = (TissueModel(compartments), ZHL16C())
+    return _models[key]
+
+
+def _distribution(values):
+    values = np.asarray(values, dtype=np.float64)
+    summary = {"mean": round(float(values.mean()), 3), "std": round(float(values.std()), 3),
+               "min": round(float(values.min()), 3), "max": round(float(values.max()), 3)}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}"] = round(float(value), 3)
+    return summary
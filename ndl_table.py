@@ -0,0 +1,192 @@
+"""
+Precomputed NDL tables for the gas mixes offered by the UI.
+
+With the compartment parameters fixed, the NDL returned by `_calculate_ndl`
+depends only on depth, time at depth and the inert gas fraction (N₂ + He), so
+for each standard mix the whole surface over 0-350 m and the bottom-time range
+can be computed once. Tables are stored as a float32 NumPy array
+(mix x depth x time) next to a JSON metadata file and loaded with mmap; lookups
+between grid points use bilinear interpolation.
+
+NDL is linear in time but climbs steeply with depth just below each
+compartment's loading threshold, where no grid is fine enough. Depth cells
+whose interpolation error exceeds CELL_TOLERANCE are recorded at build time
+and answered by the exact solver instead. The worst error of the remaining
+lookups, measured against the exact solver on random points, is stored per
+mix as `max_error`.
+
+The file name carries a fingerprint of the model parameters and grid, so
+changing either builds a new table instead of reading a stale one.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# Gas mixes offered by the frontend gas cards: (name, O₂, N₂, He)
+STANDARD_MIXES = (
+    ("Air", 0.21, 0.79, 0.0),
+    ("EANx32", 0.32, 0.68, 0.0),
+    ("EANx36", 0.36, 0.64, 0.0),
+    ("EANx40", 0.40, 0.60, 0.0),
+    ("Rebreather", 0.30, 0.70, 0.0),
+    ("Trimix", 0.18, 0.45, 0.37),
+)
+
+MAX_DEPTH = 350.0
+DEPTH_STEP = 0.25
+MAX_TIME = 300.0
+TIME_STEP = 5.0
+NDL_LIMIT = 999.0  # Same ceiling `_calculate_ndl` applies to infinite or very large NDLs
+CELL_TOLERANCE = 0.005  # Minutes; half the 0.01 min resolution NDLs are reported at
+VALIDATION_SAMPLES = 20000
+
+
+class NDLTable:
+    """Grid of clamped NDL values with bilinear lookups."""
+
+    def __init__(self, values, metadata):
+        self.values = values
+        self.metadata = metadata
+        self.depth_step = metadata["depth_step"]
+        self.time_step = metadata["time_step"]
+        self.max_depth = metadata["max_depth"]
+        self.max_time = metadata["max_time"]
+        self._mix_by_fraction = {mix["inert_fraction"]: i for i, mix in enumerate(metadata["mixes"])}
+        self._exact_cells = [frozenset(mix["exact_cells"]) for mix in metadata["mixes"]]
+
+    @classmethod
+    def build(cls, tissue_model, mixes=STANDARD_MIXES, seed=0):
+        """Solve the full grid with the exact model and record the interpolation error against it."""
+        metadata = _grid_metadata(tissue_model, mixes)
+        depths = np.arange(metadata["depth_points"]) * DEPTH_STEP
+        times = np.arange(metadata["time_points"]) * TIME_STEP
+        values = np.empty((len(mixes), len(depths), len(times)), dtype=np.float32)
+        for i, mix in enumerate(metadata["mixes"]):
+            values[i] = exact_ndl(tissue_model, depths[:, None], times[None, :], mix["inert_fraction"])
+            mix["exact_cells"] = _steep_cells(tissue_model, values[i], depths, times, mix["inert_fraction"])
+
+        table = cls(values, metadata)
+        rng = np.random.default_rng(seed)
+        for i, mix in enumerate(metadata["mixes"]):
+            sample_depths = rng.uniform(0, MAX_DEPTH, VALIDATION_SAMPLES)
+            sample_times = np.maximum(0.01, np.round(rng.uniform(0, MAX_TIME, VALIDATION_SAMPLES), 2))
+            tabulated = ~np.isin(np.minimum(sample_depths // DEPTH_STEP, len(depths) - 2), mix["exact_cells"])
+            sample_depths, sample_times = sample_depths[tabulated], sample_times[tabulated]
+            exact = np.round(exact_ndl(tissue_model, sample_depths, sample_times, mix["inert_fraction"]), 2)
+            approx = np.round(table._interpolate(i, sample_depths, sample_times), 2)
+            mix["max_error"] = round(float(np.max(np.abs(approx - exact))), 4)
+        return table
+
+    @classmethod
+    def load_or_build(cls, tissue_model, directory, mixes=STANDARD_MIXES):
+        """Memory-map the table matching the current model, building and saving it first if needed."""
+        fingerprint = _grid_metadata(tissue_model, mixes)["fingerprint"]
+        values_path, metadata_path = _paths(directory, fingerprint)
+        if os.path.exists(values_path) and os.path.exists(metadata_path):
+            try:
+                with open(metadata_path, "r") as file:
+                    metadata = json.load(file)
+                if metadata.get("fingerprint") == fingerprint:
+                    return cls(np.load(values_path, mmap_mode="r"), metadata)
+            except (OSError, ValueError):
+                pass  # Unreadable or torn files are rebuilt below
+
+        table = cls.build(tissue_model, mixes)
+        table.save(directory)
+        return cls(np.load(values_path, mmap_mode="r"), table.metadata)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        values_path, metadata_path = _paths(directory, self.metadata["fingerprint"])
+        # Write both files under temporary names first so readers never see half a table.
+        with open(values_path + ".tmp", "wb") as file:
+            np.save(file, np.ascontiguousarray(self.values))
+        with open(metadata_path + ".tmp", "w") as file:
+            json.dump(self.metadata, file, indent=4)
+        os.replace(values_path + ".tmp", values_path)
+        os.replace(metadata_path + ".tmp", metadata_path)
+
+    def mix_index(self, inert_gas_fraction):
+        """Index of the tabulated mix with this inert gas fraction, or None."""
+        return self._mix_by_fraction.get(round(inert_gas_fraction, 6))
+
+    def lookup(self, depth, time_at_depth_minutes, inert_gas_fraction):
+        """
+        Interpolated NDL in minutes, rounded like `_calculate_ndl` (without RGBM adjustment).
+        Returns None when the mix is not tabulated, the point lies outside the grid or in a
+        depth cell that must be solved exactly.
+        """
+        mix = self.mix_index(inert_gas_fraction)
+        time_at_depth_minutes = max(0.01, round(time_at_depth_minutes, 2))
+        if mix is None or not (0 <= depth <= self.max_depth and time_at_depth_minutes <= self.max_time):
+            return None
+
+        grid = self.values[mix]
+        d = depth / self.depth_step
+        t = time_at_depth_minutes / self.time_step
+        d0 = min(int(d), grid.shape[0] - 2)
+        t0 = min(int(t), grid.shape[1] - 2)
+        if d0 in self._exact_cells[mix]:
+            return None
+        fd = d - d0
+        ft = t - t0
+        value = ((1 - fd) * ((1 - ft) * float(grid[d0, t0]) + ft * float(grid[d0, t0 + 1]))
+                 + fd * ((1 - ft) * float(grid[d0 + 1, t0]) + ft * float(grid[d0 + 1, t0 + 1])))
+        return round(value, 2)
+
+    def _interpolate(self, mix, depth, time_at_depth_minutes):
+        grid = self.values[mix]
+        d = np.asarray(depth, dtype=np.float64) / self.depth_step
+        t = np.asarray(time_at_depth_minutes, dtype=np.float64) / self.time_step
+        d0 = np.clip(np.floor(d).astype(np.intp), 0, grid.shape[0] - 2)
+        t0 = np.clip(np.floor(t).astype(np.intp), 0, grid.shape[1] - 2)
+        fd = d - d0
+        ft = t - t0
+        return ((1 - fd) * (1 - ft) * grid[d0, t0] + (1 - fd) * ft * grid[d0, t0 + 1]
+                + fd * (1 - ft) * grid[d0 + 1, t0] + fd * ft * grid[d0 + 1, t0 + 1])
+
+
+def exact_ndl(tissue_model, depth, time_at_depth_minutes, inert_gas_fraction):
+    """The exact solver's NDL before rounding: infinite or very large values are clamped to NDL_LIMIT."""
+    ndl = tissue_model.constant_depth_ndl(depth, time_at_depth_minutes, inert_gas_fraction)[0]
+    return np.minimum(ndl, NDL_LIMIT)
+
+
+def _steep_cells(tissue_model, grid, depths, times, inert_gas_fraction):
+    """Depth cells where bilinear interpolation misses the exact NDL by more than CELL_TOLERANCE."""
+    worst = np.zeros(len(depths) - 1)
+    mid_times = (times[:-1] + times[1:]) / 2
+    for position in (0.25, 0.5, 0.75):
+        sample_depths = depths[:-1] + position * DEPTH_STEP
+        exact = exact_ndl(tissue_model, sample_depths[:, None], mid_times[None, :], inert_gas_fraction)
+        approx = ((1 - position) * (grid[:-1, :-1] + grid[:-1, 1:]) + position * (grid[1:, :-1] + grid[1:, 1:])) / 2
+        worst = np.maximum(worst, np.abs(exact - approx).max(axis=1))
+    return np.flatnonzero(worst > CELL_TOLERANCE).tolist()
+
+
+def _grid_metadata(tissue_model, mixes):
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "half_times": tissue_model.half_times.tolist(),
+        "m_values": tissue_model.m_values.tolist(),
+        "surface_pressure": tissue_model.surface_pressure,
+        "max_depth": MAX_DEPTH,
+        "depth_step": DEPTH_STEP,
+        "depth_points": int(round(MAX_DEPTH / DEPTH_STEP)) + 1,
+        "max_time": MAX_TIME,
+        "time_step": TIME_STEP,
+        "time_points": int(round(MAX_TIME / TIME_STEP)) + 1,
+        "mixes": [{"name": name, "oxygen_fraction": o2, "nitrogen_fraction": n2, "helium_fraction": he,
+                   "inert_fraction": round(n2 + he, 6)} for name, o2, n2, he in mixes],
+    }
+    metadata["fingerprint"] = hashlib.sha1(json.dumps(metadata, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return metadata
+
+
+def _paths(directory, fingerprint):
+    base = os.path.join(directory, f"ndl_table_v{FORMAT_VERSION}_{fingerprint}")
+    return base + ".npy", base + ".json"
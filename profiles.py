@@ -0,0 +1,144 @@
+"""
+Offline simulation of multi-level dive profiles.
+
+A profile is a list of segments, each a depth, a time to stay there and the gas
+breathed. Moving between segment depths happens at a fixed descent or ascent
+rate and loads the tissues with the Schreiner equation; the stay itself uses
+the Haldane equation. Both have closed forms for any elapsed time, so every
+sample of a phase is computed in one NumPy call from the tensions at the start
+of the phase, and the simulation never waits on the wall clock.
+"""
+import math
+
+import numpy as np
+
+MAX_DEPTH = 350.0
+
+
+def parse_segments(segments, defaults):
+    """
+    Validate a request's segment list and fill in gas fractions from `defaults`.
+    Raises ValueError with a message suitable for the API response.
+    """
+    if not isinstance(segments, list) or not segments:
+        raise ValueError("segments must be a non-empty list")
+    parsed = []
+    for number, segment in enumerate(segments, start=1):
+        if not isinstance(segment, dict):
+            raise ValueError(f"Segment {number} must be an object")
+        try:
+            depth = float(segment["depth"])
+            duration = float(segment["duration"])
+            oxygen = float(segment.get("oxygen_fraction", defaults["oxygen_fraction"]))
+            nitrogen = float(segment.get("nitrogen_fraction", defaults["nitrogen_fraction"]))
+            helium = float(segment.get("helium_fraction", defaults["helium_fraction"]))
+        except KeyError as e:
+            raise ValueError(f"Segment {number} is missing {e.args[0]}")
+        except (TypeError, ValueError):
+            raise ValueError(f"Segment {number} must contain numbers")
+        values = (depth, duration, oxygen, nitrogen, helium)
+        if not all(math.isfinite(value) for value in values):
+            raise ValueError(f"Segment {number} must contain finite numbers")
+        if not 0 <= depth <= MAX_DEPTH:
+            raise ValueError(f"Segment {number}: depth must be between 0 and {MAX_DEPTH:g} m")
+        if duration < 0:
+            raise ValueError(f"Segment {number}: duration must not be negative")
+        if min(oxygen, nitrogen, helium) < 0 or oxygen + nitrogen + helium > 1.0001:
+            raise ValueError(f"Segment {number}: gas fractions must be between 0 and 1 and sum to at most 1")
+        parsed.append({"depth": depth, "duration": duration, "oxygen_fraction": oxygen,
+                       "nitrogen_fraction": nitrogen, "helium_fraction": helium})
+    return parsed
+
+
+def sample_count(segments, interval_minutes, descent_rate, ascent_rate, start_depth=0.0):
+    """Number of timeline rows `simulate` will produce, to reject oversized requests before streaming."""
+    count = 1
+    depth = start_depth
+    for segment in segments:
+        rate = descent_rate if segment["depth"] > depth else ascent_rate
+        for minutes in (abs(segment["depth"] - depth) / rate, segment["duration"]):
+            if minutes > 0:
+                count += _interval_count(minutes, interval_minutes)
+        depth = segment["depth"]
+    return count
+
+
+def simulate(tissue_model, segments, interval_minutes, descent_rate, ascent_rate, tensions=None, start_depth=0.0):
+    """
+    Yield the timeline one phase at a time as dicts of equal-length arrays.
+
+    Each phase (travel to a segment's depth, then the stay there) is sampled every `interval_minutes`
+    and at its end. Keys: segment (1-based, 0 for the starting point), time (minutes since the start),
+    depth, time_at_depth (seconds at the current depth, 0 while travelling), the three gas fractions and
+    tensions (rows x compartments).
+    """
+    tensions = tissue_model.new_tensions() if tensions is None else np.asarray(tensions, dtype=np.float64)
+    depth = start_depth
+    elapsed = 0.0
+    first = segments[0]
+    yield _phase(0, np.zeros(1), np.full(1, depth), np.zeros(1), first, tensions[None, :])
+
+    for number, segment in enumerate(segments, start=1):
+        target = segment["depth"]
+        inert_fraction = segment["nitrogen_fraction"] + segment["helium_fraction"]
+
+        travel_minutes = abs(target - depth) / (descent_rate if target > depth else ascent_rate)
+        if travel_minutes > 0:
+            offsets = _sample_offsets(travel_minutes, interval_minutes)
+            pressure_rate = (target - depth) / 10 / travel_minutes * inert_fraction
+            start_pressure = float(tissue_model.ambient_pressure(depth)) * inert_fraction
+            rows = tissue_model.schreiner(tensions, start_pressure, pressure_rate, offsets)
+            depths = depth + (target - depth) * offsets / travel_minutes
+            yield _phase(number, elapsed + offsets, depths, np.zeros(len(offsets)), segment, rows)
+            tensions = rows[-1]
+            elapsed += travel_minutes
+            depth = target
+
+        if segment["duration"] > 0:
+            offsets = _sample_offsets(segment["duration"], interval_minutes)
+            inert_gas_pressure = float(tissue_model.ambient_pressure(depth)) * inert_fraction
+            rows = tissue_model.haldane(tensions, inert_gas_pressure, offsets)
+            yield _phase(number, elapsed + offsets, np.full(len(offsets), depth), offsets * 60, segment, rows)
+            tensions = rows[-1]
+            elapsed += segment["duration"]
+
+
+def compute_rgbm_factor(depth, time_at_depth, nitrogen_fraction, helium_fraction):
+    """
+    RGBM factor for a depth (m), time at that depth (s) and gas mix, as `calculate_rgbm` reports it.
+    Every argument may be a NumPy array.
+    """
+    # Prevent division by zero for time_at_depth
+    time_at_depth = np.maximum(time_at_depth, 0.1)
+
+    inert_gas_fraction = nitrogen_fraction + helium_fraction  # Inert gas load in the body
+    base_rgbm_factor = (1 + time_at_depth / 60) * np.exp(-np.asarray(depth, dtype=np.float64) / 100)
+
+    # Adjust RGBM factor based on the gas mix
+    gas_penalty_factor = 1 + (inert_gas_fraction - nitrogen_fraction) * 0.2  # Adjust based on inert gas fraction
+    return np.round(base_rgbm_factor * gas_penalty_factor, 5)
+
+
+def _sample_offsets(minutes, interval_minutes):
+    """Sample times within a phase: every interval, plus the end of the phase."""
+    offsets = np.arange(1, _interval_count(minutes, interval_minutes) + 1) * interval_minutes
+    offsets[-1] = minutes
+    return offsets
+
+
+def _interval_count(minutes, interval_minutes):
+    # Rounding first keeps e.g. 3.0000000001 intervals from adding a sample
+    return max(1, math.ceil(round(minutes / interval_minutes, 9)))
+
+
+def _phase(segment_number, times, depths, time_at_depth, segment, tensions):
+    return {
+        "segment": segment_number,
+        "time": times,
+        "depth": depths,
+        "time_at_depth": time_at_depth,
+        "oxygen_fraction": segment["oxygen_fraction"],
+        "nitrogen_fraction": segment["nitrogen_fraction"],
+        "helium_fraction": segment["helium_fraction"],
+        "tensions": tensions
+    }
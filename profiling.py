@@ -0,0 +1,267 @@
+"""
+On-demand CPU profiling of the requests a live server handles.
+
+The /debug/profile endpoints start a profiling session on the running server,
+so real traffic can be profiled without a restart in debug mode. A session
+covers the requests that begin while it runs, optionally only those of one
+route (URL rule, as /metrics labels them), and ends after `duration` seconds,
+after `requests` requests, at whichever comes first, or when it is stopped.
+Requests outside a session only pay one attribute check.
+
+Two profilers are available:
+
+- "cprofile": every profiled request runs under its own cProfile.Profile, and
+  the results are merged into one pstats.Stats. Exact call counts and times,
+  at the cost of slowing the profiled requests down severalfold. (On Python
+  3.12+ only one cProfile can run at a time, so requests overlapping another
+  profiled request are skipped and counted.)
+- "sampling": a thread records the stack of every thread handling a profiled
+  request each `interval` seconds. The overhead does not depend on what the
+  requests do, so timings stay realistic; times are sample counts times the
+  interval, and the "calls" in its pstats are sample counts. While requests
+  keep the GIL busy the sampler only gets to run every
+  sys.getswitchinterval() (5 ms by default), so shorter intervals add little.
+
+Results of the last session can be downloaded as a marshalled pstats file
+(read with `pstats.Stats(path)`, snakeviz, ...) and, for the sampling
+profiler, as collapsed stacks (`frame;frame;frame count` lines, the input of
+flamegraph.pl and speedscope).
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILERS = ("cprofile", "sampling")
+
+
+class _Session:
+    def __init__(self, profiler, duration, requests, route, interval):
+        self.profiler = profiler
+        self.duration = duration
+        self.max_requests = requests
+        self.route = route
+        self.interval = interval
+        self.started = time.time()
+        self.deadline = time.monotonic() + duration if duration is not None else None
+        self.stopped = None  # time.time() when the session ended
+        self.requests = 0  # Requests taken on, including ones still running
+        self.skipped = 0
+        self.active = {}  # thread ident -> cProfile.Profile (or None when sampling) of a request in progress
+        self.stats = None  # pstats.Stats merged from the finished requests (cprofile)
+        self.samples = Counter()  # stack of (filename, line, function), outermost first -> samples (sampling)
+        self.sample_count = 0
+        self.wake = threading.Event()
+
+    def accepting(self):
+        return (self.stopped is None and (self.deadline is None or time.monotonic() < self.deadline)
+                and (self.max_requests is None or self.requests < self.max_requests))
+
+
+class RequestProfiler:
+    """Runs one profiling session at a time over the requests that `begin_request`/`end_request` bracket."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None  # The running session, or the last one, whose results can be downloaded
+
+    def start(self, profiler="sampling", duration=None, requests=None, route=None, interval=0.005):
+        """
+        Start a session, replacing the results of the last one. Raises ValueError for invalid settings and
+        RuntimeError if a session is already running.
+        """
+        if profiler not in PROFILERS:
+            raise ValueError(f"profiler must be one of {', '.join(PROFILERS)}")
+        if duration is None and requests is None:
+            raise ValueError("Give a duration in seconds, a number of requests, or both")
+        if duration is not None and not duration > 0:
+            raise ValueError("duration must be positive")
+        if requests is not None and requests < 1:
+            raise ValueError("requests must be at least 1")
+        if not interval > 0:
+            raise ValueError("interval must be positive")
+        with self._lock:
+            if self._session is not None and self._running(self._session):
+                raise RuntimeError("A profiling session is already running")
+            session = self._session = _Session(profiler, duration, requests, route, interval)
+        if profiler == "sampling":
+            threading.Thread(target=self._sample, args=(session,), name="profile-sampler", daemon=True).start()
+        return self.status()
+
+    def stop(self):
+        """End the running session; requests already being profiled still finish into its results."""
+        with self._lock:
+            session = self._session
+            if session is not None and session.stopped is None:
+                session.stopped = time.time()
+                session.wake.set()
+        return self.status()
+
+    def status(self):
+        with self._lock:
+            session = self._session
+            if session is None:
+                return {"running": False}
+            running = self._running(session)
+            ended = session.stopped or time.time()
+            if not running and session.duration is not None:
+                ended = min(ended, session.started + session.duration)
+            return {
+                "running": running,
+                "profiler": session.profiler,
+                "route": session.route,
+                "duration": session.duration,
+                "max_requests": session.max_requests,
+                "interval": session.interval if session.profiler == "sampling" else None,
+                "started": session.started,
+                "elapsed": round(ended - session.started, 3),
+                "requests": session.requests - len(session.active),
+                "in_progress": len(session.active),
+                "skipped": session.skipped,
+                "samples": session.sample_count if session.profiler == "sampling" else None
+            }
+
+    def begin_request(self, route):
+        """Start profiling the calling thread's request if the session takes it; returns whether it does."""
+        session = self._session
+        if session is None or session.stopped is not None:
+            return False
+        with self._lock:
+            if self._session is not session or not session.accepting():
+                return False
+            if session.route is not None and route != session.route:
+                return False
+            ident = threading.get_ident()
+            if ident in session.active:
+                return False  # The server re-entered on this thread; the outer request covers it
+            profile = None
+            if session.profiler == "cprofile":
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:  # Another cProfile is active (Python 3.12+ allows one at a time)
+                    session.skipped += 1
+                    return False
+            session.active[ident] = profile
+            session.requests += 1
+            return True
+
+    def end_request(self):
+        """Finish profiling the calling thread's request, started by a `begin_request` that returned True."""
+        ident = threading.get_ident()
+        with self._lock:
+            session = self._session
+            if session is None or ident not in session.active:
+                return
+            profile = session.active.pop(ident)
+        if profile is None:
+            return
+        profile.disable()
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        with self._lock:
+            if session.stats is None:
+                session.stats = stats
+            else:
+                session.stats.add(stats)
+        if not session.accepting() and not session.active:
+            self._finish(session)
+
+    def pstats_data(self):
+        """The last session's results as a marshalled pstats file, or None if there are none yet."""
+        with self._lock:
+            session = self._session
+            if session is None:
+                return None
+            if session.profiler == "cprofile":
+                return marshal.dumps(session.stats.stats) if session.stats is not None else None
+            samples = dict(session.samples)
+        return marshal.dumps(_sample_stats(samples, session.interval)) if samples else None
+
+    def collapsed_stacks(self):
+        """
+        The last sampling session's stacks as `frame;frame;... count` lines, or None if there are none yet.
+        Raises ValueError for a cProfile session, which records callers but not whole stacks.
+        """
+        with self._lock:
+            session = self._session
+            if session is None:
+                return None
+            if session.profiler != "sampling":
+                raise ValueError("Collapsed stacks need the sampling profiler")
+            samples = dict(session.samples)
+        if not samples:
+            return None
+        lines = sorted(";".join(_frame_name(frame) for frame in stack) + f" {count}"
+                       for stack, count in samples.items())
+        return "\n".join(lines) + "\n"
+
+    def _running(self, session):
+        return session.stopped is None and (session.accepting() or bool(session.active))
+
+    def _finish(self, session):
+        with self._lock:
+            if session.stopped is None:
+                session.stopped = time.time()
+                session.wake.set()
+
+    def _sample(self, session):
+        while not session.wake.wait(session.interval):
+            with self._lock:
+                idents = list(session.active)
+                finished = not session.accepting() and not session.active
+            if finished:
+                self._finish(session)
+                return
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            stacks = []
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if stack:
+                    stacks.append(tuple(reversed(stack)))
+            with self._lock:
+                session.samples.update(stacks)
+                session.sample_count += len(stacks)
+
+
+def _sample_stats(samples, interval):
+    """pstats data from sampled stacks: own time from the samples a function was on top, total from all it was in."""
+    stats = {}  # function -> [samples, samples, own seconds, total seconds, {caller: [samples, samples, own, total]}]
+    for stack, count in samples.items():
+        seconds = count * interval
+        seen = set()
+        for depth, function in enumerate(stack):
+            entry = stats.setdefault(function, [0, 0, 0.0, 0.0, {}])
+            leaf = depth == len(stack) - 1
+            if leaf:
+                entry[2] += seconds
+            if function in seen:
+                continue  # Recursion: count each function once per sample
+            seen.add(function)
+            entry[0] += count
+            entry[1] += count
+            entry[3] += seconds
+            if depth:
+                edge = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                edge[0] += count
+                edge[1] += count
+                edge[2] += seconds if leaf else 0.0
+                edge[3] += seconds
+    return {function: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+            for function, (cc, nc, tt, ct, callers) in stats.items()}
+
+
+def _frame_name(frame):
+    filename, line, function = frame
+    return f"{function} ({os.path.basename(filename)}:{line})"
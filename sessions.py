@@ -0,0 +1,161 @@
+"""
+Per-client dive sessions.
+
+Every request carries a Client-UUID header, and each UUID gets its own
+DiveSession holding the diver state, tissue tensions (a NumPy array with one
+value per compartment), the ZH-L16C N₂/He tensions used for decompression
+stops, NDL smoothing, the bounded in-memory dive log (see dive_log.py) and a
+version counter that /api/v1/state exposes as its ETag. Sessions live in a
+SessionManager that is split into shards, each guarded by its own lock, so
+looking up one client never waits on another and work on one session never
+blocks a different diver.
+"""
+import threading
+import time
+import secrets
+import zlib
+from collections import OrderedDict, defaultdict
+
+from dive_log import DEFAULT_CAPACITY, DiveLogBuffer
+
+STATE_HISTORY_SIZE = 16  # State versions remembered for since= delta responses
+
+
+def new_dive_state():
+    """Return a fresh diver state at the surface, breathing air."""
+    return {
+        "depth": 0,
+        "last_depth": 0,
+        "time_elapsed": 0,
+        "time_at_depth": 0,
+        "depth_start_time": time.time(),
+        "depth_durations": defaultdict(float),  # Use defaultdict to avoid KeyErrors
+        "ndl": -999,
+        "rgbm_factor": 1.0,
+        "pressure": 1.0,
+        "oxygen_toxicity": 0.21,
+        "oxygen_fraction": 0.21,
+        "nitrogen_fraction": 0.79,
+        "helium_fraction": 0.0,
+        "selected_deco_model": "bühlmann",
+        "use_rgbm_for_ndl": False,
+        "dive_start_time": None
+    }
+
+
+class DiveSession:
+    """
+    Everything the simulator knows about one diver.
+
+    All reads and writes of a session must happen while holding `lock`. It is
+    re-entrant so helpers that lock on their own can be called from endpoints
+    that already hold it.
+    """
+
+    def __init__(self, client_uuid, tissue_model, deco_model, dive_log_capacity=DEFAULT_CAPACITY):
+        self.client_uuid = client_uuid
+        self.lock = threading.RLock()
+        self.last_seen = time.time()
+        self.state = new_dive_state()
+        self.tissue_tensions = tissue_model.new_tensions()
+        # ZH-L16C tensions, starting saturated at the surface, advanced together with tissue_tensions
+        self.nitrogen_tensions, self.helium_tensions = deco_model.surface_tensions()
+        self.last_update_time = time.time()
+        self.smoothed_ndl = 200
+        # time.time() each lazily computed /api/v1/state field was last asked for; snapshots only compute the
+        # recently read ones. Readers write it without `lock` (single assignments, where the last one wins).
+        self.state_reads = {}
+        self.dive_log = DiveLogBuffer(dive_log_capacity)
+        # Tissue loading accumulated from the dive log, advanced as entries are logged
+        self.accumulated_tensions = tissue_model.new_tensions()
+        self.accumulated_time = 0.0
+        # The same loading from the entries the dive log has evicted, where replays of the log start
+        self.evicted_tensions = tissue_model.new_tensions()
+        self.evicted_time = 0.0
+        # Bumped by every change a client can see in /api/v1/state; the epoch keeps ETags from an
+        # earlier server run (or an expired session) from matching a fresh counter
+        self.state_epoch = secrets.token_hex(4)
+        self.state_version = 1
+        self.state_snapshots = OrderedDict()  # version -> the state fields reported at that version
+        # Latest read-only /api/v1/state payload, replaced (never modified) by `refresh_state_snapshot`
+        self.state_snapshot = None
+
+    def reset_state(self):
+        """Put the diver back at the surface; tissue loading and the dive log are kept."""
+        self.state = new_dive_state()
+
+    def record_state(self, payload):
+        """
+        Remember the fields of a computed /api/v1/state payload under the current version and return that
+        version. If any field differs from what this version already reported, the version is bumped first,
+        so each version stands for one set of values that since= deltas can be computed against.
+        """
+        snapshot = self.state_snapshots.get(self.state_version)
+        if snapshot is not None and any(key in snapshot and snapshot[key] != value for key, value in payload.items()):
+            self.state_version += 1
+            snapshot = None
+        if snapshot is None:
+            snapshot = self.state_snapshots[self.state_version] = {}
+            while len(self.state_snapshots) > STATE_HISTORY_SIZE:
+                self.state_snapshots.popitem(last=False)
+        snapshot.update(payload)
+        return self.state_version
+
+
+class SessionManager:
+    """
+    Thread-safe registry of DiveSession objects keyed by Client-UUID.
+
+    The registry is split into `shard_count` dictionaries, each with its own
+    lock. The lock is only taken to create a session; lookups of existing
+    sessions are plain dictionary reads.
+    """
+
+    def __init__(self, session_factory, shard_count=64):
+        self._session_factory = session_factory
+        self._shards = [({}, threading.Lock()) for _ in range(shard_count)]
+
+    def _shard(self, client_uuid):
+        return self._shards[zlib.crc32(client_uuid.encode("utf-8")) % len(self._shards)]
+
+    def get(self, client_uuid):
+        """Return the session for `client_uuid`, creating it on first use."""
+        sessions, lock = self._shard(client_uuid)
+        session = sessions.get(client_uuid)
+        if session is None:
+            with lock:
+                session = sessions.get(client_uuid)
+                if session is None:
+                    session = self._session_factory(client_uuid)
+                    sessions[client_uuid] = session
+        session.last_seen = time.time()
+        return session
+
+    def discard(self, client_uuid):
+        sessions, lock = self._shard(client_uuid)
+        with lock:
+            sessions.pop(client_uuid, None)
+
+    def expire_idle(self, max_idle_seconds, keep=()):
+        """Drop sessions that have not been used for `max_idle_seconds`; returns how many were removed."""
+        cutoff = time.time() - max_idle_seconds
+        removed = 0
+        for sessions, lock in self._shards:
+            with lock:
+                stale = [uuid for uuid, session in sessions.items()
+                         if session.last_seen < cutoff and uuid not in keep]
+                for uuid in stale:
+                    del sessions[uuid]
+                removed += len(stale)
+        return removed
+
+    def all(self):
+        """Snapshot of every live session, safe to iterate while other threads add sessions."""
+        result = []
+        for sessions, lock in self._shards:
+            with lock:
+                result.extend(sessions.values())
+        return result
+
+    def __len__(self):
+        return sum(len(sessions) for sessions, _ in self._shards)
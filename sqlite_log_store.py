@@ -0,0 +1,143 @@
+"""
+SQLite backend for the per-client dive logs.
+
+All clients share one table, so queries across clients, by time range or by
+depth are a single indexed SELECT instead of opening and parsing one file per
+client. Each entry is kept verbatim as JSON next to the columns used for
+lookups (client, timestamp, depth, total time). Entries without a timestamp
+are stored under the time they were saved, which time filters then use.
+
+The database runs in WAL mode, so readers never block the writer. sqlite3
+connections must not be shared between threads, so every thread that touches
+the store gets its own connection. The SQL strings are constants with
+parameters, so each connection's statement cache prepares them once and reuses
+them. `append_many` inserts a whole batch in one transaction.
+"""
+import base64
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from log_store import LogStore
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS dive_log (
+        id INTEGER PRIMARY KEY,
+        client_uuid TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        depth REAL,
+        total_time REAL,
+        entry TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS dive_log_client_timestamp ON dive_log (client_uuid, timestamp)",
+)
+_INSERT = "INSERT INTO dive_log (client_uuid, timestamp, depth, total_time, entry) VALUES (?, ?, ?, ?, ?)"
+_SELECT_CLIENT = "SELECT timestamp, id, entry FROM dive_log WHERE client_uuid = ?"
+
+
+class SQLiteLogStore(LogStore):
+    """Dive logs of every client in one SQLite database at `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")  # Persistent: stored in the database file
+        with connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        """This thread's connection, opened on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, cached_statements=64)
+            connection.execute("PRAGMA synchronous=NORMAL")  # Durable across crashes of the process in WAL mode
+            self._local.connection = connection
+        return connection
+
+    def location(self, client_uuid):
+        return self.path
+
+    def ensure(self, client_uuid):
+        pass  # The schema is created when the store opens
+
+    def version(self, client_uuid):
+        # Commits land in the WAL until a checkpoint moves them to the database, so watch both files. Any
+        # client's write changes this, which only costs the other clients a cache reload.
+        version = []
+        for path in (self.path, self.path + "-wal"):
+            try:
+                stat = os.stat(path)
+                version.extend((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                version.extend((0, 0))
+        return tuple(version)
+
+    def append_many(self, client_uuid, entries, sync=False):
+        rows = [_row(client_uuid, entry) for entry in entries]
+        connection = self._connection()
+        if sync:
+            connection.execute("PRAGMA synchronous=FULL")  # Sync the WAL on this commit
+        try:
+            with connection:  # One transaction for the whole batch
+                connection.executemany(_INSERT, rows)
+        finally:
+            if sync:
+                connection.execute("PRAGMA synchronous=NORMAL")
+        return sum(len(row[-1]) for row in rows)
+
+    def scan(self, client_uuid, after=None, start=None, end=None, min_depth=None, max_depth=None):
+        # Keyset pagination on (timestamp, id), the order of the (client_uuid, timestamp) index
+        sql = [_SELECT_CLIENT]
+        parameters = [client_uuid]
+        if after is not None:
+            sql.append("AND (timestamp, id) > (?, ?)")
+            parameters.extend(_decode_cursor(after))
+        for condition, value in (("timestamp >= ?", start), ("timestamp <= ?", end),
+                                 ("depth >= ?", min_depth), ("depth <= ?", max_depth)):
+            if value is not None:
+                sql.append("AND " + condition)
+                parameters.append(value)
+        sql.append("ORDER BY timestamp, id")
+        for timestamp, row_id, line in self._connection().execute(" ".join(sql), parameters):
+            yield _encode_cursor(timestamp, row_id), line, json.loads(line)
+
+    def close(self):
+        """Close the calling thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def _row(client_uuid, entry):
+    # Entries without a timestamp sort by the time they were stored
+    timestamp = entry.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return (client_uuid, str(timestamp), _number(entry.get("depth")),
+            _number(entry.get("total_time", entry.get("time_elapsed"))),
+            json.dumps(entry, separators=(",", ":")))
+
+
+def _encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(timestamp), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,125 @@
+"""
+Server-Sent Events fan-out of per-client dive state.
+
+Browsers subscribe to a client UUID and get a queue. One ticker thread wakes
+every `interval` seconds, computes the state of each subscribed client once,
+serializes it once, and puts it in every subscriber's queue, but only when it
+differs from the last snapshot sent for that client. Any number of
+subscribers therefore costs one state computation per client per tick.
+
+Each open stream holds a server thread, so the app has to run under a
+threaded (or gevent) server; main.py also ends every stream after
+STATE_STREAM_MAX_AGE seconds and the browser reconnects.
+"""
+import json
+import queue
+import threading
+import time
+
+from tracing import tracer
+
+_QUEUE_SIZE = 8  # Snapshots buffered per subscriber; a slow reader drops the oldest
+
+# Sent during quiet periods. A named event rather than an SSE comment, which EventSource never shows to scripts,
+# so the page can tell a quiet stream from a stuck one.
+HEARTBEAT = "event: heartbeat\ndata: {}\n\n"
+
+
+class StateBroadcaster:
+    """Shares one state computation per client and tick among all of its SSE subscribers."""
+
+    def __init__(self, compute_state, interval=1.0):
+        self._compute_state = compute_state
+        self.interval = interval
+        self._subscribers = {}  # client_uuid -> set of queues
+        self._last_snapshot = {}  # client_uuid -> (event id, serialized state)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.ticks = 0
+        self.published = 0
+
+    def subscribe(self, client_uuid):
+        """Register a subscriber and return its queue, primed with the client's latest snapshot."""
+        subscriber = queue.Queue(maxsize=_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(client_uuid, set()).add(subscriber)
+            snapshot = self._last_snapshot.get(client_uuid)
+            if self._thread is None:
+                # Started on first use so it also runs under servers that never execute main.py's __main__ block
+                self._thread = threading.Thread(target=self._run, name="state-stream", daemon=True)
+                self._thread.start()
+        if snapshot is not None:
+            subscriber.put(snapshot)
+        else:
+            self._publish(client_uuid)  # Delivers the first snapshot to this subscriber too
+        return subscriber
+
+    def unsubscribe(self, client_uuid, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(client_uuid)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[client_uuid]
+                self._last_snapshot.pop(client_uuid, None)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def tick(self):
+        """Compute and fan out the state of every client that has subscribers."""
+        with self._lock:
+            client_uuids = list(self._subscribers)
+        for client_uuid in client_uuids:
+            self._publish(client_uuid)
+        self.ticks += 1
+
+    def _publish(self, client_uuid):
+        try:
+            data = json.dumps(self._compute_state(client_uuid), sort_keys=True)
+        except Exception as e:
+            tracer.error("state_stream.failed", "❌ State stream for {client_uuid} failed: {error}",
+                         client_uuid=client_uuid, error=str(e))
+            return None
+
+        with self._lock:
+            subscribers = self._subscribers.get(client_uuid)
+            if not subscribers:
+                return None
+            last = self._last_snapshot.get(client_uuid)
+            if last is not None and last[1] == data:
+                return last
+            snapshot = ((last[0] + 1) if last else 1, data)
+            self._last_snapshot[client_uuid] = snapshot
+            subscribers = list(subscribers)
+        for subscriber in subscribers:
+            _offer(subscriber, snapshot)
+        self.published += 1
+        return snapshot
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            self.tick()
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+def _offer(subscriber, snapshot):
+    """Queue a snapshot without blocking the ticker, dropping the oldest one if the reader is behind."""
+    while True:
+        try:
+            subscriber.put_nowait(snapshot)
+            return
+        except queue.Full:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def format_event(snapshot):
+    """One SSE message for a (event id, serialized state) snapshot."""
+    event_id, data = snapshot
+    return f"id: {event_id}\ndata: {data}\n\n"
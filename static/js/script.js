@@ -27,10 +27,60 @@ function updateTimers() {
   const depthTimeEl = document.getElementById("depth-time");
   if (timeEl) timeEl.innerText = elapsedTime;
   if (depthTimeEl) depthTimeEl.innerText = timeAtDepth;
-  fetchNDL();
+  // The state stream pushes updates on its own; poll only while it is unavailable
+  checkStateStream();
+  if (!stateStreamConnected) fetchNDL();
 }
 setInterval(updateTimers, 1000);
 
+// ----- Live State Stream (Server-Sent Events) -----
+// The server sends a message or heartbeat at least every STATE_STREAM_HEARTBEAT (15 s); a stream silent for
+// longer than this is stuck (e.g. behind a buffering proxy) and is dropped in favour of polling.
+const STATE_STREAM_STALE_MS = 40000;
+const STATE_STREAM_RETRY_MS = 60000; // Wait before opening a new stream after dropping a stuck one
+let stateStream = null;
+let stateStreamConnected = false;
+let stateStreamLastEvent = 0;
+
+function startStateStream() {
+  if (!window.EventSource) {
+    console.warn("⚠️ EventSource not supported, polling /api/v1/state instead.");
+    return;
+  }
+  const stream = stateStream = new EventSource(`/api/v1/state/stream?client_uuid=${encodeURIComponent(clientUUID)}`);
+  stream.onopen = () => {
+    stateStreamConnected = true;
+    stateStreamLastEvent = Date.now();
+    console.log("📡 State stream connected");
+  };
+  stream.onmessage = event => {
+    stateStreamLastEvent = Date.now();
+    try {
+      renderNDL(JSON.parse(event.data));
+    } catch (error) {
+      console.error("🚨 Error parsing state stream message:", error);
+    }
+  };
+  stream.addEventListener("heartbeat", () => {
+    stateStreamLastEvent = Date.now();
+  });
+  stream.onerror = () => {
+    // EventSource reconnects by itself (the server also ends streams periodically); poll until it does
+    stateStreamConnected = false;
+    console.warn("⚠️ State stream interrupted, falling back to polling.");
+  };
+}
+
+function checkStateStream() {
+  if (!stateStreamConnected || Date.now() - stateStreamLastEvent < STATE_STREAM_STALE_MS) return;
+  console.warn("⚠️ State stream went silent, polling instead.");
+  stateStream.close();
+  stateStream = null;
+  stateStreamConnected = false;
+  setTimeout(startStateStream, STATE_STREAM_RETRY_MS);
+}
+startStateStream();
+
 // ----- Utility: UUID Generation -----
 function generateUUID() {
   if (window.crypto && crypto.randomUUID) {
@@ -230,7 +280,7 @@ function logDiveData(data) {
 }
 
 function resetSimulation() {
-  fetch('/api/v1//reset', { method: "POST" })
+  fetch('/api/v1//reset', { method: "POST", headers })
     .then(() => {
       const logList = document.getElementById("dive-log");
       if (logList) logList.innerHTML = "";
@@ -343,7 +393,7 @@ function renderNDLPage(state) {
 }
 
 function fetchStateAndEnableRGBM() {
-    fetch('/api/v1/state')
+    fetch('/api/v1/state', { headers })
     .then(response => response.json())
     .then(state => {
         document.getElementById("ndl-value").textContent = state.ndl.toFixed(2);
@@ -366,7 +416,7 @@ function toggleRGBM() {
 
     fetch('/api/v1/toggle-rgbm-ndl', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers,
         body: JSON.stringify({ use_rgbm: useRGBM }) // Send the updated state
     })
     .then(response => response.json())
@@ -464,6 +514,7 @@ function updateDecoOutput() {
     fetch("/api/v1/decompression_stops", {
         method: "POST",
         headers: {
+            "Client-UUID": clientUUID,
             "Content-Type": "application/json"
         },
         body: JSON.stringify(requestData)
@@ -630,9 +681,14 @@ function updateNDL(ndlValue) {
 
 // ----- Fetch NDL Data -----
 function fetchNDL() {
-  fetch('/api/v1/state')
+  // Only the fields renderNDL shows, to keep the 1 Hz poll small
+  fetch('/api/v1/state?fields=ndl,accumulated_ndl,rgbm_factor,oxygen_toxicity', { headers })
     .then(response => response.json())
-    .then(state => {
+    .then(renderNDL)
+    .catch(error => console.error("Error fetching NDL:", error));
+}
+
+function renderNDL(state) {
         try {
           if (document.getElementById("ndl-value")) {
             document.getElementById("ndl-value").textContent = state.ndl?.toFixed(2) ?? "N/A";
@@ -660,8 +716,6 @@ function fetchNDL() {
         } catch (error) {
           console.error("🚨 Error updating UI elements:", error);
         }
-    })
-    .catch(error => console.error("Error fetching NDL:", error));
 }
 
 // ----- DOMContentLoaded: Attach Listeners & Initialize -----
@@ -681,7 +735,7 @@ document.addEventListener("DOMContentLoaded", function () {
       // Send selected model to backend
       fetch("/api/v1/set-deco-model", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers,
         body: JSON.stringify({ deco_model: this.value }),
       })
         .then((response) => {
@@ -813,7 +867,7 @@ let isFetchingState = false;
 function fetchStateAndUpdate() {
   if (isFetchingState) return;
   isFetchingState = true;
-  fetch('/api/v1/state')
+  fetch('/api/v1/state', { headers })
     .then(response => response.json())
     .then(state => {
       updateNDLContainer(state);
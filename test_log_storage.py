@@ -0,0 +1,174 @@
+"""
+Offline tests of the dive log storage (log_store.py, log_archive.py, log_cache.py). Unlike test_api.py they need
+no running server: python -m pytest test_log_storage.py
+"""
+import json
+import os
+
+import pytest
+
+import log_archive
+import log_store
+from log_cache import CachedLogStore
+
+CLIENT = "diver"
+
+
+def entry(second, depth):
+    return {"timestamp": f"2025-01-01 10:00:{second:02d}", "depth": depth}
+
+
+# Two finished dives (each ends back at depth 0) and one in progress
+DIVES = [entry(0, 0), entry(1, 10), entry(2, 20), entry(3, 0),
+         entry(4, 5), entry(5, 15), entry(6, 0),
+         entry(7, 3), entry(8, 4)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return log_store.NDJSONLogStore(str(tmp_path / "logs"))
+
+
+def seconds(rows):
+    return [row[2]["timestamp"][-2:] for row in rows]
+
+
+def test_cursor_issued_before_compaction_continues_after_it(store):
+    store.append_many(CLIENT, DIVES)
+    cursors = [cursor for cursor, _, _ in store.scan(CLIENT)]
+
+    assert log_archive.compact_log(store.location(CLIENT)) == 2
+    # Entries left in the log keep their cursors
+    assert [cursor for cursor, _, _ in store.scan(CLIENT)] == cursors[-2:]
+    assert seconds(store.scan(CLIENT, after=cursors[6])) == ["07", "08"]
+    assert seconds(store.scan(CLIENT, after=cursors[7])) == ["08"]
+    # A cursor into the archived dives continues with the first entry still in the log
+    assert seconds(store.scan(CLIENT, after=cursors[2])) == ["07", "08"]
+
+    store.append_many(CLIENT, [entry(9, 0), entry(10, 2)])
+    assert log_archive.compact_log(store.location(CLIENT)) == 1
+    assert seconds(store.scan(CLIENT, after=cursors[7])) == ["10"]
+    assert seconds(store.scan(CLIENT, after=cursors[8])) == ["10"]
+
+
+def test_cursor_stays_valid_while_a_compaction_is_interrupted(store, monkeypatch):
+    store.append_many(CLIENT, DIVES)
+    path = store.location(CLIENT)
+    cursors = [cursor for cursor, _, _ in store.scan(CLIENT)]
+
+    # The index is written, but the crash comes before the shorter log replaces the old one
+    def crash(source, destination):
+        raise OSError("crashed")
+    monkeypatch.setattr(log_archive.os, "replace", crash)
+    with pytest.raises(OSError):
+        log_archive.compact_log(path)
+    monkeypatch.undo()
+
+    assert [cursor for cursor, _, _ in store.scan(CLIENT)] == cursors
+    log_archive.compact_log(path)
+    assert seconds(store.scan(CLIENT, after=cursors[7])) == ["08"]
+
+
+def test_invalid_cursors_are_rejected(store):
+    store.append_many(CLIENT, DIVES)
+    last = int([cursor for cursor, _, _ in store.scan(CLIENT)][-1])
+    for cursor in ("abc", "-5", str(last + 1), str(last - 1)):
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            list(store.scan(CLIENT, after=cursor))
+
+
+def test_append_drops_a_torn_last_line(tmp_path):
+    path = str(tmp_path / "torn.ndjson")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(json.dumps(entry(0, 0)) + "\n" + '{"timestamp": "2025-01-01 10:00:01", "de')
+
+    # Readers skip the torn line
+    assert list(log_store.iter_entries(path)) == [entry(0, 0)]
+    log_store.append_entry(path, entry(2, 5))
+    assert list(log_store.iter_entries(path)) == [entry(0, 0), entry(2, 5)]
+    with open(path, encoding="utf-8") as file:
+        assert all(json.loads(line) for line in file)
+
+
+def test_repair_restores_a_missing_final_newline(tmp_path):
+    path = str(tmp_path / "unterminated.ndjson")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(json.dumps(entry(0, 0)))
+
+    assert log_store.repair(path) is False
+    log_store.append_entry(path, entry(1, 5))
+    assert list(log_store.iter_entries(path)) == [entry(0, 0), entry(1, 5)]
+
+
+def test_interrupted_compaction_does_not_archive_twice(store, monkeypatch):
+    store.append_many(CLIENT, DIVES)
+    path = store.location(CLIENT)
+
+    def crash(source, destination):
+        raise OSError("crashed")
+    monkeypatch.setattr(log_archive.os, "replace", crash)
+    with pytest.raises(OSError):
+        log_archive.compact_log(path)
+    monkeypatch.undo()
+    os.remove(path + ".tmp")
+
+    # The log still holds the dives the crashed run archived; the next run only rewrites it
+    assert log_archive.compact_log(path) == 0
+    assert [row["dive"] for row in log_archive.read_index(path)] == [1, 2]
+    assert log_archive.read_dive(path, 1) == DIVES[:4]
+    assert log_archive.read_dive(path, 2) == DIVES[4:7]
+    assert list(store.iter_entries(CLIENT)) == DIVES[7:]
+
+
+def test_retention_down_to_zero_keeps_the_dive_numbering(store):
+    store.append_many(CLIENT, DIVES)
+    path = store.location(CLIENT)
+    log_archive.compact_log(path)
+
+    assert log_archive.apply_retention(path, max_bytes=0) == 2
+    assert log_archive.read_index(path) == []
+    with pytest.raises(KeyError):
+        log_archive.read_dive(path, 1)
+
+    store.append_many(CLIENT, [entry(9, 0)])
+    assert log_archive.compact_log(path) == 1
+    assert [row["dive"] for row in log_archive.read_index(path)] == [3]
+    assert log_archive.read_dive(path, 3) == DIVES[7:] + [entry(9, 0)]
+
+
+def test_retention_by_age_keeps_recent_dives_readable(store):
+    from datetime import datetime
+
+    store.append_many(CLIENT, DIVES)
+    path = store.location(CLIENT)
+    log_archive.compact_log(path)
+
+    # Dive 1 ended at 10:00:03 and dive 2 at 10:00:06; only the first is over a day old at this point
+    now = datetime(2025, 1, 2, 10, 0, 5)
+    assert log_archive.apply_retention(path, max_age_days=1, now=now) == 1
+    assert [row["dive"] for row in log_archive.read_index(path)] == [2]
+    assert log_archive.read_dive(path, 2) == DIVES[4:7]
+
+
+def test_cache_is_filled_by_full_reads_only(store):
+    store.append_many(CLIENT, DIVES)
+    cache = CachedLogStore(store)
+    first_page = list(zip(range(2), cache.scan(CLIENT)))
+    assert len(first_page) == 2 and cache.stats()["clients"] == 0
+
+    assert list(cache.iter_entries(CLIENT)) == DIVES
+    assert cache.stats()["clients"] == 1
+    cursor = list(store.scan(CLIENT))[4][0]
+    assert seconds(cache.scan(CLIENT, after=cursor)) == ["05", "06", "07", "08"]
+    assert cache.stats()["hits"] == 1
+
+    cache.append_many(CLIENT, [entry(9, 0)])
+    assert list(cache.iter_entries(CLIENT))[-1] == entry(9, 0)
+
+
+def test_cache_does_not_keep_logs_over_its_budget(store):
+    store.append_many(CLIENT, DIVES)
+    cache = CachedLogStore(store, max_bytes=100)
+    assert list(cache.iter_entries(CLIENT)) == DIVES
+    assert list(cache.iter_json_lines(CLIENT)) == [json.dumps(row, separators=(",", ":")) for row in DIVES]
+    assert cache.stats()["clients"] == 0 and cache.stats()["bytes"] == 0
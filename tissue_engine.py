@@ -0,0 +1,137 @@
+"""
+Array-backed Bühlmann tissue engine.
+
+The compartment table (half-times, k constants, M-values and optional a/b
+coefficients) is held as contiguous float arrays so Haldane updates and NDL
+solves run for every compartment in one NumPy call instead of a Python loop.
+Tissue tensions are 1-D arrays of shape (compartments,) for a single diver or
+2-D arrays of shape (sessions, compartments) to update many divers at once;
+per-diver scalars (inert gas pressure, time step, depth) broadcast as arrays of
+shape (sessions,).
+"""
+import math
+
+import numpy as np
+
+LN2 = math.log(2)
+
+
+class TissueModel:
+    """Compartment parameters of a Bühlmann-style model as NumPy arrays."""
+
+    def __init__(self, compartments, surface_pressure=1.0):
+        self.surface_pressure = surface_pressure
+        self.ids = tuple(tissue["tissue"] for tissue in compartments)
+        self.half_times = np.array([tissue["half_time"] for tissue in compartments], dtype=np.float64)
+        self.k = LN2 / self.half_times
+        self.m_values = np.array([tissue.get("M-value", 1.0) for tissue in compartments], dtype=np.float64)
+        # Bühlmann coefficients are optional; compartments without them fall back to the M-value.
+        self.a = np.array([tissue.get("a", np.nan) for tissue in compartments], dtype=np.float64)
+        self.b = np.array([tissue.get("b", np.nan) for tissue in compartments], dtype=np.float64)
+        self.has_ab = ~(np.isnan(self.a) | np.isnan(self.b))
+        self.max_tensions = self.m_values * surface_pressure
+
+    def __len__(self):
+        return len(self.ids)
+
+    def new_tensions(self, sessions=None):
+        """Unloaded tissue tensions for one diver, or a (sessions, compartments) block."""
+        shape = len(self) if sessions is None else (sessions, len(self))
+        return np.zeros(shape, dtype=np.float64)
+
+    def as_dict(self, tensions):
+        """Map compartment id -> tension, the shape the JSON API has always returned."""
+        return dict(zip(self.ids, np.asarray(tensions, dtype=np.float64).tolist()))
+
+    def ambient_pressure(self, depth):
+        """Ambient pressure in ATA (1 atm at the surface plus 1 atm per 10 m)."""
+        return self.surface_pressure + np.asarray(depth, dtype=np.float64) / 10
+
+    def haldane(self, tensions, inert_gas_pressure, dt_minutes):
+        """
+        Load every compartment at constant ambient pressure:
+            P(t+Δt) = P_A + (P(t) - P_A)*exp(-k*Δt)
+        `inert_gas_pressure` and `dt_minutes` are scalars, or one value per row of a 2-D `tensions`.
+        """
+        inert_gas_pressure = _per_row(inert_gas_pressure)
+        dt_minutes = _per_row(dt_minutes)
+        return inert_gas_pressure + (tensions - inert_gas_pressure) * np.exp(-self.k * dt_minutes)
+
+    def schreiner(self, tensions, start_inert_pressure, rate, dt_minutes):
+        """
+        Load every compartment while the inert gas pressure changes linearly by `rate` ATA/min:
+            P(t+Δt) = P_A0 + R*(Δt - 1/k) - (P_A0 - P(t) - R/k)*exp(-k*Δt)
+        Reduces to the Haldane equation when `rate` is 0.
+        """
+        start_inert_pressure = _per_row(start_inert_pressure)
+        rate = _per_row(rate)
+        dt_minutes = _per_row(dt_minutes)
+        return (start_inert_pressure + rate * (dt_minutes - 1 / self.k)
+                - (start_inert_pressure - tensions - rate / self.k) * np.exp(-self.k * dt_minutes))
+
+    def remaining_times(self, tensions, depth):
+        """
+        Per-compartment time left at `depth` before the tension reaches its limit:
+            Δt = -1/k * ln((P_A - p_max) / (P_A - P_current))
+        p_max is (P_A - a) / b for compartments with Bühlmann coefficients, the M-value otherwise.
+        Compartments whose limit cannot be solved (denominator <= 0 or a non-positive ratio) give 0.
+        """
+        ambient_pressure = _per_row(self.ambient_pressure(depth))
+        p_max = self.max_tensions
+        if self.has_ab.any():
+            p_max = np.where(self.has_ab, (ambient_pressure - self.a) / self.b, p_max)
+        numerator = ambient_pressure - p_max
+        denominator = ambient_pressure - tensions
+        positive = denominator > 0
+        ratio = np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                          where=positive)
+        solvable = ratio > 0
+        times = np.log(ratio, out=np.zeros_like(ratio), where=solvable)
+        return np.divide(times, -self.k, out=times, where=solvable)
+
+    def tension_ndl(self, tensions, depth):
+        """
+        NDL from current tensions: the sum of the negative compartment times if any tissue is over
+        its limit, otherwise the smallest remaining time. One value per diver.
+        """
+        return combine_ndl(self.remaining_times(tensions, depth))
+
+    def constant_depth_ndl(self, depth, time_at_depth_minutes, inert_gas_fraction):
+        """
+        NDL for a square profile from unloaded tissues, the model behind `_calculate_ndl`.
+
+        For every compartment the time to reach its M-value at the inert gas pressure of `depth` is
+            ln(1 - M / P_inert) / -k
+        minus the time already spent there. Compartments that never reach their M-value are skipped.
+        All arguments broadcast, so arrays of depths/times/fractions are solved in one call.
+
+        Returns (ndl, limiting_index, compartment_ndl): ndl is +inf and limiting_index -1 where no
+        compartment limits the dive.
+        """
+        inert_gas_pressure = _per_row(self.ambient_pressure(depth) * np.asarray(inert_gas_fraction, dtype=np.float64))
+        shape = np.broadcast(inert_gas_pressure, self.max_tensions).shape
+        # A zero inert gas pressure never loads a tissue: its ratio stays infinite and the compartment is skipped.
+        log_arg = 1 - np.divide(self.max_tensions, inert_gas_pressure, out=np.full(shape, np.inf),
+                                where=inert_gas_pressure != 0)
+        limiting = log_arg > 0
+        compartment_ndl = np.log(log_arg, out=np.full(shape, -np.inf), where=limiting)
+        compartment_ndl /= -self.k
+        compartment_ndl = compartment_ndl - _per_row(time_at_depth_minutes)
+        ndl = compartment_ndl.min(axis=-1)
+        limiting_index = np.where(np.isinf(ndl), -1, compartment_ndl.argmin(axis=-1))
+        return ndl, limiting_index, compartment_ndl
+
+
+def combine_ndl(compartment_times):
+    """Sum of negative compartment times if any are negative, else the minimum, along the last axis."""
+    compartment_times = np.asarray(compartment_times, dtype=np.float64)
+    minimum = compartment_times.min(axis=-1)
+    if compartment_times.ndim == 1:
+        return compartment_times[compartment_times < 0].sum() if minimum < 0 else minimum
+    return np.where(minimum < 0, np.minimum(compartment_times, 0.0).sum(axis=-1), minimum)
+
+
+def _per_row(value):
+    """Give per-diver values a trailing axis so they broadcast against (sessions, compartments)."""
+    value = np.asarray(value, dtype=np.float64)
+    return value[..., None] if value.ndim else value
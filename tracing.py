@@ -0,0 +1,132 @@
+"""
+Level-gated structured event tracing.
+
+Code reports what it does as named events with keyword fields instead of
+printing formatted strings:
+
+    tracer.debug("ndl.result", "✅ Final Computed NDL: {ndl:.2f} minutes", ndl=ndl)
+
+An event below the tracer's level returns after one comparison: the message
+template is never formatted and nothing is written, so debug events can stay
+in hot paths. Loops that emit an event per tissue check `sampled` once per
+call first, and that check is where verbose events are sampled: an event name
+with a rate in `sample_rates` passes it in only that fraction of the calls.
+
+Enabled events go to a sink. ConsoleSink prints the formatted message, as the
+old print() calls did; JSONSink writes one JSON object per event (time, level,
+event name, fields) to a file or stream for log shippers. main.py configures
+the shared `tracer` from the TRACE_* settings.
+"""
+import json
+import random
+import sys
+import threading
+import time
+import traceback
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR, "off": OFF}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+
+class ConsoleSink:
+    """Prints each event's formatted message to stdout."""
+
+    def emit(self, level, name, message, fields, exc_text):
+        if message is None:
+            text = f"{name} {fields}" if fields else name
+        else:
+            try:
+                text = message.format(**fields)
+            except (KeyError, IndexError, ValueError) as e:
+                text = f"{message} {fields} (format error: {e})"
+        print(text)
+        if exc_text:
+            print(exc_text, end="")
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+class JSONSink:
+    """Writes one JSON object per event to `path` (appended) or to a stream, stdout by default."""
+
+    def __init__(self, path=None, stream=None):
+        self._file = open(path, "a", encoding="utf-8") if path else (stream or sys.stdout)
+        self._lock = threading.Lock()
+
+    def emit(self, level, name, message, fields, exc_text):
+        record = {"ts": round(time.time(), 6), "level": LEVEL_NAMES.get(level, level), "event": name}
+        record.update(fields)
+        if exc_text:
+            record["exception"] = exc_text
+        line = json.dumps(record, default=str, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            if level >= WARNING:
+                self._file.flush()
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+
+class Tracer:
+    """Routes events at or above `level` to `sink`, sampling the event names listed in `sample_rates`."""
+
+    def __init__(self, level=INFO, sink=None, sample_rates=None):
+        self.level = level
+        self.sink = sink or ConsoleSink()
+        self.sample_rates = dict(sample_rates or {})
+
+    def configure(self, level=None, sink=None, sample_rates=None):
+        if level is not None:
+            self.level = LEVELS[level] if isinstance(level, str) else level
+        if sink is not None:
+            self.sink = sink
+        if sample_rates is not None:
+            self.sample_rates = dict(sample_rates)
+
+    def flush(self):
+        self.sink.flush()
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def sampled(self, level, name):
+        """Whether an event `name` at `level` would be traced on this call, after sampling."""
+        if level < self.level:
+            return False
+        rate = self.sample_rates.get(name)
+        return rate is None or random.random() < rate
+
+    def event(self, level, name, message=None, exc_info=False, **fields):
+        """Trace an event; `message` is a str.format template over the fields, used by ConsoleSink."""
+        if level < self.level:
+            return
+        self.sink.emit(level, name, message, fields, traceback.format_exc() if exc_info else None)
+
+    def debug(self, name, message=None, **fields):
+        if DEBUG >= self.level:
+            self.event(DEBUG, name, message, **fields)
+
+    def info(self, name, message=None, **fields):
+        if INFO >= self.level:
+            self.event(INFO, name, message, **fields)
+
+    def warning(self, name, message=None, **fields):
+        if WARNING >= self.level:
+            self.event(WARNING, name, message, **fields)
+
+    def error(self, name, message=None, exc_info=False, **fields):
+        if ERROR >= self.level:
+            self.event(ERROR, name, message, exc_info, **fields)
+
+
+# Shared by every module; main.py sets its level, sink and sample rates
+tracer = Tracer()